@@ -0,0 +1,535 @@
+#!/usr/bin/python3
+"""
+Perfservmon benchmarks, run from a checkout: python perfservbench.py <benchmark> ...
+"""
+
+import argparse
+import json
+import os
+import py_compile
+import random
+import shelve
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dbm import whichdb
+
+import perfservcore
+import perfservshow
+
+
+def makeserver(nodename, servername, rng):
+    """
+    A WAS server with typical metric values
+    :param nodename: WAS Node Name
+    :param servername: WAS Server Name
+    :param rng: random.Random instance
+    :return: A TypicalApplicationServer instance
+    """
+    was = perfservcore.TypicalApplicationServer(servername, nodename)
+    was.maxheapMB = 2048
+    was.heapusedMB = rng.randint(100, 2048)
+    was.wcpoolsize = '50'
+    was.wcactive = str(rng.randint(0, 50))
+    was.wcthreadshung = str(rng.randint(0, 2))
+    was.orbpoolsize = '50'
+    was.orbactive = str(rng.randint(0, 50))
+    was.webSecAuthenTime = rng.randint(0, 5)
+    was.webSecAuthorTime = rng.randint(0, 5)
+    for i in range(3):
+        jndiname = 'jdbc/DataSource{}'.format(i)
+        was.addjdbcconnpoolpercentused(jndiname, str(rng.randint(0, 100)))
+        was.addjdbcconnpoolwaitingthreadcount(jndiname, str(rng.randint(0, 10)))
+        was.addjdbcconnpoolusetime(jndiname, rng.randint(0, 30))
+        was.addjdbcconnpoolwaittime(jndiname, rng.randint(0, 10))
+    for i in range(2):
+        modname = 'App{}#App{}Web.war'.format(i, i)
+        was.addactivehttpsessions(modname, str(rng.randint(0, 100)))
+        was.addlivehttpsessions(modname, str(rng.randint(0, 1000)))
+    was.totalactivesessions = str(rng.randint(0, 200))
+    was.totallivesessions = str(rng.randint(0, 2000))
+    sibmename = '{}.{}-bus'.format(nodename, servername)
+    for i in range(4):
+        was.adddestination(perfservcore.SIBQueue('QUEUE.{}'.format(i), sibmename, str(rng.randint(0, 10 ** 6)),
+                                                 str(rng.randint(0, 100))))
+    return was
+
+
+def makecell(noservers, seed=0):
+    """WAS servers of a Cell, 20 servers per Node"""
+    rng = random.Random(seed)
+    return [makeserver('node{}'.format(i // 20), 'server{}'.format(i), rng) for i in range(noservers)]
+
+
+def filessize(prefix):
+    """Total size of the files starting with prefix, shelve backends may create more than one file"""
+    directory, name = os.path.split(prefix)
+    return sum(os.path.getsize(os.path.join(directory, filename))
+               for filename in os.listdir(directory) if filename.startswith(name))
+
+
+def benchstore(sizes, lookups, workdir):
+    """
+    Compare the snapshot file against the python shelve store it replaced: write time, file size
+    and the cost of a show check, i.e. open the store, load one server, query a metric and close the store
+    """
+    results = []
+    for noservers in sizes:
+        servers = makecell(noservers)
+        rng = random.Random(1)
+        queries = [rng.choice(servers).serverfullname() for i in range(lookups)]
+
+        shelvefilename = os.path.join(workdir, 'bench{}.dbm'.format(noservers))
+        started = time.time()
+        with shelve.open(shelvefilename, flag='n') as pfile:
+            for was in servers:
+                pfile[was.serverfullname()] = was
+        shelvewrite = time.time() - started
+        started = time.time()
+        for serverfullname in queries:
+            with shelve.open(shelvefilename, flag='r') as pfile:
+                pfile[serverfullname].querymetric('Heap', 75, 90)
+        shelvequery = (time.time() - started) / lookups
+
+        snapshotfilename = os.path.join(workdir, 'bench{}.snap'.format(noservers))
+        started = time.time()
+        perfservcore.storeperfservers(snapshotfilename, servers)
+        snapshotwrite = time.time() - started
+        started = time.time()
+        for serverfullname in queries:
+            with perfservcore.PerfSnapshotReader(snapshotfilename) as snapshot:
+                snapshot.get(serverfullname).querymetric('Heap', 75, 90)
+        snapshotquery = (time.time() - started) / lookups
+
+        result = dict(servers=noservers, shelvebackend=whichdb(shelvefilename),
+                      shelvewrite_s=shelvewrite, shelvequery_ms=shelvequery * 1000,
+                      shelvesize_bytes=filessize(shelvefilename),
+                      snapshotwrite_s=snapshotwrite, snapshotquery_ms=snapshotquery * 1000,
+                      snapshotsize_bytes=filessize(snapshotfilename))
+        print('{servers:>6} servers  shelve({shelvebackend}): write {shelvewrite_s:.3f}s query {shelvequery_ms:.3f}ms '
+              'size {shelvesize_bytes}  snapshot: write {snapshotwrite_s:.3f}s query {snapshotquery_ms:.3f}ms '
+              'size {snapshotsize_bytes}'.format(**result))
+        results.append(result)
+    return results
+
+
+class CellShape:
+    """The shape of a synthetic Cell, the number of each kind of perfservlet Stat per parent"""
+
+    def __init__(self, servers, serverspernode=20, providers=2, pools=3, modules=4, queues=8, topicspaces=2,
+                 subscribers=3, sibservers=0.5):
+        """
+        :param servers: WAS servers of the Cell
+        :param serverspernode: WAS servers per Node
+        :param providers: JDBC providers per server
+        :param pools: Connection pools per JDBC provider
+        :param modules: Web modules with HTTP sessions per server
+        :param queues: SIB queues per Messaging Engine
+        :param topicspaces: SIB topic spaces per Messaging Engine
+        :param subscribers: Durable subscribers per topic space
+        :param sibservers: Fraction of the servers running a Messaging Engine
+        """
+        self.servers = servers
+        self.serverspernode = serverspernode
+        self.providers = providers
+        self.pools = pools
+        self.modules = modules
+        self.queues = queues
+        self.topicspaces = topicspaces
+        self.subscribers = subscribers
+        self.sibservers = sibservers
+
+
+def perfxml(shape, seed=0):
+    """
+    Generate the perfservlet xml of a synthetic Cell. Besides the Stats perfservmon parses, each server has
+    the PMI modules it skips, as a real perfservlet response does
+    :param shape: A CellShape instance
+    :param seed: Seed of the metric values
+    :return: A generator of xml text chunks
+    """
+    rng = random.Random(seed)
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<PerformanceMonitor responseStatus="success" version="9.0.5.0">\n'
+    sibevery = int(1 / shape.sibservers) if shape.sibservers else 0
+    for i in range(shape.servers):
+        nodename = 'node{}'.format(i // shape.serverspernode)
+        if i % shape.serverspernode == 0:
+            if i:
+                yield '</Node>\n'
+            yield '<Node name="{}">\n'.format(nodename)
+        servername = 'server{}'.format(i)
+        chunk = ['<Server name="{}">\n<Stat name="server">\n'.format(servername)]
+        chunk.append('<Stat name="JVM Runtime">'
+                     '<BoundedRangeStatistic name="HeapSize" ID="1" lowerBound="524288" upperBound="2097152" '
+                     'current="2097152" integral="0.0" value="2097152"/>'
+                     '<CountStatistic name="FreeMemory" ID="2" count="{}"/>'
+                     '<CountStatistic name="UsedMemory" ID="3" count="{}"/>'
+                     '<CountStatistic name="UpTime" ID="4" count="{}"/>'
+                     '<CountStatistic name="ProcessCpuUsage" ID="5" count="{}"/></Stat>\n'
+                     .format(rng.randint(0, 10 ** 6), rng.randint(10 ** 5, 2097152), rng.randint(0, 10 ** 7),
+                             rng.randint(0, 100)))
+        chunk.append('<Stat name="Thread Pools">')
+        for poolname in ('WebContainer', 'Object Request Broker', 'Default', 'SIBFAPThreadPool'):
+            chunk.append('<Stat name="{}"><BoundedRangeStatistic name="ActiveCount" ID="3" value="{}"/>'
+                         '<BoundedRangeStatistic name="PoolSize" ID="4" upperBound="50" value="50"/>'
+                         '<CountStatistic name="DeclaredThreadHungCount" ID="8" count="{}"/>'
+                         '<CountStatistic name="ClearedThreadHangCount" ID="9" count="0"/></Stat>'
+                         .format(poolname, rng.randint(0, 50), rng.randint(0, 3)))
+        chunk.append('</Stat>\n')
+        for modulename, statistic in (('Security Authentication', 'WebAuthenticationTime'),
+                                      ('Security Authorization', 'WebAuthorizationTime')):
+            chunk.append('<Stat name="{}"><TimeStatistic name="{}" ID="1" count="{}" totalTime="{}" min="0" '
+                         'max="{}"/></Stat>\n'.format(modulename, statistic, rng.randint(0, 10 ** 5),
+                                                      rng.randint(0, 10 ** 7), rng.randint(0, 9000)))
+        chunk.append('<Stat name="JDBC Connection Pools">')
+        for provider in range(shape.providers):
+            chunk.append('<Stat name="JDBC Provider {}">'.format(provider))
+            for pool in range(shape.pools):
+                chunk.append('<Stat name="jdbc/DataSource{}_{}">'
+                             '<CountStatistic name="CreateCount" ID="1" count="{}"/>'
+                             '<RangeStatistic name="PercentUsed" ID="14" value="{}"/>'
+                             '<RangeStatistic name="WaitingThreadCount" ID="7" value="{}"/>'
+                             '<TimeStatistic name="UseTime" ID="12" count="{}" max="{}"/>'
+                             '<TimeStatistic name="WaitTime" ID="13" count="{}" max="{}"/></Stat>'
+                             .format(provider, pool, rng.randint(0, 10 ** 4), rng.randint(0, 100),
+                                     rng.randint(0, 10), rng.randint(0, 10 ** 5), rng.randint(0, 40000),
+                                     rng.randint(0, 10 ** 3), rng.randint(0, 12000)))
+            chunk.append('</Stat>')
+        chunk.append('</Stat>\n<Stat name="Servlet Session Manager">'
+                     '<RangeStatistic name="ActiveCount" ID="6" value="{}"/>'
+                     '<RangeStatistic name="LiveCount" ID="7" value="{}"/>'
+                     .format(rng.randint(0, 100), rng.randint(0, 5000)))
+        for module in range(shape.modules):
+            chunk.append('<Stat name="App{0}#App{0}Web.war"><RangeStatistic name="ActiveCount" ID="6" value="{1}"/>'
+                         '<RangeStatistic name="LiveCount" ID="7" value="{2}"/></Stat>'
+                         .format(module, rng.randint(0, 50), rng.randint(0, 1000)))
+        chunk.append('<Stat name="perfServletApp#perfServletApp.war"><RangeStatistic name="ActiveCount" ID="6" '
+                     'value="1"/><RangeStatistic name="LiveCount" ID="7" value="1"/></Stat></Stat>\n')
+        chunk.append('<Stat name="Transaction Manager"><CountStatistic name="GlobalBegunCount" ID="1" count="{}"/>'
+                     '<CountStatistic name="CommittedCount" ID="4" count="{}"/>'
+                     '<CountStatistic name="RolledbackCount" ID="5" count="{}"/></Stat>\n'
+                     .format(rng.randint(0, 10 ** 6), rng.randint(0, 10 ** 6), rng.randint(0, 10 ** 3)))
+        if sibevery and i % sibevery == 0:
+            chunk.append('<Stat name="SIB Service"><Stat name="SIB Messaging Engines">'
+                         '<Stat name="{}.{}-bus"><Stat name="Destinations"><Stat name="Queues">'
+                         .format(nodename, servername))
+            for queue in range(shape.queues):
+                chunk.append('<Stat name="QUEUE.{}">'
+                             '<CountStatistic name="QueueStats.TotalMessagesConsumedCount" ID="3" count="{}"/>'
+                             '<CountStatistic name="QueueStats.AvailableMessageCount" ID="4" count="{}"/></Stat>'
+                             .format(queue, rng.randint(0, 10 ** 6), rng.randint(0, 200)))
+            chunk.append('</Stat><Stat name="Topicspaces">')
+            for topicspace in range(shape.topicspaces):
+                chunk.append('<Stat name="TOPICSPACE.{}"><Stat name="Durable Subscriptions">'
+                             '<CountStatistic name="DurableSubscriptionStats.TotalMessagesConsumedCount" ID="3" '
+                             'count="{}"/>'
+                             '<CountStatistic name="DurableSubscriptionStats.AvailableMessageCount" ID="4" '
+                             'count="{}"/>'.format(topicspace, rng.randint(0, 10 ** 6), rng.randint(0, 200)))
+                chunk.extend('<Stat name="Subscriber{}"/>'.format(subscriber)
+                             for subscriber in range(shape.subscribers))
+                chunk.append('</Stat></Stat>')
+            chunk.append('</Stat></Stat></Stat></Stat></Stat>\n')
+        chunk.append('</Stat>\n</Server>\n')
+        yield ''.join(chunk)
+    if shape.servers:
+        yield '</Node>\n'
+    yield '</PerformanceMonitor>\n'
+
+
+def writeperfxml(xmlfilename, shape, seed=0):
+    """Write the perfservlet xml of a synthetic Cell"""
+    with open(xmlfilename, 'w') as xmlfile:
+        for chunk in perfxml(shape, seed):
+            xmlfile.write(chunk)
+
+
+def runstage(stage, xmlfilename, snapshotfilename, queries):
+    """
+    Run one stage of the perfservmon pipeline in this process, see benchpipeline
+    :return: The stage results, peak RSS included
+    """
+    import resource
+    started = time.time()
+    if stage == 'parse':
+        responsestatus, servers = perfservcore.readperfxml(xmlfilename)
+        count = sum(1 for was in servers)
+    elif stage == 'store':
+        responsestatus, servers = perfservcore.readperfxml(xmlfilename)
+        servers = list(servers)
+        count = len(servers)
+        started = time.time()
+        perfservcore.storeperfservers(snapshotfilename, servers)
+    elif stage == 'query':
+        with perfservcore.PerfSnapshotReader(snapshotfilename) as snapshot:
+            serverfullnames = list(snapshot.keys())
+        rng = random.Random(2)
+        path, filename = os.path.split(snapshotfilename)
+        cellname = filename[:-len('.snap')]
+        for i in range(queries):
+            nodename, servername = rng.choice(serverfullnames).split('.', 1)
+            perfservshow.queryperfdata(os.path.join(path, ''), cellname, nodename, servername, 'Heap', 75, 90)
+        count = queries
+    walltime = time.time() - started
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return dict(count=count, wall_s=walltime, maxrss_kb=maxrss // 1024 if sys.platform == 'darwin' else maxrss)
+
+
+def benchpipeline(sizes, queries, shape, workdir):
+    """
+    Wall time, peak RSS and output size of each stage of the perfservmon pipeline: parse the perfservlet xml,
+    store the servers in the snapshot file and query them as the show checks do. Each stage runs in a new
+    process, so that its peak RSS is its own
+    """
+    results = []
+    for noservers in sizes:
+        shape.servers = noservers
+        xmlfilename = os.path.join(workdir, 'pipeline{}.xml'.format(noservers))
+        snapshotfilename = os.path.join(workdir, 'pipeline{}.snap'.format(noservers))
+        writeperfxml(xmlfilename, shape)
+        result = dict(servers=noservers, xml_bytes=os.path.getsize(xmlfilename))
+        for stage in ('parse', 'store', 'query'):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'stage', stage, xmlfilename,
+                                              snapshotfilename, str(queries)], universal_newlines=True)
+            result[stage] = json.loads(output)
+        result['snapshot_bytes'] = os.path.getsize(snapshotfilename)
+        result['query']['perquery_ms'] = result['query']['wall_s'] * 1000 / queries
+        print('{servers:>6} servers  xml {xml_bytes}B  parse {parse[wall_s]:.3f}s {parse[maxrss_kb]}KB  '
+              'store {store[wall_s]:.3f}s {store[maxrss_kb]}KB {snapshot_bytes}B  '
+              'query {query[perquery_ms]:.3f}ms {query[maxrss_kb]}KB'.format(**result))
+        results.append(result)
+    return results
+
+
+def benchparallel(sizes, workers, runs, shape, workdir):
+    """
+    Wall time of the parallel parse of the perfservlet xml split at Node boundaries against the serial parse,
+    for each number of worker processes. The xml is read in memory first, as the parallel parse does
+    """
+    import io
+    results = []
+    for noservers in sizes:
+        shape.servers = noservers
+        xmlfilename = os.path.join(workdir, 'parallel{}.xml'.format(noservers))
+        writeperfxml(xmlfilename, shape)
+        with open(xmlfilename, 'rb') as xmlfile:
+            data = xmlfile.read()
+        result = dict(servers=noservers, xml_bytes=len(data), cpus=os.cpu_count(), workers={})
+        for noworkers in [1] + [noworkers for noworkers in workers if noworkers > 1]:
+            walltimes = []
+            for i in range(runs):
+                started = time.time()
+                if noworkers > 1:
+                    responsestatus, servers = perfservcore.readperfxmlparallel(data, noworkers)
+                else:
+                    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(data))
+                parsed = sum(1 for was in servers)
+                walltimes.append(time.time() - started)
+            if parsed != noservers:
+                raise ValueError('Parsed {} servers out of {}'.format(parsed, noservers))
+            result['workers'][noworkers] = dict(wall_s=min(walltimes), servers_per_s=noservers / min(walltimes),
+                                                speedup=result['workers'][1]['wall_s'] / min(walltimes)
+                                                if noworkers > 1 else 1.0)
+        print('{:>6} servers  xml {}B  {}'.format(noservers, len(data), '  '.join(
+            '{} workers {wall_s:.3f}s x{speedup:.2f}'.format(noworkers, **result['workers'][noworkers])
+            for noworkers in sorted(result['workers']))))
+        results.append(result)
+    return results
+
+
+def benchmodel(sizes, shape, workdir):
+    """
+    Memory held by the parsed servers of the Cell, as traced by tracemalloc, and their pickled size, which is what
+    the parallel parse workers send back
+    """
+    import io
+    import pickle
+    import tracemalloc
+    results = []
+    for noservers in sizes:
+        shape.servers = noservers
+        xmlfilename = os.path.join(workdir, 'model{}.xml'.format(noservers))
+        writeperfxml(xmlfilename, shape)
+        with open(xmlfilename, 'rb') as xmlfile:
+            data = xmlfile.read()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        responsestatus, servers = perfservcore.readperfxml(io.BytesIO(data))
+        servers = list(servers)
+        traced = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        pickled = len(pickle.dumps(servers, pickle.HIGHEST_PROTOCOL))
+        result = dict(servers=len(servers), traced_bytes=traced, traced_per_server=traced // len(servers),
+                      pickle_bytes=pickled, pickle_per_server=pickled // len(servers))
+        print('{servers:>6} servers  traced {traced_bytes}B {traced_per_server}B/server  '
+              'pickle {pickle_bytes}B {pickle_per_server}B/server'.format(**result))
+        results.append(result)
+    return results
+
+
+def importtimes(stderr):
+    """
+    Parse python -X importtime output
+    :return: Total import time in ms and the cumulative ms of each top level import
+    """
+    toplevel = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        selftime, cumulative, name = line[len('import time:'):].split('|')
+        if not name[1:].startswith(' '):
+            toplevel[name.strip()] = int(cumulative) / 1000.0
+    return sum(toplevel.values()), toplevel
+
+
+def benchstartup(runs, budget, noservers):
+    """
+    Cold start latency of a show check, i.e. a new python process as forked by Nagios for every check,
+    against the interpreter startup alone
+    :return: The benchmark results, including whether the show median is within budget ms
+    """
+    # show reads the snapshot from the plugin default path
+    path = '/tmp/' if sys.platform.startswith('linux') else ''
+    cellname = 'perfservbench{}'.format(os.getpid())
+    perfservcore.storeperfservers(path + cellname + '.snap', makecell(noservers))
+    plugindir = os.path.dirname(os.path.abspath(__file__))
+    plugin = os.path.join(plugindir, 'perfservmon.py')
+    # As installed, the plugin modules are imported from their cached bytecode, see the README Setup
+    for module in ('perfservcore.py', 'perfservshow.py'):
+        py_compile.compile(os.path.join(plugindir, module), doraise=True)
+    commands = dict(python=[sys.executable, '-X', 'importtime', '-c', 'pass'],
+                    show=[sys.executable, '-X', 'importtime', plugin, '-C', cellname, 'show', '-n', 'node0',
+                          '-s', 'server0', '-M', 'Heap', '-w', '75', '-c', '90'])
+    result = dict(servers=noservers, runs=runs, budget_ms=budget)
+    try:
+        for name, command in sorted(commands.items()):
+            walltimes = []
+            for i in range(runs):
+                started = time.time()
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                           universal_newlines=True)
+                stdout, stderr = process.communicate()
+                walltimes.append((time.time() - started) * 1000)
+            walltimes.sort()
+            imports, toplevel = importtimes(stderr)
+            result[name] = dict(median_ms=walltimes[len(walltimes) // 2], min_ms=walltimes[0], imports_ms=imports,
+                                slowest_imports=sorted(toplevel.items(), key=lambda item: -item[1])[:5])
+            print('{:>6}: median {median_ms:.1f}ms min {min_ms:.1f}ms imports {imports_ms:.1f}ms slowest {slowest}'
+                  .format(name, slowest=', '.join('{}={:.1f}ms'.format(*item)
+                                                  for item in result[name]['slowest_imports']), **result[name]))
+    finally:
+        os.remove(path + cellname + '.snap')
+    result['withinbudget'] = result['show']['median_ms'] <= budget
+    print('show median {:.1f}ms, budget {}ms: {}'.format(result['show']['median_ms'], budget,
+                                                         'OK' if result['withinbudget'] else 'OVER BUDGET'))
+    return [result]
+
+
+def addshapeargs(subparser):
+    """Synthetic Cell shape arguments"""
+    subparser.add_argument("--serverspernode", type=int, dest='ServersPerNode', default=20)
+    subparser.add_argument("--providers", type=int, dest='Providers', help="JDBC providers per server", default=2)
+    subparser.add_argument("--pools", type=int, dest='Pools', help="Connection pools per JDBC provider", default=3)
+    subparser.add_argument("--modules", type=int, dest='Modules', help="Web modules per server", default=4)
+    subparser.add_argument("--queues", type=int, dest='Queues', help="SIB queues per Messaging Engine", default=8)
+    subparser.add_argument("--topicspaces", type=int, dest='TopicSpaces', help="SIB topic spaces per Messaging Engine",
+                           default=2)
+    subparser.add_argument("--subscribers", type=int, dest='Subscribers', help="Durable subscribers per topic space",
+                           default=3)
+    subparser.add_argument("--sibservers", type=float, dest='SibServers',
+                           help="Fraction of the servers running a Messaging Engine", default=0.5)
+
+
+def cellshape(arguments, servers=0):
+    return CellShape(servers, arguments.ServersPerNode, arguments.Providers, arguments.Pools, arguments.Modules,
+                     arguments.Queues, arguments.TopicSpaces, arguments.Subscribers, arguments.SibServers)
+
+
+def parsecmdargs():
+    parser = argparse.ArgumentParser(description='Perfservmon benchmarks')
+    parser.add_argument("--json", type=str, action="store", dest='JsonFile',
+                        help="Write the results in this json file", required=False)
+    subparsers = parser.add_subparsers(help='Benchmarks', dest='benchmark')
+    store_parser = subparsers.add_parser('store', help='Snapshot file against python shelve store')
+    store_parser.add_argument("--sizes", type=int, nargs='+', dest='Sizes', help="Number of servers per Cell",
+                              default=[10, 100, 1000, 5000])
+    store_parser.add_argument("--lookups", type=int, dest='Lookups', help="Show checks per Cell size",
+                              default=200)
+    startup_parser = subparsers.add_parser('startup', help='Cold start latency of a show check')
+    startup_parser.add_argument("--runs", type=int, dest='Runs', help="Number of show processes", default=30)
+    startup_parser.add_argument("--budget", type=float, dest='Budget',
+                                help="Budget of the show median latency in ms, exceeding it exits with 1",
+                                default=100)
+    startup_parser.add_argument("--servers", type=int, dest='Servers', help="Number of servers of the snapshot",
+                                default=1000)
+    pipeline_parser = subparsers.add_parser('pipeline', help='Parse, store and query stages over synthetic Cells')
+    pipeline_parser.add_argument("--sizes", type=int, nargs='+', dest='Sizes', help="Number of servers per Cell",
+                                 default=[10, 100, 1000, 5000])
+    pipeline_parser.add_argument("--queries", type=int, dest='Queries', help="Show checks per Cell size",
+                                 default=200)
+    addshapeargs(pipeline_parser)
+    parallel_parser = subparsers.add_parser('parallel', help='Parallel parse split at Node boundaries against the '
+                                                             'serial parse')
+    parallel_parser.add_argument("--sizes", type=int, nargs='+', dest='Sizes', help="Number of servers per Cell",
+                                 default=[1000, 5000])
+    parallel_parser.add_argument("--workers", type=int, nargs='+', dest='Workers',
+                                 help="Numbers of worker processes", default=[2, 4, 8, 16])
+    parallel_parser.add_argument("--runs", type=int, dest='Runs', help="Runs per number of workers, the fastest "
+                                                                         "is kept", default=3)
+    addshapeargs(parallel_parser)
+    model_parser = subparsers.add_parser('model', help='Memory and pickled size of the parsed servers')
+    model_parser.add_argument("--sizes", type=int, nargs='+', dest='Sizes', help="Number of servers per Cell",
+                              default=[100, 1000, 5000])
+    addshapeargs(model_parser)
+    xml_parser = subparsers.add_parser('xml', help='Write the perfservlet xml of a synthetic Cell')
+    xml_parser.add_argument("--servers", type=int, dest='Servers', help="Number of servers of the Cell",
+                            default=100)
+    xml_parser.add_argument("--seed", type=int, dest='Seed', help="Seed of the metric values", default=0)
+    xml_parser.add_argument("-o", type=str, dest='OutputFile', help="The xml file, default stdout", required=False)
+    addshapeargs(xml_parser)
+    # Internal, runs one stage of the pipeline benchmark in its own process
+    stage_parser = subparsers.add_parser('stage')
+    stage_parser.add_argument('Stage', choices=['parse', 'store', 'query'])
+    stage_parser.add_argument('XmlFile')
+    stage_parser.add_argument('SnapshotFile')
+    stage_parser.add_argument('Queries', type=int)
+    arguments = parser.parse_args()
+    if arguments.benchmark is None:
+        parser.error('a benchmark is required')
+    return arguments
+
+
+if __name__ == '__main__':
+    arguments = parsecmdargs()
+    if arguments.benchmark == 'stage':
+        print(json.dumps(runstage(arguments.Stage, arguments.XmlFile, arguments.SnapshotFile, arguments.Queries)))
+        sys.exit(0)
+    if arguments.benchmark == 'xml':
+        if arguments.OutputFile:
+            writeperfxml(arguments.OutputFile, cellshape(arguments, arguments.Servers), arguments.Seed)
+        else:
+            sys.stdout.writelines(perfxml(cellshape(arguments, arguments.Servers), arguments.Seed))
+        sys.exit(0)
+    workdir = tempfile.mkdtemp(prefix='perfservbench')
+    try:
+        if arguments.benchmark == 'store':
+            benchresults = benchstore(arguments.Sizes, arguments.Lookups, workdir)
+        elif arguments.benchmark == 'startup':
+            benchresults = benchstartup(arguments.Runs, arguments.Budget, arguments.Servers)
+        elif arguments.benchmark == 'pipeline':
+            benchresults = benchpipeline(arguments.Sizes, arguments.Queries, cellshape(arguments), workdir)
+        elif arguments.benchmark == 'parallel':
+            benchresults = benchparallel(arguments.Sizes, arguments.Workers, arguments.Runs, cellshape(arguments),
+                                         workdir)
+        elif arguments.benchmark == 'model':
+            benchresults = benchmodel(arguments.Sizes, cellshape(arguments), workdir)
+    finally:
+        shutil.rmtree(workdir)
+    if arguments.JsonFile:
+        with open(arguments.JsonFile, 'w') as jsonfile:
+            json.dump(dict(benchmark=arguments.benchmark, python=sys.version.split()[0], results=benchresults),
+                      jsonfile, indent=2)
+    if arguments.benchmark == 'startup' and not benchresults[0]['withinbudget']:
+        sys.exit(1)
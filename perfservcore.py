@@ -0,0 +1,3686 @@
+"""
+@author: varounisdi
+@contributor: atterdag
+"""
+
+# The plugin code, imported by the perfservmon.py entry point from its cached bytecode.
+# Only the snapshot reader and the threshold logic are needed by show, which Nagios forks for every check.
+# The network, xml and daemon modules are imported by the functions that use them, to keep show startup short
+import argparse
+import struct
+from collections.abc import MutableMapping
+import mmap
+import sys
+import os
+import time
+
+OK = 0
+WARNING = 1
+CRITICAL = 2
+UNKNOWN = 3
+
+# The show Metric Types of the usage percentages which windowed aggregates are kept for
+AGGREGATEMETRICS = ('Heap', 'WebContainer', 'DBConnectionPoolPercentUsed')
+AGGREGATES = ('avg', 'max', 'p95')
+
+# The PMI module each show Metric Type is collected from, used to request only the needed modules from perfservlet.
+# The Stat paths of the Extra metrics of a stat map may lie in any module, None requests all of them
+PMIMODULES = {'WebContainer': 'threadPoolModule',
+              'WebContainerThreadHung': 'threadPoolModule',
+              'ORB': 'threadPoolModule',
+              'DBConnectionPoolPercentUsed': 'connectionPoolModule',
+              'DBConnectionPoolUseTime': 'connectionPoolModule',
+              'DBConnectionPoolWaitTime': 'connectionPoolModule',
+              'DBConnectionPoolWaitingThreadCount': 'connectionPoolModule',
+              'Heap': 'jvmRuntimeModule',
+              'LiveSessions': 'servletSessionsModule',
+              'SIBDestinations': 'SIBService',
+              'WebAuthenticationTime': 'SecurityAuthenticationStats',
+              'WebAuthorizationTime': 'SecurityAuthorizationStats',
+              'Extra': None
+              }
+
+
+class GenericServer:
+    """Generic WAS Server Prototype"""
+    __slots__ = ('name', 'nodename', 'maxheapMB', 'heapusedMB')
+
+    def __init__(self, name, nodename):
+        """
+        :param name: WAS Server Name
+        :param nodename: WAS Node Name the Server belongs
+        """
+        self.name = name
+        self.nodename = nodename
+        self.maxheapMB = None
+        self.heapusedMB = None
+
+    def printserver(self):
+        """
+        Print Generic Server Attributes(for debug purposes)
+        """
+        print('Name:' + str(self.name))
+        print('NodeName:' + str(self.nodename))
+        print('MaxHeap:' + str(self.maxheapMB))
+        print('HeapUsed:' + str(self.heapusedMB))
+
+    def serverfullname(self):
+        """Utility to uniquely identify a server in a Cell"""
+        return '.'.join((self.nodename, self.name))
+
+
+# ###################################################################################
+class SIBDestination:
+    """WAS SIB Generic Class
+    Can be a Topic Space or a Queue
+    """
+    __slots__ = ('Name', 'MEName', 'TotalMessagesConsumed', 'AvailableMessages')
+
+    def __init__(self, name, mename, totalmessagesconsumed, availablemessages):
+        """
+        :param name: The Destination Name
+        :param mename: The Message Engine Name  
+        :param totalmessagesconsumed: PMI Metric -> Total Messages Consumed since restart of Message Engine
+        :param availablemessages: PMI Metric -> No of available msgs in Destination
+        """
+        self.Name = name
+        self.MEName = mename
+        self.TotalMessagesConsumed = totalmessagesconsumed
+        self.AvailableMessages = availablemessages
+
+    def printsibdest(self):
+        print('SIB Destination Name:' + str(self.Name))
+        print('SIB Message Engine Name:' + str(self.MEName))
+        print('SIB Dest Messages Consumed:' + str(self.TotalMessagesConsumed))
+        print('SIB Dest Available Messages:' + str(self.AvailableMessages))
+
+
+class SIBQueue(SIBDestination):
+    """Queue Destination"""
+    __slots__ = ()
+
+    def __init__(self, name, mename, totalmessagesconsumed, availablemessages):
+        SIBDestination.__init__(self, name, mename, totalmessagesconsumed, availablemessages)
+
+
+class SIBTopicSpace(SIBDestination):
+    """Pub/Sub Destination"""
+    __slots__ = ('subscribers',)
+
+    def __init__(self, name, mename, totalmessagesconsumed, availablemessages):
+        """
+        :param name: The Destination Name
+        :param totalmessagesconsumed: PMI Metric -> Total Messages Consumed since restart of Message Engine
+        :param availablemessages: PMI Metric -> No of available msgs in Destination
+        """
+        SIBDestination.__init__(self, name, mename, totalmessagesconsumed, availablemessages)
+        self.subscribers = []
+
+    def adddurablesubscriber(self, subscrname):
+        """Add Active Durable Subscribers to the list"""
+        self.subscribers.append(subscrname)
+
+    def printsibdest(self):
+        SIBDestination.printsibdest(self)
+        if len(self.subscribers) > 0:
+            print('SIB Topic Subscribers:' + str(self.subscribers))
+
+
+# ######################################################################################
+class ConnectionPools:
+    """
+    The JDBC connection pools of a WAS server, their metrics kept in lists parallel to the list of their JNDI names,
+    None for a metric without value. The positions map each JNDI name to its position in the lists
+    """
+    __slots__ = ('names', 'positions', 'metrics')
+    METRICS = ('percentused', 'usetime', 'waittime', 'waitingthreadcount')
+
+    def __init__(self):
+        self.names = []
+        self.positions = {}
+        self.metrics = tuple([] for metric in self.METRICS)
+
+    def __getstate__(self):
+        # The positions are rebuilt on unpickling, rather than sent along with the parsed servers
+        return self.names, self.metrics
+
+    def __setstate__(self, state):
+        self.names, self.metrics = state
+        self.positions = dict((name, i) for i, name in enumerate(self.names))
+
+    def position(self, name):
+        return self.positions.get(name)
+
+    def set(self, name, metric, value):
+        """
+        :param name: The JNDI name of the pool
+        :param metric: The position of the metric in METRICS
+        :param value: The metric value
+        """
+        i = self.position(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.positions[name] = i
+            for values in self.metrics:
+                values.append(None)
+        self.metrics[metric][i] = value
+
+
+class ConnectionPoolMetric(MutableMapping):
+    """JNDI name -> value view of a metric of the ConnectionPools, holding the pools with a value"""
+    __slots__ = ('pools', 'metric')
+
+    def __init__(self, pools, metric):
+        self.pools = pools
+        self.metric = metric
+
+    def __getitem__(self, name):
+        i = self.pools.position(name)
+        if i is None or self.pools.metrics[self.metric][i] is None:
+            raise KeyError(name)
+        return self.pools.metrics[self.metric][i]
+
+    def __setitem__(self, name, value):
+        self.pools.set(name, self.metric, value)
+
+    def __delitem__(self, name):
+        self[name]
+        self.pools.set(name, self.metric, None)
+
+    def __iter__(self):
+        return (name for name, value in zip(self.pools.names, self.pools.metrics[self.metric]) if value is not None)
+
+    def __len__(self):
+        return sum(1 for value in self.pools.metrics[self.metric] if value is not None)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class TypicalApplicationServer(GenericServer):
+    """Typical WAS Class - Recommended for use in most cases"""
+    __slots__ = ('wcpoolsize', 'wcactive', 'wcthreadshung', 'orbpoolsize', 'orbactive', 'connpools',
+                 'totalactivesessions', 'totallivesessions', 'activesessions', 'livesessions', 'destinations',
+                 'messageengines', 'webSecAuthenTime', 'webSecAuthorTime', 'rates', 'aggregates', 'extras')
+
+    def __init__(self, name, nodename):
+        GenericServer.__init__(self, name, nodename)
+        self.wcpoolsize = None
+        self.wcactive = None
+        self.wcthreadshung = None
+        self.orbpoolsize = None
+        self.orbactive = None
+        self.connpools = ConnectionPools()
+        self.totalactivesessions = None
+        self.totallivesessions = None
+        self.activesessions = {}
+        self.livesessions = {}
+        self.destinations = {}
+        self.messageengines = []
+        self.webSecAuthenTime = None
+        self.webSecAuthorTime = None
+        # Derived from the history of the counters at collection time, see recordrates
+        self.rates = {}
+        # Windowed aggregates of the usage percentages, derived from their history at collection time,
+        # see recordaggregates
+        self.aggregates = {}
+        # Extra metrics of a stat map file, see readstatmap
+        self.extras = {}
+
+    def printserver(self):
+        """
+        Print Typical Server Attributes(for debug purposes)
+        """
+        print('****************************')
+        GenericServer.printserver(self)
+        print('WebContainerActive:' + str(self.wcactive))
+        print('WebContainerPoolSize:' + str(self.wcpoolsize))
+        print('WebContainerConcurrentHungThreadCount:' + str(self.wcthreadshung))
+        print('ORBActive:' + str(self.orbactive))
+        print('ORBPoolSize:' + str(self.orbpoolsize))
+        print('JDBC Conn Pools Percent Used:' + str(self.connpoolspercentused))
+        print('JDBC Conn Pools Use Time:' + str(self.connpoolsusetime))
+        print('JDBC Conn Pools Wait Time:' + str(self.connpoolswaittime))
+        print('JDBC Conn Pools Waiting Thread Count:' + str(self.connpoolswaitingthreadcount))
+        print('Total Active Http Sessions:' + str(self.totalactivesessions))
+        print('Total Live Http Sessions:' + str(self.totallivesessions))
+        print('Http Active Sessions:' + str(self.activesessions))
+        print('Http Live Sessions:' + str(self.livesessions))
+        for dest in self.destinations:
+            (self.destinations[dest]).printsibdest()
+        print('****************************')
+
+    @property
+    def connpoolspercentused(self):
+        return ConnectionPoolMetric(self.connpools, 0)
+
+    @property
+    def connpoolsusetime(self):
+        return ConnectionPoolMetric(self.connpools, 1)
+
+    @property
+    def connpoolswaittime(self):
+        return ConnectionPoolMetric(self.connpools, 2)
+
+    @property
+    def connpoolswaitingthreadcount(self):
+        return ConnectionPoolMetric(self.connpools, 3)
+
+    def addjdbcconnpoolpercentused(self, name, value):
+        self.connpoolspercentused[name] = value
+
+    def addjdbcconnpoolusetime(self, name, value):
+        self.connpoolsusetime[name] = value
+
+    def addjdbcconnpoolwaittime(self, name, value):
+        self.connpoolswaittime[name] = value
+
+    def addjdbcconnpoolwaitingthreadcount(self, name, value):
+        self.connpoolswaitingthreadcount[name] = value
+
+    def addactivehttpsessions(self, modname, nosessions):
+        self.activesessions[modname] = nosessions
+
+    def addlivehttpsessions(self, modname, nosessions):
+        self.livesessions[modname] = nosessions
+
+    def adddestination(self, sibdest):
+        self.destinations[sibdest.Name] = sibdest
+
+    def addsibme(self, sibmename):
+        self.messageengines.append(sibmename)
+
+    def querymetric(self, metric, warning, critical, destination=None, jndi=None, aggregate=None, extra=None,
+                    top=5):
+        """
+        Delegate the metric query to the appropriate function
+        :param metric:
+        :param warning:
+        :param critical:
+        :param destination: The SIB destination name, may contain shell style wildcards
+        :param jndi: The JNDI name of the connection pool, may contain shell style wildcards
+        :param aggregate: Check the avg, max or p95 aggregate of the metric over the collection window instead
+        :param extra: The name of the Extra metric
+        :param top: Number of pools or destinations reported when many match a wildcard
+        :return:
+        """
+        metrics = dict(WebContainer=self.querywebcontainer,
+                       WebContainerThreadHung=self.querywebcontainerhungthreads,
+                       ORB=self.queryorb,
+                       DBConnectionPoolPercentUsed=self.querydbconnpoolpercentused,
+                       DBConnectionPoolUseTime=self.querydbconnpoolusetime,
+                       DBConnectionPoolWaitTime=self.querydbconnpoolwaittime,
+                       DBConnectionPoolWaitingThreadCount=self.querydbconnpoolwaitingthreadcount,
+                       WebAuthenticationTime=self.querysecauthen,
+                       WebAuthorizationTime=self.querysecauthor,
+                       Heap=self.queryheapusage,
+                       LiveSessions=self.querylivesessions,
+                       SIBDestinations=self.querysibdestination,
+                       Extra=self.queryextra
+                       )
+
+        queryargs = dict(warning=warning, critical=critical)
+        if aggregate is not None:
+            if metric not in AGGREGATEMETRICS:
+                return UNKNOWN, 'Aggregates are only kept for {} metrics'.format(', '.join(AGGREGATEMETRICS))
+            queryargs['aggregate'] = aggregate
+        if metric == 'Extra':
+            queryargs['name'] = extra
+        elif destination is not None:
+            queryargs['destname'] = destination
+            queryargs['top'] = top
+        elif jndi is not None:
+            queryargs['jndiname'] = jndi
+            queryargs['top'] = top
+        return metrics[metric](**queryargs)
+
+    def querywebcontainer(self, warning=75, critical=90, aggregate=None):
+        if self.wcactive is None or self.wcpoolsize is None:
+            return UNKNOWN, 'Could not find WebContainer Usage metrics for server {}'.format(self.name)
+        elif aggregate is not None:
+            if 'WebContainer:' + aggregate not in self.aggregates:
+                return UNKNOWN, 'Could not find WebContainer Usage {} over the collection window for server {}' \
+                    .format(aggregate, self.name)
+            percentused = int(self.aggregates['WebContainer:' + aggregate])
+            msg = 'WebContainer Thread Pool {agg} over {wnd} seconds: {pc}%, now {actv}/{sz}|' \
+                  'wcthreadpoolusage_{agg}={pc}%;{warn};{crit} wcthreadpoolused={actv};;;0;{sz}' \
+                .format(agg=aggregate, wnd=int(self.aggregates['Window']), actv=self.wcactive, sz=self.wcpoolsize,
+                        pc=percentused, warn=warning, crit=critical)
+        else:
+            percentused = int(float(self.wcactive) / float(self.wcpoolsize) * 100)
+            msg = 'WebContainer Thread Pool: {actv}/{sz} ({pc}%)|' \
+                  'wcthreadpoolusage={pc}%;{warn};{crit} wcthreadpoolused={actv};;;0;{sz}' \
+                .format(actv=self.wcactive, sz=self.wcpoolsize, pc=percentused, warn=warning, crit=critical)
+        if warning < percentused < critical:
+            return WARNING, msg
+        elif percentused >= critical:
+            return CRITICAL, msg
+        else:
+            return OK, msg
+
+    def querywebcontainerhungthreads(self, warning=75, critical=90):
+        if self.wcthreadshung is None:
+            return UNKNOWN, 'Could not find WebContainer Thread Hung metrics for server {}'.format(self.name)
+        else:
+            wcthreadshung = self.wcthreadshung
+            if 'ThreadsHung' in self.rates:
+                msg = 'WebContainer Declared Thread Hung: {thrh}, {new} new in the last {intv} seconds|' \
+                      'wcthreadhung={thrh};{warn};{crit};0 wcnewthreadhung={new};;;0' \
+                    .format(thrh=self.wcthreadshung, new=int(self.rates['ThreadsHung']),
+                            intv=int(self.rates['ThreadsHungInterval']), warn=warning, crit=critical)
+            else:
+                msg = 'WebContainer Declared Thread Hung: {thrh}|wcthreadhung={thrh};{warn};{crit};0' \
+                    .format(thrh=self.wcthreadshung, warn=warning, crit=critical)
+            if warning < wcthreadshung < critical:
+                return WARNING, msg
+            elif wcthreadshung >= critical:
+                return CRITICAL, msg
+            else:
+                return OK, msg
+
+    def queryorb(self, warning=75, critical=90):
+        if self.orbactive is None or self.orbpoolsize is None:
+            return UNKNOWN, 'Could not find ORB metrics for server {}'.format(self.name)
+        else:
+            percentused = int(float(self.orbactive) / float(self.orbpoolsize) * 100)
+            msg = 'ORB Thread Pool: {actv}/{sz} ({pc}%)|' \
+                  'orbthreadpoolusage={pc}%;{warn};{crit} orbthreadpoolused={actv};;;0;{sz}' \
+                .format(actv=self.orbactive, sz=self.orbpoolsize, pc=percentused, warn=warning, crit=critical)
+            if warning < percentused < critical:
+                return WARNING, msg
+            elif percentused >= critical:
+                return CRITICAL, msg
+            else:
+                return OK, msg
+
+    def querydbconnpoolpercentused(self, jndiname=None, warning=75, critical=90, aggregate=None, top=5):
+        if len(self.connpoolspercentused) == 0 or self.connpoolspercentused is None:
+            return UNKNOWN, 'Could not find DB Connection Pool Percent Used metrics for server {}'.format(self.name)
+        else:
+            statuscode = OK
+            connpoolspercentused, title, label = self.connpoolspercentused, 'DB Connection Pool Percent Used', 'usage'
+            if aggregate is not None:
+                prefix = 'DBConnectionPoolPercentUsed:{}:'.format(aggregate)
+                connpoolspercentused = dict((name[len(prefix):], value) for name, value in self.aggregates.items()
+                                            if name.startswith(prefix))
+                if len(connpoolspercentused) == 0:
+                    return UNKNOWN, 'Could not find DB Connection Pool Percent Used {} over the collection window ' \
+                                    'for server {}'.format(aggregate, self.name)
+                title += ' {} over {} seconds'.format(aggregate, int(self.aggregates['Window']))
+                label += '_' + aggregate
+            if jndiname is None:
+                # If no jndi name is given, show all Connection Pools
+                # alert if ANY is above Warn, Crit
+                msg = title
+                perfdata = '|'
+                for connpool in connpoolspercentused:
+                    percentused = int(connpoolspercentused[connpool])
+                    msg += ' - {connpool} {pc}%'.format(connpool=connpool, pc=percentused)
+                    perfdata += '{connpool}_{label}={pc}%;{warn};{crit} ' \
+                        .format(connpool=connpool, label=label, pc=percentused, warn=warning, crit=critical)
+                    # For this loop, Change statuscode only when lower status code is active
+                    # e.g. change to warning only when statuscode is OK, not critical or warning
+                    if warning < percentused < critical and statuscode == OK:
+                        statuscode = WARNING
+                    if critical <= percentused:
+                        statuscode = CRITICAL
+                msg += perfdata
+            elif iswildcard(jndiname):
+                return self.querydbconnpoolmatches(title, connpoolspercentused, jndiname, label, '%', warning,
+                                                   critical, top)
+            elif jndiname in connpoolspercentused:
+                percentused = int(connpoolspercentused[jndiname])
+                msg = '{title} - {jndi} {pc}%|{jndi}_{label}={pc}%;{warn};{crit}' \
+                    .format(title=title, jndi=jndiname, label=label, pc=percentused, warn=warning, crit=critical)
+                if warning < percentused < critical:
+                    statuscode = WARNING
+                if critical <= percentused:
+                    statuscode = CRITICAL
+            else:
+                msg = 'No DB Connection Pool for {jndi} was found'.format(jndi=jndiname)
+                statuscode = UNKNOWN
+            return statuscode, msg
+
+    def querydbconnpoolusetime(self, jndiname=None, warning=10, critical=30, top=5):
+        if len(self.connpoolsusetime) == 0 or self.connpoolsusetime is None:
+            return UNKNOWN, 'Could not find DB Connection Pool Use Time metrics for server {}'.format(self.name)
+        elif jndiname is None:
+            return UNKNOWN, 'Please set datasource JNDI name using -j JndiName'
+        elif iswildcard(jndiname):
+            return self.querydbconnpoolmatches('DB Connection Pool Use Time', self.connpoolsusetime, jndiname,
+                                               'usetime', 's', warning, critical, top)
+        else:
+            if jndiname in self.connpoolsusetime:
+                statuscode = OK
+                usetime = self.connpoolsusetime[jndiname]
+                msg = 'DB Connection Pool Use Time - {jndi} {usets} seconds|' \
+                      '{jndi}_usetime={usets}s;{warn};{crit};0' \
+                    .format(jndi=jndiname, usets=usetime, warn=warning, crit=critical)
+                if warning < usetime < critical:
+                    statuscode = WARNING
+                if critical <= usetime:
+                    statuscode = CRITICAL
+            else:
+                statuscode = UNKNOWN
+                msg = 'No DB Connection Pool for {jndi} was found'.format(jndi=jndiname)
+            return statuscode, msg
+
+    def querydbconnpoolwaittime(self, jndiname=None, warning=5, critical=10, top=5):
+        if len(self.connpoolswaittime) == 0 or self.connpoolswaittime is None:
+            return UNKNOWN, 'Could not find DB Connection Pool Wait Time metrics for server {}'.format(self.name)
+        elif jndiname is None:
+            return UNKNOWN, 'Please set datasource JNDI name using -j JndiName'
+        elif iswildcard(jndiname):
+            return self.querydbconnpoolmatches('DB Connection Pool Wait Time', self.connpoolswaittime, jndiname,
+                                               'waittime', 's', warning, critical, top)
+        else:
+            if jndiname in self.connpoolswaittime:
+                statuscode = OK
+                waittime = self.connpoolswaittime[jndiname]
+                msg = 'DB Connection Pool Wait Time - {jndi} {waitts} seconds|' \
+                      '{jndi}_waittime={waitts}s;{warn};{crit};0' \
+                    .format(jndi=jndiname, waitts=waittime, warn=warning, crit=critical)
+                if warning < waittime < critical:
+                    statuscode = WARNING
+                if critical <= waittime:
+                    statuscode = CRITICAL
+            else:
+                statuscode = UNKNOWN
+                msg = 'No DB Connection Pool for {jndi} was found'.format(jndi=jndiname)
+            return statuscode, msg
+
+    def querydbconnpoolwaitingthreadcount(self, jndiname=None, warning=5, critical=10, top=5):
+        if len(self.connpoolswaitingthreadcount) == 0 or self.connpoolswaitingthreadcount is None:
+            return UNKNOWN, 'Could not find DB Connection Pool Waiting Threads Count metrics for server {}' \
+                .format(self.name)
+        elif jndiname is None:
+            return UNKNOWN, 'Please set datasource JNDI name using -j JndiName'
+        elif iswildcard(jndiname):
+            return self.querydbconnpoolmatches('DB Connection Pool Waiting Threads Count',
+                                               self.connpoolswaitingthreadcount, jndiname, 'waitthreads', '', warning,
+                                               critical, top)
+        else:
+            if jndiname in self.connpoolswaitingthreadcount:
+                statuscode = OK
+                waitingthreadcount = self.connpoolswaitingthreadcount[jndiname]
+                msg = 'DB Connection Pool Waiting Threads Count - {jndi} {waitthrcount}|' \
+                      '{jndi}_waitthreads={waitthrcount};{warn};{crit};0' \
+                    .format(jndi=jndiname, waitthrcount=waitingthreadcount, warn=warning, crit=critical)
+                if warning < waitingthreadcount < critical:
+                    statuscode = WARNING
+                if critical <= waitingthreadcount:
+                    statuscode = CRITICAL
+            else:
+                statuscode = UNKNOWN
+                msg = 'No DB Connection Pool for {jndi} was found'.format(jndi=jndiname)
+            return statuscode, msg
+
+    def querydbconnpoolmatches(self, title, values, pattern, label, unit, warning, critical, top=5):
+        """
+        Check all the connection pools with a JNDI name matching a wildcard pattern in one pass
+        :param values: JNDI name -> value of the checked metric
+        :param label: The perfdata label suffix of the metric
+        :param unit: The perfdata unit of the metric
+        :param top: Number of the worst pools reported in the message, perfdata are reported for all of them
+        :return: Nagios Message of the worst pool
+        """
+        results = []
+        for jndiname in matchnames(values, pattern):
+            value = int(values[jndiname])
+            status = OK
+            if warning < value < critical:
+                status = WARNING
+            if critical <= value:
+                status = CRITICAL
+            results.append((status, value, '{} {}{}'.format(jndiname, value, unit),
+                            '{jndi}_{label}={value}{unit};{warn};{crit};0'
+                            .format(jndi=jndiname, label=label, value=value, unit=unit, warn=warning, crit=critical)))
+        if len(results) == 0:
+            return UNKNOWN, 'No DB Connection Pool matching {} was found'.format(pattern)
+        return reportmatches(title, 'pools', pattern, results, top)
+
+    def queryheapusage(self, warning=75, critical=90, aggregate=None):
+        if self.heapusedMB is None or self.maxheapMB is None:
+            return UNKNOWN, 'Could not find Heap Usage metrics for server {}'.format(self.name)
+        elif aggregate is not None:
+            if 'Heap:' + aggregate not in self.aggregates:
+                return UNKNOWN, 'Could not find Heap Usage {} over the collection window for server {}' \
+                    .format(aggregate, self.name)
+            percentused = int(self.aggregates['Heap:' + aggregate])
+            msg = 'Heap Usage {agg} over {wnd} seconds: {heappc}%, now {heapused}/{maxheap} MB|' \
+                  'heapusage_{agg}={heappc}%;{warn};{crit} usedheap={heapused}MB;;;0;{maxheap}' \
+                .format(agg=aggregate, wnd=int(self.aggregates['Window']), heapused=self.heapusedMB,
+                        maxheap=self.maxheapMB, heappc=percentused, warn=warning, crit=critical)
+        else:
+            percentused = int(float(self.heapusedMB) / float(self.maxheapMB) * 100)
+            msg = 'Heap Usage: {heapused}/{maxheap} MB ({heappc}%)|' \
+                  'heapusage={heappc}%;{warn};{crit} usedheap={heapused}MB;;;0;{maxheap}' \
+                .format(heapused=self.heapusedMB, maxheap=self.maxheapMB, heappc=percentused, warn=warning,
+                        crit=critical)
+        if warning < percentused < critical:
+            return WARNING, msg
+        elif percentused >= critical:
+            return CRITICAL, msg
+        else:
+            return OK, msg
+
+    def querysecauthen(self, warning=2, critical=5):
+        if self.webSecAuthenTime is None:
+            return UNKNOWN, 'Could not find Web Authentication Time metrics for server {}'.format(self.name)
+        else:
+            websecauthentime = self.webSecAuthenTime
+            msg = 'Web Authentication Time: {wsecauthtime} seconds|websecauthentime={wsecauthtime}s;{warn};{crit}' \
+                .format(wsecauthtime=self.webSecAuthenTime, warn=warning, crit=critical)
+            if warning < websecauthentime < critical:
+                return WARNING, msg
+            elif websecauthentime >= critical:
+                return CRITICAL, msg
+            else:
+                return OK, msg
+
+    def querysecauthor(self, warning=2, critical=5):
+        if self.webSecAuthorTime is None:
+            return UNKNOWN, 'Could not find Web Authorization Time metrics for server {}'.format(self.name)
+        else:
+            websecauthortime = self.webSecAuthorTime
+            msg = 'Web Authorization Time: {wsecauthortime} seconds|websecauthortime={wsecauthortime}s;{warn};{crit}' \
+                .format(wsecauthortime=self.webSecAuthorTime, warn=warning, crit=critical)
+            if warning < websecauthortime < critical:
+                return WARNING, msg
+            elif websecauthortime >= critical:
+                return CRITICAL, msg
+            else:
+                return OK, msg
+
+    def querylivesessions(self, warning=None, critical=None):
+        # TODO Implement threshold checking
+        if len(self.livesessions) == 0 or self.totallivesessions is None:
+            return UNKNOWN, 'Could not find Live Session metrics for server {}'.format(self.name)
+        else:
+            msg = 'live sessions: total {totalsessions}'.format(totalsessions=self.totallivesessions)
+            perfdata = '|totallivesessions={totalsessions};;;0'.format(totalsessions=self.totallivesessions)
+            for appmodule in self.livesessions:
+                msg += ' , {mod} {livesessions!s}'.format(mod=appmodule, livesessions=self.livesessions[appmodule])
+                perfdata += " '{mod}_sessions'={livesessions!s};;;0" \
+                    .format(mod=appmodule, livesessions=self.livesessions[appmodule])
+            msg += perfdata
+            return OK, msg
+
+    def queryextra(self, name=None, warning=None, critical=None):
+        if name is None:
+            return UNKNOWN, 'Please set the Extra metric name using -e ExtraName'
+        if name in self.extras:
+            values = {name: self.extras[name]}
+        else:
+            # An Extra metric with a * in its Stat path has one value per matched Stat
+            values = dict((extraname, value) for extraname, value in self.extras.items()
+                          if extraname.startswith(name + ':'))
+        if len(values) == 0:
+            return UNKNOWN, 'Could not find Extra metric {} for server {}'.format(name, self.name)
+        statuscode = OK
+        msg = ''
+        perfdata = '|'
+        for extraname in sorted(values):
+            value = values[extraname]
+            msg += '{}{} {}'.format(' - ' if msg else '', extraname, formatvalue(value))
+            perfdata += "'{}'={};{};{} ".format(extraname, formatvalue(value), '' if warning is None else warning,
+                                               '' if critical is None else critical)
+            if critical is not None and value >= critical:
+                statuscode = CRITICAL
+            elif warning is not None and value > warning and statuscode == OK:
+                statuscode = WARNING
+        return statuscode, msg + perfdata.rstrip()
+
+    def querysibdestination(self, destname=None, warning=10, critical=100, top=5):
+        if len(self.destinations) == 0 or self.destinations is None:
+            if len(self.messageengines) > 0:
+                return OK, 'Inactive SIB Message Engine'
+            else:
+                return UNKNOWN, 'Could not find requested Destination metrics for server {}'.format(self.name)
+        elif destname is None:
+            return UNKNOWN, 'Please set Destination name using -d DestName'
+        elif iswildcard(destname):
+            return self.querysibdestinationmatches(destname, warning, critical, top)
+        elif destname not in self.destinations:
+            return UNKNOWN, 'No SIB Destination {} was found for server {}'.format(destname, self.name)
+        else:
+            destination = self.destinations[destname]
+            msg = 'Destination:{dname} - Available Messages:{davail} , Messages Consumed:{dtotalmsgcon} ' \
+                .format(dname=destination.Name, davail=destination.AvailableMessages,
+                        dtotalmsgcon=destination.TotalMessagesConsumed)
+            consumerate = self.rates.get('Consumed:' + destination.Name)
+            if consumerate is not None:
+                msg += ', Messages Consumed/s:{:.2f} '.format(consumerate)
+            if isinstance(destination, SIBTopicSpace) and len(destination.subscribers) > 0:
+                msg += ' , Durable Subscribers:'
+                for subscriber in destination.subscribers:
+                    msg += '%s ' % subscriber
+            msg += '|{dname}_AvailMsgs={davail};{warn};{crit};0 {dname}_ConsumMsgs={dtotalmsgcon};;;0' \
+                .format(dname=destination.Name,
+                        davail=destination.AvailableMessages,
+                        dtotalmsgcon=destination.TotalMessagesConsumed,
+                        warn=warning,
+                        crit=critical)
+            if consumerate is not None:
+                msg += ' {dname}_ConsumRate={rate:.2f};;;0'.format(dname=destination.Name, rate=consumerate)
+            return thresholdstatus(destination.AvailableMessages, warning, critical), msg
+
+    def querysibdestinationmatches(self, pattern, warning=10, critical=100, top=5):
+        """
+        Check all the SIB destinations with a name matching a wildcard pattern in one pass
+        :param top: Number of the worst destinations reported in the message, perfdata are reported for all of them
+        :return: Nagios Message of the worst destination
+        """
+        results = []
+        for destname in matchnames(self.destinations, pattern):
+            destination = self.destinations[destname]
+            if destination.AvailableMessages is None:
+                continue
+            status = thresholdstatus(destination.AvailableMessages, warning, critical)
+            perfdata = '{dname}_AvailMsgs={davail};{warn};{crit};0 {dname}_ConsumMsgs={dtotalmsgcon};;;0' \
+                .format(dname=destname, davail=destination.AvailableMessages,
+                        dtotalmsgcon=destination.TotalMessagesConsumed, warn=warning, crit=critical)
+            consumerate = self.rates.get('Consumed:' + destname)
+            if consumerate is not None:
+                perfdata += ' {dname}_ConsumRate={rate:.2f};;;0'.format(dname=destname, rate=consumerate)
+            results.append((status, destination.AvailableMessages,
+                            '{} {}'.format(destname, destination.AvailableMessages), perfdata))
+        if len(results) == 0:
+            return UNKNOWN, 'No SIB Destination matching {} was found for server {}'.format(pattern, self.name)
+        return reportmatches('SIB Destinations Available Messages', 'destinations', pattern, results, top)
+
+
+def thresholdstatus(value, warning, critical):
+    """Nagios status of a value, WARNING above the warning threshold and CRITICAL from the critical one on"""
+    if value >= critical:
+        return CRITICAL
+    elif value > warning:
+        return WARNING
+    else:
+        return OK
+
+
+def iswildcard(name):
+    """Whether a name contains shell style wildcards"""
+    return any(char in name for char in '*?[')
+
+
+def matchnames(names, pattern):
+    """
+    :param names: The JNDI names of the connection pools or the names of the SIB destinations
+    :param pattern: A name, which may contain shell style wildcards
+    :return: The sorted names matching the pattern
+    """
+    from fnmatch import fnmatchcase
+    if not iswildcard(pattern):
+        return [pattern] if pattern in names else []
+    return sorted(name for name in names if fnmatchcase(name, pattern))
+
+
+def reportmatches(title, kind, pattern, results, top=5):
+    """
+    Nagios Message of the many pools or destinations matching a wildcard pattern
+    :param kind: What is matched, e.g. pools
+    :param results: (status, value, text, perfdata) of each match
+    :param top: Number of the worst matches reported in the message, by status then by value
+    :return: The worst status and the message of the top matches with the perfdata of all the matches
+    """
+    ranking = [OK, WARNING, UNKNOWN, CRITICAL]
+    worst = sorted(results, key=lambda result: (ranking.index(result[0]), result[1]), reverse=True)[:top]
+    msg = '{} top {} of {} {} {}: {}|'.format(title, len(worst), len(results), kind, pattern,
+                                                ', '.join(result[2] for result in worst))
+    msg += ' '.join(result[3] for result in results)
+    return worststatus(result[0] for result in results), msg
+
+
+# ############################################################################################################
+def parseperfxml(path, cellname, workers=1):
+    """
+    Parse the perfsevlet xml and store the needed metrics(defined in STATRULES) for all WAS servers
+    of the Cell in a snapshot file
+    :param path: Where to store the perfserv xml and the snapshot file
+    :param cellname: The name of the WAS Cell
+    :param workers: Parse the perfservlet xml in this many processes, default a serial parse
+    :raise:
+    """
+    xmlfilename = path + cellname + '.xml'
+    snapshotfilename = path + cellname + '.snap'
+    if workers > 1:
+        with open(xmlfilename, 'rb') as xmlfile:
+            responsestatus, servers = readperfxmlparallel(xmlfile.read(), workers)
+    else:
+        responsestatus, servers = readperfxml(xmlfilename)
+    storeperfservers(snapshotfilename, servers)
+
+
+def storeperfservers(snapshotfilename, servers, collected=None, historyfilename=None, historysamples=0,
+                     window=None, keep=()):
+    """
+    Store the parsed WAS servers of the Cell in a new generation of the snapshot file
+    :param snapshotfilename: The snapshot file
+    :param servers: An iterable of TypicalApplicationServer instances
+    :param collected: Timestamp of the perfservlet data collection, default now
+    :param historyfilename: The history file the counters are recorded in, to store their rates as well
+    :param historysamples: Samples kept per counter in the history file, default no history
+    :param window: Seconds of history the aggregates of the usage percentages are computed over, default none
+    :param keep: Servers stored as they are, without recording their counters in the history, e.g. the servers of
+    the failed Nodes of a sharded retrieval
+    :return: The number of servers whose metrics changed and were written, and the number of unchanged servers
+    """
+    collected = time.time() if collected is None else collected
+    history = PerfHistory(historyfilename, historysamples) if historysamples else None
+    try:
+        with PerfSnapshotWriter(snapshotfilename, collected, derived=history is not None) as snapshot:
+            for was in servers:
+                # Comment out for debug purposes
+                # was.printserver()
+                if history is not None:
+                    recordrates(history, was, collected)
+                    if window:
+                        recordaggregates(history, was, collected, window)
+                snapshot.add(was)
+            for was in keep:
+                snapshot.add(was)
+    finally:
+        if history is not None:
+            history.close()
+    return snapshot.changed, snapshot.skipped
+
+
+def readperfxml(source, stats=None, statindex=None):
+    """
+    Start streaming the perfservlet xml. The root tag is read right away, so that the perfservlet response status
+    is known before any Server is parsed
+    :param source: The perfservlet xml file name or a file object to read it from, e.g. the perfservlet response
+    :param stats: PerfRetrievalStats instance counting the parsed Stat tags, default none
+    :param statindex: StatPathIndex of the stat rules to apply, default the built in ones
+    :return: The perfservlet responseStatus and a generator of the Cell TypicalApplicationServer instances
+    """
+    from xml.etree.ElementTree import iterparse
+    events = iterparse(source, events=('start', 'end'))
+    event, root = next(events)
+    return root.attrib.get('responseStatus'), iterperfservers(events, stats, statindex)
+
+
+def iterperfservers(events, stats=None, statindex=None):
+    """
+    Yield one populated WAS Server at a time out of the perfservlet xml parse events.
+    Each element is dispatched once, as it streams in, to the stat rules of the enclosing Stat path.
+    Each Server tag is discarded as soon as it is complete, so memory usage is bounded
+    by the largest Server subtree instead of the whole Cell document
+    :param events: iterparse start and end events of the perfservlet xml
+    :param stats: PerfRetrievalStats instance counting the parsed Stat tags, default none
+    :param statindex: StatPathIndex of the stat rules to apply, default the built in ones
+    :return: A generator of TypicalApplicationServer instances
+    """
+    if statindex is None:
+        statindex = StatPathIndex()
+    node = None
+    was = None
+    # The trie states of the enclosing Stats, innermost last
+    states = [[]]
+    nostats = 0
+    for event, elem in events:
+        if event == 'start':
+            if elem.tag == 'Stat':
+                nostats += 1
+                states.append(statindex.enter(states[-1], elem.attrib.get('name')) if was is not None else [])
+            elif states[-1]:
+                statindex.dispatch(states[-1], was, elem)
+            elif elem.tag == 'Server' and node is not None:
+                was = TypicalApplicationServer(sys.intern(elem.attrib['name']), sys.intern(node.attrib['name']))
+                nostats = 0
+            elif elem.tag == 'Node':
+                node = elem
+        elif elem.tag == 'Stat':
+            statindex.leave(states.pop(), was, elem)
+        elif elem.tag == 'Server' and was is not None:
+            if stats is not None:
+                stats.stats += nostats
+            # Free the parsed Server subtree before moving on to the next one
+            elem.clear()
+            yield was
+            was = None
+        elif elem.tag == 'Node' and node is not None:
+            node.clear()
+            node = None
+
+
+def splitperfxml(data, partitions):
+    """
+    Split the perfservlet xml at Node boundaries, and large Nodes at Server boundaries, into well formed documents
+    of about the same size, each holding whole Servers under their Node tag
+    :param data: The perfservlet xml bytes
+    :param partitions: The number of documents aimed at
+    :return: The list of perfservlet xml documents, in the order of their Servers in the perfservlet xml
+    """
+    first = data.find(b'<Node ')
+    if first < 0:
+        return [data]
+    prologue, rootend = data[:first], data.rfind(b'</')
+    epilogue = data[rootend:]
+    target = max(1, (rootend - first) // partitions)
+    # (Node start tag, Servers) pieces of the Nodes
+    pieces = []
+    nodestart = first
+    while nodestart >= 0:
+        tagend = data.index(b'>', nodestart) + 1
+        if data[tagend - 2:tagend] == b'/>':
+            nodestart = data.find(b'<Node ', tagend, rootend)
+            continue
+        nodeend = data.index(b'</Node>', tagend)
+        start = tagend
+        while start < nodeend:
+            cut = data.find(b'<Server ', start + target, nodeend)
+            cut = nodeend if cut < 0 else cut
+            pieces.append((data[nodestart:tagend], data[start:cut]))
+            start = cut
+        nodestart = data.find(b'<Node ', nodeend, rootend)
+    documents, document, size = [], [], 0
+    for nodetag, servers in pieces:
+        document.extend((nodetag, servers, b'</Node>'))
+        size += len(servers)
+        if size >= target:
+            documents.append(b''.join([prologue] + document + [epilogue]))
+            document, size = [], 0
+    if document:
+        documents.append(b''.join([prologue] + document + [epilogue]))
+    return documents
+
+
+def parseperfxmlpartition(document, extrarules=()):
+    """
+    Parse a document of splitperfxml, in a worker process
+    :param document: The perfservlet xml bytes of whole Servers
+    :param extrarules: StatRules of extra metrics, applied besides the built in ones
+    :return: The list of TypicalApplicationServer instances and the number of parsed Stat tags
+    """
+    import io
+    stats = PerfRetrievalStats()
+    responsestatus, servers = readperfxml(io.BytesIO(document), stats, StatPathIndex(extrarules))
+    servers = list(servers)
+    return servers, stats.stats
+
+
+def readperfxmlparallel(data, workers, stats=None, statindex=None):
+    """
+    Parse the perfservlet xml in a pool of processes, one partition of whole Servers each, see splitperfxml
+    :param data: The perfservlet xml bytes
+    :param workers: The number of worker processes
+    :param stats: PerfRetrievalStats instance counting the parsed Stat tags, default none
+    :param statindex: StatPathIndex of the stat rules to apply, default the built in ones
+    :return: The perfservlet responseStatus and a generator of the Cell TypicalApplicationServer instances, in the
+    order of the perfservlet xml
+    """
+    import io
+    documents = splitperfxml(data, workers * 4)
+    # The root tag alone tells the response status
+    first = data.find(b'<Node ')
+    responsestatus, servers = readperfxml(io.BytesIO(data[:first] + data[data.rfind(b'</'):]) if first >= 0 else
+                                          io.BytesIO(data))
+    return responsestatus, iterperfxmlpartitions(documents, workers, stats,
+                                                 statindex.extrarules if statindex is not None else ())
+
+
+def iterperfxmlpartitions(documents, workers, stats=None, extrarules=()):
+    """Yield the WAS servers parsed by the worker processes, partition after partition"""
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=min(workers, len(documents))) as executor:
+        for servers, nostats in executor.map(parseperfxmlpartition, documents, [extrarules] * len(documents)):
+            if stats is not None:
+                stats.stats += nostats
+            for was in servers:
+                yield was
+
+
+def toint(value):
+    """The perfservlet attribute strings are converted once, as they are parsed"""
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def kilobytestomb(value):
+    return int(value) // 1024
+
+
+def mstoseconds(value):
+    return int(value) // 1000
+
+
+class StatRule:
+    """Stores an attribute of the PMI statistics found under a Stat path in a field of the WAS server"""
+
+    def __init__(self, path, statistic, attribute, field, convert=None, name=None):
+        """
+        :param path: The names of the Stats enclosing the statistic, innermost last. The path matches at any depth
+        below the Server and * matches any Stat name
+        :param statistic: The name of the statistic
+        :param attribute: The attribute of the statistic, None for its count or else its value
+        :param field: The TypicalApplicationServer attribute the value is stored in. When the path has a *, the field
+        is a dict and the value is stored under the Stat name matched by the innermost *
+        :param convert: Conversion of the attribute text, default keep the text
+        :param name: Store the value in the field dict under this name, suffixed by :<Stat name> when the path has a *
+        """
+        self.path = tuple(path)
+        self.statistic = statistic
+        self.attribute = attribute
+        self.field = field
+        self.convert = convert
+        self.name = name
+
+    def apply(self, was, statistic, key):
+        """
+        :param was: The TypicalApplicationServer instance
+        :param statistic: The statistic element
+        :param key: The Stat name matched by the innermost * of the path, None without a *
+        """
+        if self.attribute is None:
+            value = statistic.attrib.get('count', statistic.attrib.get('value'))
+        else:
+            value = statistic.attrib.get(self.attribute)
+        if value is None:
+            return
+        if self.convert is not None:
+            value = self.convert(value)
+        if key is not None:
+            # The same pool, module and Stat names repeat over all the servers of the Cell
+            key = sys.intern(key)
+        if self.name is not None:
+            getattr(was, self.field)[self.name if key is None else '{}:{}'.format(self.name, key)] = value
+        elif key is not None:
+            getattr(was, self.field)[key] = value
+        else:
+            setattr(was, self.field, value)
+
+
+# The perfservlet metrics stored for all WAS servers
+STATRULES = [StatRule(['JVM Runtime'], 'HeapSize', 'upperBound', 'maxheapMB', kilobytestomb),
+             StatRule(['JVM Runtime'], 'UsedMemory', 'count', 'heapusedMB', kilobytestomb),
+             StatRule(['Security Authentication'], 'WebAuthenticationTime', 'max', 'webSecAuthenTime', mstoseconds),
+             StatRule(['Security Authorization'], 'WebAuthorizationTime', 'max', 'webSecAuthorTime', mstoseconds),
+             StatRule(['WebContainer'], 'ActiveCount', 'value', 'wcactive', toint),
+             StatRule(['WebContainer'], 'PoolSize', 'upperBound', 'wcpoolsize', toint),
+             StatRule(['WebContainer'], 'DeclaredThreadHungCount', 'count', 'wcthreadshung', toint),
+             StatRule(['Object Request Broker'], 'ActiveCount', 'value', 'orbactive', toint),
+             StatRule(['Object Request Broker'], 'PoolSize', 'upperBound', 'orbpoolsize', toint),
+             StatRule(['JDBC Connection Pools', '*', '*'], 'PercentUsed', 'value', 'connpoolspercentused', toint),
+             StatRule(['JDBC Connection Pools', '*', '*'], 'WaitingThreadCount', 'value',
+                      'connpoolswaitingthreadcount', toint),
+             StatRule(['JDBC Connection Pools', '*', '*'], 'UseTime', 'max', 'connpoolsusetime', mstoseconds),
+             StatRule(['JDBC Connection Pools', '*', '*'], 'WaitTime', 'max', 'connpoolswaittime', mstoseconds),
+             StatRule(['Servlet Session Manager', '*'], 'ActiveCount', 'value', 'activesessions', toint),
+             StatRule(['Servlet Session Manager', '*'], 'LiveCount', 'value', 'livesessions', toint),
+             StatRule(['Servlet Session Manager'], 'ActiveCount', 'value', 'totalactivesessions', toint),
+             StatRule(['Servlet Session Manager'], 'LiveCount', 'value', 'totallivesessions', toint)
+             ]
+# Stats parsed as a whole once complete, by Stat path
+STATHANDLERS = {('SIB Service',): lambda was, stat: parsesibstats(was, stat)}
+# Stats never matched by a *, i.e. the modules of the perfservlet application itself
+IGNOREDSTATS = 'perfServletApp'
+
+
+def readstatmap(statmapfilename):
+    """
+    Read the extra metrics of a stat map file, an ini file with one section per extra metric, e.g.
+    [DefaultThreadPoolActive]
+    path = Thread Pools/Default
+    statistic = ActiveCount
+    attribute = value
+    The path lists the names of the Stats enclosing the statistic, separated by /, and matches at any depth below
+    the Server. A * matches any Stat name, the metric then has one value per matched Stat.
+    The attribute is optional, default the count or else the value of the statistic
+    :param statmapfilename: The stat map file
+    :return: A list of StatRule instances, storing the extra metrics by section name
+    :raise ValueError: On an invalid stat map file
+    """
+    import configparser
+    config = configparser.ConfigParser()
+    try:
+        if not config.read(statmapfilename):
+            raise IOError('Could not read {}'.format(statmapfilename))
+        rules = []
+        for name in config.sections():
+            path = [statname.strip() for statname in config.get(name, 'path').split('/') if statname.strip()]
+            if not path:
+                raise ValueError('Empty Stat path of extra metric {}'.format(name))
+            rules.append(StatRule(path, config.get(name, 'statistic'), config.get(name, 'attribute', fallback=None),
+                                  'extras', float, name))
+    except configparser.Error as error:
+        raise ValueError(str(error).replace('\n', ' '))
+    return rules
+
+
+class StatPathNode:
+    """A Stat name of the StatPathIndex trie"""
+
+    def __init__(self):
+        self.children = {}
+        # Stat rules by statistic name
+        self.rules = {}
+        self.handler = None
+
+
+class StatPathIndex:
+    """
+    The stat rules compiled once into a trie of their Stat paths. While the perfservlet xml streams in, each Stat
+    moves the trie states of its enclosing Stat one level down and each statistic is dispatched with a dict lookup
+    in the rules of the current states, so no subtree is scanned twice whatever the number of rules
+    """
+
+    def __init__(self, extrarules=()):
+        """
+        :param extrarules: StatRules of extra metrics, applied besides the built in ones
+        """
+        self.root = StatPathNode()
+        self.extrarules = tuple(extrarules)
+        for rule in list(STATRULES) + list(extrarules):
+            self.node(rule.path).rules.setdefault(rule.statistic, []).append(rule)
+        for path, handler in STATHANDLERS.items():
+            self.node(path).handler = handler
+
+    def node(self, path):
+        node = self.root
+        for name in path:
+            node = node.children.setdefault(name, StatPathNode())
+        return node
+
+    def enter(self, states, name):
+        """
+        :param states: The (trie node, innermost * Stat name) states of the enclosing Stat
+        :param name: The name of the Stat entered
+        :return: The states of the Stat entered, a path may start at any Stat
+        """
+        entered = []
+        for node, key in states + [(self.root, None)]:
+            child = node.children.get(name)
+            if child is not None:
+                entered.append((child, key))
+            child = node.children.get('*')
+            if child is not None and name is not None and not name.startswith(IGNOREDSTATS):
+                entered.append((child, name))
+        return entered
+
+    def dispatch(self, states, was, statistic):
+        """Apply the rules of the statistic, under the Stat of the given states"""
+        name = statistic.attrib.get('name')
+        for node, key in states:
+            for rule in node.rules.get(name, ()):
+                rule.apply(was, statistic, key)
+
+    def leave(self, states, was, stat):
+        """Run the handlers of a complete Stat"""
+        for node, key in states:
+            if node.handler is not None:
+                node.handler(was, stat)
+
+
+def parsesibstats(was, stat):
+    """
+    Parse SIB Statistics found in  perfservlet xml and attach them in WAS Object instance
+    :param was: Current Typical Application Server instance
+    :param stat: Stat tags in perfservlet xml under the specific Server tag
+    """
+    sibmes = stat.find(".//Stat[@name='SIB Messaging Engines']")
+    sibme = sibmes.findall('./Stat')
+    # Assume 1-to-1 relationship of ME and WAS JVM
+    if len(sibme) > 0:
+        sibmename = sys.intern(sibme[0].attrib['name'])
+
+        queuesnode = stat.find(".//Stat[@name='Queues']")
+        if queuesnode is not None:
+            for queue in queuesnode.findall('./Stat'):
+                queuename = sys.intern(queue.attrib['name'])
+                totammsgsconsumed = queue.find(
+                    "./CountStatistic[@name='QueueStats.TotalMessagesConsumedCount']")
+                availablemsgs = queue.find("./CountStatistic[@name='QueueStats.AvailableMessageCount']")
+                if totammsgsconsumed is not None and availablemsgs is not None:
+                    sibqueue = SIBQueue(queuename, sibmename, toint(totammsgsconsumed.attrib['count']),
+                                        toint(availablemsgs.attrib['count']))
+                    was.adddestination(sibqueue)
+        topicspacesnode = stat.find(".//Stat[@name='Topicspaces']")
+        if topicspacesnode is not None:
+            # Loop over each topic space
+            for topicspace in topicspacesnode.findall('./Stat'):
+                topicspname = sys.intern(topicspace.attrib['name'])
+                totammsgsconsumed = topicspace.find(
+                    "./Stat/CountStatistic[@name='DurableSubscriptionStats.TotalMessagesConsumedCount']")
+                availablemsgs = topicspace.find(
+                    "./Stat/CountStatistic[@name='DurableSubscriptionStats.AvailableMessageCount']")
+                if totammsgsconsumed is not None and availablemsgs is not None:
+                    sibtopic = SIBTopicSpace(topicspname, sibmename, toint(totammsgsconsumed.attrib['count']),
+                                             toint(availablemsgs.attrib['count']))
+                    for durablesub in topicspace.findall("./Stat[@name='Durable Subscriptions']/Stat"):
+                        dursubname = sys.intern(durablesub.attrib['name'])
+                        sibtopic.adddurablesubscriber(dursubname)
+                    was.adddestination(sibtopic)
+        # Case of inactive SIB Message Engine
+        if queuesnode is None and topicspacesnode is None:
+            was.addsibme(sibmename)
+
+
+# #################################################################################################################
+# Snapshot file layout, all numbers little endian:
+#   header: magic, version, reserved, number of servers, offset of the index, generation, collection timestamp,
+#           offset of the columns, generation of the base snapshot of a delta file(0 for a base snapshot),
+#           offset of the derived values(0 when no server has any)
+#   records: one per WAS server, starting with its serverfullname, holding the metrics as perfservlet reports them
+#   index: (record offset, record length, record digest) per server, sorted by serverfullname
+#   columns: number of columns, then per column its name and one double per server, in index order
+#   derived values: number of servers, then (offset, length) of the derived values of each server, then the values:
+#                   the rates and aggregates computed out of the history, only written when a history is kept
+# A snapshot file is never modified once published, a new generation replaces it with an atomic rename. Only the
+# collection timestamp of the current generation is updated in place, when a collection did not change anything.
+# A new generation where few servers changed is published as a delta file(<cell>.delta) of the same layout, holding
+# only the records which differ from the base snapshot file(<cell>.snap); readers overlay it on its base snapshot.
+# The derived values of a delta file cover all the servers of its base snapshot, in the base snapshot index order
+SNAPSHOT_MAGIC = b'PSMS'
+SNAPSHOT_VERSION = 8
+SNAPSHOT_HEADER = struct.Struct('<4sHHIQQdQQQ')
+SNAPSHOT_COLLECTEDOFFSET = struct.calcsize('<4sHHIQQ')
+SNAPSHOT_INDEXENTRY = struct.Struct('<QI8s')
+SNAPSHOT_DERIVEDENTRY = struct.Struct('<QI')
+# A new base snapshot is written once more than this fraction of the servers differ from the base snapshot
+SNAPSHOT_DELTARATIO = 0.5
+# Marks a numeric field without value
+SNAPSHOT_NULL = -2 ** 63
+# Fixed layout numeric fields of a WAS server record
+SNAPSHOT_SCALARS = ('maxheapMB', 'heapusedMB', 'wcpoolsize', 'wcactive', 'wcthreadshung', 'orbpoolsize', 'orbactive',
+                    'totalactivesessions', 'totallivesessions', 'webSecAuthenTime', 'webSecAuthorTime')
+SNAPSHOT_SCALARS_STRUCT = struct.Struct('<{}q'.format(len(SNAPSHOT_SCALARS)))
+# Name -> numeric value fields of a WAS server record
+SNAPSHOT_NAMEDVALUES = ('connpoolspercentused', 'connpoolsusetime', 'connpoolswaittime', 'connpoolswaitingthreadcount',
+                        'activesessions', 'livesessions')
+# Name -> floating point value fields of a WAS server record
+SNAPSHOT_NAMEDREALS = ('extras',)
+# Name -> floating point value fields of a WAS server derived out of the history, kept apart from its record
+SNAPSHOT_DERIVED = ('rates', 'aggregates')
+# The show Metric Types kept as one value per server column, for the checks over many servers
+SNAPSHOT_COLUMNS = ('Heap', 'WebContainer', 'WebContainerThreadHung', 'ORB', 'DBConnectionPoolPercentUsed',
+                    'LiveSessions', 'WebAuthenticationTime', 'WebAuthorizationTime')
+
+
+def packsnapshotint(value):
+    """Snapshot representation of a numeric metric, perfservlet attribute strings included"""
+    if value is None:
+        return SNAPSHOT_NULL
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def packsnapshotstr(value):
+    """Snapshot representation of a name"""
+    data = value.encode('utf-8')
+    return struct.pack('<H', len(data)) + data
+
+
+def packserver(was):
+    """
+    Encode a WAS server as a snapshot record
+    :param was: A TypicalApplicationServer instance
+    :return: The snapshot record bytes
+    """
+    record = [packsnapshotstr(was.serverfullname()), packsnapshotstr(was.name), packsnapshotstr(was.nodename),
+              SNAPSHOT_SCALARS_STRUCT.pack(*[packsnapshotint(getattr(was, field)) for field in SNAPSHOT_SCALARS])]
+    for field in SNAPSHOT_NAMEDVALUES:
+        namedvalues = getattr(was, field)
+        record.append(struct.pack('<H', len(namedvalues)))
+        for name in namedvalues:
+            record.append(packsnapshotstr(name))
+            record.append(struct.pack('<q', packsnapshotint(namedvalues[name])))
+    for field in SNAPSHOT_NAMEDREALS:
+        namedreals = getattr(was, field)
+        record.append(struct.pack('<H', len(namedreals)))
+        for name in namedreals:
+            record.append(packsnapshotstr(name))
+            record.append(struct.pack('<d', namedreals[name]))
+    record.append(struct.pack('<H', len(was.destinations)))
+    for destination in was.destinations.values():
+        istopicspace = isinstance(destination, SIBTopicSpace)
+        record.append(struct.pack('<B', istopicspace))
+        record.append(packsnapshotstr(destination.Name))
+        record.append(packsnapshotstr(destination.MEName))
+        record.append(struct.pack('<qq', packsnapshotint(destination.TotalMessagesConsumed),
+                                  packsnapshotint(destination.AvailableMessages)))
+        subscribers = destination.subscribers if istopicspace else []
+        record.append(struct.pack('<H', len(subscribers)))
+        record.extend(packsnapshotstr(subscriber) for subscriber in subscribers)
+    record.append(struct.pack('<H', len(was.messageengines)))
+    record.extend(packsnapshotstr(sibmename) for sibmename in was.messageengines)
+    return b''.join(record)
+
+
+def packderived(was):
+    """
+    Encode the SNAPSHOT_DERIVED values of a WAS server
+    :return: The bytes of the derived values, empty when the server has none
+    """
+    if not any(getattr(was, field) for field in SNAPSHOT_DERIVED):
+        return b''
+    derived = []
+    for field in SNAPSHOT_DERIVED:
+        namedreals = getattr(was, field)
+        derived.append(struct.pack('<H', len(namedreals)))
+        for name in namedreals:
+            derived.append(packsnapshotstr(name))
+            derived.append(struct.pack('<d', namedreals[name]))
+    return b''.join(derived)
+
+
+def unpackderived(data, was):
+    """Decode the SNAPSHOT_DERIVED values of a WAS server into its TypicalApplicationServer instance"""
+    if not data:
+        return
+    record = SnapshotRecord(data)
+    for field in SNAPSHOT_DERIVED:
+        namedreals = getattr(was, field)
+        for i in range(record.readcount()):
+            name = record.readstr()
+            namedreals[name] = record.readreal()
+
+
+def columnvalues(was):
+    """
+    The SNAPSHOT_COLUMNS values of a WAS server, as its show checks report them. A server's
+    DBConnectionPoolPercentUsed is its most used pool
+    :return: A tuple of floats, NaN for a missing value
+    """
+    nan = float('nan')
+    connpoolspercentused = [int(value) for value in was.connpoolspercentused.values() if value is not None]
+    values = dict(Heap=int(float(was.heapusedMB) / float(was.maxheapMB) * 100)
+                  if was.heapusedMB is not None and was.maxheapMB else nan,
+                  WebContainer=int(float(was.wcactive) / float(was.wcpoolsize) * 100)
+                  if was.wcactive is not None and was.wcpoolsize else nan,
+                  WebContainerThreadHung=was.wcthreadshung,
+                  ORB=int(float(was.orbactive) / float(was.orbpoolsize) * 100)
+                  if was.orbactive is not None and was.orbpoolsize else nan,
+                  DBConnectionPoolPercentUsed=max(connpoolspercentused) if connpoolspercentused else nan,
+                  LiveSessions=was.totallivesessions,
+                  WebAuthenticationTime=was.webSecAuthenTime,
+                  WebAuthorizationTime=was.webSecAuthorTime)
+    return tuple(nan if values[metric] is None else float(values[metric]) for metric in SNAPSHOT_COLUMNS)
+
+
+class SnapshotRecord:
+    """Sequential decoder of a snapshot record"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def readcount(self):
+        (count,) = struct.unpack_from('<H', self.data, self.pos)
+        self.pos += 2
+        return count
+
+    def readstr(self):
+        length = self.readcount()
+        value = self.data[self.pos:self.pos + length].decode('utf-8')
+        self.pos += length
+        return value
+
+    def readname(self):
+        """A name repeated over the servers of the Cell, e.g. a JNDI, module or destination name"""
+        return sys.intern(self.readstr())
+
+    def readint(self):
+        (value,) = struct.unpack_from('<q', self.data, self.pos)
+        self.pos += 8
+        return None if value == SNAPSHOT_NULL else value
+
+    def readreal(self):
+        (value,) = struct.unpack_from('<d', self.data, self.pos)
+        self.pos += 8
+        return value
+
+    def readscalars(self):
+        values = SNAPSHOT_SCALARS_STRUCT.unpack_from(self.data, self.pos)
+        self.pos += SNAPSHOT_SCALARS_STRUCT.size
+        return [None if value == SNAPSHOT_NULL else value for value in values]
+
+
+def unpackserver(data):
+    """
+    Decode a snapshot record
+    :param data: The snapshot record bytes
+    :return: A TypicalApplicationServer instance
+    """
+    record = SnapshotRecord(data)
+    record.readstr()
+    was = TypicalApplicationServer(record.readname(), record.readname())
+    for field, value in zip(SNAPSHOT_SCALARS, record.readscalars()):
+        setattr(was, field, value)
+    for field in SNAPSHOT_NAMEDVALUES:
+        namedvalues = getattr(was, field)
+        for i in range(record.readcount()):
+            name = record.readname()
+            namedvalues[name] = record.readint()
+    for field in SNAPSHOT_NAMEDREALS:
+        namedreals = getattr(was, field)
+        for i in range(record.readcount()):
+            name = record.readstr()
+            namedreals[name] = record.readreal()
+    for i in range(record.readcount()):
+        istopicspace = record.data[record.pos]
+        record.pos += 1
+        name, mename = record.readname(), record.readname()
+        totalmessagesconsumed, availablemessages = record.readint(), record.readint()
+        if istopicspace:
+            destination = SIBTopicSpace(name, mename, totalmessagesconsumed, availablemessages)
+        else:
+            destination = SIBQueue(name, mename, totalmessagesconsumed, availablemessages)
+        for j in range(record.readcount()):
+            destination.adddurablesubscriber(record.readname())
+        was.adddestination(destination)
+    for i in range(record.readcount()):
+        was.addsibme(record.readname())
+    return was
+
+
+def deltafilename(snapshotfilename):
+    """The delta file published along a snapshot file"""
+    return os.path.splitext(snapshotfilename)[0] + '.delta'
+
+
+class PerfSnapshotWriter:
+    """
+    Writes the WAS servers of a Cell in a new snapshot file generation. The snapshot is built in a temporary file,
+    which is published with an atomic rename on close, so that readers always see a complete snapshot without
+    any locking. The servers whose record digest matches the base snapshot are not written: when few servers changed,
+    the generation is published as a delta file of the changed servers, otherwise the unchanged records are copied
+    from the base snapshot and the generation replaces it. When nothing differs from the current generation, it is
+    kept and only its collection timestamp is updated. The derived values are left out of the digest
+    """
+
+    def __init__(self, filename, collected=None, derived=False):
+        """
+        :param filename: The snapshot file
+        :param collected: Timestamp of the perfservlet data collection, default now
+        :param derived: Write the derived values of the servers, which are computed out of a history, default False
+        """
+        self.filename = filename
+        self.deltafilename = deltafilename(filename)
+        self.tempfilename = '{}.{}.{}.tmp'.format(filename, os.getpid(), id(self))
+        self.collected = time.time() if collected is None else collected
+        try:
+            self.base = PerfSnapshotReader(filename)
+            self.generation = self.base.generation + 1
+        except (IOError, ValueError):
+            self.base = None
+            self.generation = 1
+        self.file = open(self.tempfilename, 'wb')
+        self.file.write(self.header(0, 0, 0, 0))
+        self.offset = SNAPSHOT_HEADER.size
+        self.index = {}
+        self.columns = {}
+        self.derived = {} if derived else None
+        # Servers whose record is the one of the base snapshot, and servers missing from the base snapshot
+        self.unchanged = set()
+        self.added = set()
+        # Servers whose record or derived values differ from the current generation, the delta file overlaid
+        self.differing = set()
+        self.derivedchanged = set()
+        self.changed = 0
+        self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def header(self, count, indexoffset, columnsoffset, basegeneration, derivedoffset=0):
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, count, indexoffset, self.generation,
+                                    self.collected, columnsoffset, basegeneration, derivedoffset)
+
+    def add(self, was):
+        """Append a WAS server record unless the base snapshot holds the same one, a server already added is replaced"""
+        import hashlib
+        record = packserver(was)
+        serverfullname = was.serverfullname().encode('utf-8')
+        digest = hashlib.sha1(record).digest()[:8]
+        basedigest = self.base.digest(serverfullname) if self.base is not None else None
+        self.compare(serverfullname, digest, basedigest)
+        if self.derived is not None:
+            self.derived[serverfullname] = packderived(was)
+            self.comparederived(serverfullname)
+        if digest == basedigest:
+            self.unchanged.add(serverfullname)
+            self.index.pop(serverfullname, None)
+            self.columns.pop(serverfullname, None)
+            return
+        self.unchanged.discard(serverfullname)
+        if basedigest is None:
+            self.added.add(serverfullname)
+        self.index[serverfullname] = (self.offset, len(record), digest)
+        self.columns[serverfullname] = columnvalues(was)
+        self.file.write(record)
+        self.offset += len(record)
+
+    def compare(self, serverfullname, digest, basedigest):
+        """Track whether the record differs from the current generation, which a delta file may have changed"""
+        currentdigest = self.base.delta.digest(serverfullname) if self.base is not None and \
+            self.base.delta is not None else None
+        if currentdigest is None:
+            currentdigest = basedigest
+        if digest == currentdigest:
+            self.differing.discard(serverfullname)
+        else:
+            self.differing.add(serverfullname)
+
+    def comparederived(self, serverfullname):
+        """Track whether the derived values differ from the ones of the current generation"""
+        i = self.base.position(serverfullname) if self.base is not None else None
+        if i is not None and self.derived[serverfullname] == self.base.derived(i):
+            self.derivedchanged.discard(serverfullname)
+        else:
+            self.derivedchanged.add(serverfullname)
+
+    def iscurrent(self):
+        """Whether nothing differs from the current generation, which is then kept"""
+        if self.base is None or self.differing or self.derivedchanged or \
+                len(self.index) + len(self.unchanged) != self.base.count:
+            return False
+        # Derived values no longer computed are dropped by a new generation
+        current = self.base.delta if self.base.delta is not None else self.base
+        return self.derived is not None or not current.derivedoffset
+
+    def isdelta(self):
+        """Whether the generation is published as a delta file of the base snapshot"""
+        return self.base is not None and not self.added and \
+            len(self.index) + len(self.unchanged) == self.base.count and \
+            len(self.index) <= self.base.count * SNAPSHOT_DELTARATIO
+
+    def copyunchanged(self):
+        """Append the unchanged records and their column values as they are in the base snapshot"""
+        columns = [self.base.filecolumn(metric) for metric in SNAPSHOT_COLUMNS]
+        for serverfullname in sorted(self.unchanged):
+            i = self.base.position(serverfullname)
+            offset, length, digest = self.base.indexentry(i)
+            self.index[serverfullname] = (self.offset, length, digest)
+            self.columns[serverfullname] = tuple(column[i] for column in columns)
+            self.file.write(self.base.mmap[offset:offset + length])
+            self.offset += length
+
+    def close(self):
+        """
+        Write the index and the columns sorted by serverfullname, complete the header and publish the snapshot
+        """
+        from array import array
+        self.changed = len(self.differing)
+        self.skipped = len(self.index) + len(self.unchanged) - self.changed
+        if self.iscurrent():
+            self.recollect()
+            return
+        if self.isdelta():
+            publishedfilename, basegeneration = self.deltafilename, self.base.basegeneration
+        else:
+            publishedfilename, basegeneration = self.filename, 0
+            if self.unchanged:
+                self.copyunchanged()
+        serverfullnames = sorted(self.index)
+        for serverfullname in serverfullnames:
+            self.file.write(SNAPSHOT_INDEXENTRY.pack(*self.index[serverfullname]))
+        columnsoffset = self.offset + len(serverfullnames) * SNAPSHOT_INDEXENTRY.size
+        self.file.write(struct.pack('<H', len(SNAPSHOT_COLUMNS)))
+        for i, metric in enumerate(SNAPSHOT_COLUMNS):
+            column = array('d', [self.columns[serverfullname][i] for serverfullname in serverfullnames])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            self.file.write(packsnapshotstr(metric))
+            self.file.write(column.tobytes())
+        derivedoffset = self.writederived(self.file.tell())
+        self.file.seek(0)
+        self.file.write(self.header(len(self.index), self.offset, columnsoffset, basegeneration, derivedoffset))
+        self.file.close()
+        if self.base is not None:
+            self.base.close()
+        os.replace(self.tempfilename, publishedfilename)
+        if not basegeneration:
+            # The delta file of the previous base snapshot no longer applies
+            try:
+                os.remove(self.deltafilename)
+            except OSError:
+                pass
+
+    def recollect(self):
+        """Discard the new generation and stamp the current one, the delta file if any, with the collection timestamp"""
+        currentfilename = self.deltafilename if self.base.delta is not None else self.filename
+        self.abort()
+        with open(currentfilename, 'r+b') as snapshotfile:
+            snapshotfile.seek(SNAPSHOT_COLLECTEDOFFSET)
+            snapshotfile.write(struct.pack('<d', self.collected))
+
+    def writederived(self, offset):
+        """
+        Append the derived values of all the servers, of a delta file too, sorted by serverfullname
+        :param offset: The file offset they are appended at
+        :return: The offset of the derived values, 0 when not written or no server has any
+        """
+        if not self.derived or not any(self.derived.values()):
+            return 0
+        serverfullnames = sorted(self.derived)
+        self.file.write(struct.pack('<I', len(serverfullnames)))
+        valuesoffset = offset + 4 + len(serverfullnames) * SNAPSHOT_DERIVEDENTRY.size
+        for serverfullname in serverfullnames:
+            self.file.write(SNAPSHOT_DERIVEDENTRY.pack(valuesoffset, len(self.derived[serverfullname])))
+            valuesoffset += len(self.derived[serverfullname])
+        for serverfullname in serverfullnames:
+            self.file.write(self.derived[serverfullname])
+        return offset
+
+    def abort(self):
+        """Discard the snapshot, the published snapshot file is left as is"""
+        self.file.close()
+        if self.base is not None:
+            self.base.close()
+        os.remove(self.tempfilename)
+
+
+class PerfSnapshotReader:
+    """
+    Memory mapped reader of a snapshot file, overlaid with its delta file if any.
+    Only the records of the queried WAS servers are decoded
+    """
+
+    def __init__(self, filename, overlay=True):
+        """
+        :param filename: The snapshot file
+        :param overlay: Overlay the delta file of the snapshot file, default True
+        :raise ValueError: On a file which is not a snapshot file of this version
+        """
+        self.delta = None
+        with open(filename, 'rb') as snapshotfile:
+            self.mmap = mmap.mmap(snapshotfile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < SNAPSHOT_HEADER.size or self.mmap[:4] != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError('{} is not a perfservmon snapshot file'.format(filename))
+        (magic, version, reserved, self.count, self.indexoffset, self.generation, self.collected,
+         self.columnsoffset, basegeneration, self.derivedoffset) = SNAPSHOT_HEADER.unpack_from(self.mmap, 0)
+        if version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError('Unsupported perfservmon snapshot version {}'.format(version))
+        # The generation of the base snapshot, for a base snapshot its own one
+        self.basegeneration = basegeneration or self.generation
+        if overlay and not basegeneration:
+            try:
+                delta = PerfSnapshotReader(deltafilename(filename), overlay=False)
+            except (IOError, ValueError):
+                return
+            if delta.basegeneration != self.generation:
+                # Left behind by a previous base snapshot
+                delta.close()
+                return
+            self.delta = delta
+            self.generation, self.collected = delta.generation, delta.collected
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def age(self):
+        """Seconds since the perfservlet data of the snapshot were collected"""
+        return time.time() - self.collected
+
+    def __contains__(self, serverfullname):
+        return self.find(serverfullname) is not None
+
+    def close(self):
+        self.mmap.close()
+        if self.delta is not None:
+            self.delta.close()
+
+    def indexentry(self, i):
+        return SNAPSHOT_INDEXENTRY.unpack_from(self.mmap, self.indexoffset + i * SNAPSHOT_INDEXENTRY.size)
+
+    def recordkey(self, i):
+        offset = self.indexentry(i)[0]
+        (keylength,) = struct.unpack_from('<H', self.mmap, offset)
+        return self.mmap[offset + 2:offset + 2 + keylength]
+
+    def position(self, serverfullname):
+        """
+        Binary search the index of the snapshot file
+        :param serverfullname: The <node>.<server> name of the WAS server, as str or utf-8 bytes
+        :return: The index position of the WAS server or None
+        """
+        key = serverfullname if isinstance(serverfullname, bytes) else serverfullname.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.recordkey(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.recordkey(low) == key:
+            return low
+        return None
+
+    def find(self, serverfullname):
+        """:return: (record offset, record length, record digest) of the WAS server in the snapshot file or None"""
+        i = self.position(serverfullname)
+        return None if i is None else self.indexentry(i)
+
+    def digest(self, serverfullname):
+        """:return: The record digest of the WAS server in the snapshot file or None"""
+        entry = self.find(serverfullname)
+        return None if entry is None else entry[2]
+
+    def get(self, serverfullname):
+        """
+        :param serverfullname: The <node>.<server> name of the WAS server
+        :return: A TypicalApplicationServer instance or None when the server is not in the snapshot
+        """
+        i = self.position(serverfullname)
+        if i is None:
+            return None
+        was = self.delta.record(serverfullname) if self.delta is not None else None
+        if was is None:
+            was = self.record(serverfullname, i)
+        unpackderived(self.derived(i), was)
+        return was
+
+    def record(self, serverfullname, i=None):
+        """The WAS server of the snapshot file record, without its derived values nor the delta file overlay"""
+        i = self.position(serverfullname) if i is None else i
+        if i is None:
+            return None
+        offset, length, digest = self.indexentry(i)
+        return unpackserver(self.mmap[offset:offset + length])
+
+    def derived(self, i):
+        """
+        :param i: The position of the WAS server in the index of the base snapshot
+        :return: The bytes of the derived values of the WAS server, those of a delta file supersede its base snapshot
+        """
+        return (self.delta if self.delta is not None else self).filederived(i)
+
+    def filederived(self, i):
+        """
+        :param i: The position of the WAS server in the index of the base snapshot
+        :return: The bytes of the derived values of the WAS server in the snapshot file, empty without any
+        """
+        if not self.derivedoffset:
+            return b''
+        offset, length = SNAPSHOT_DERIVEDENTRY.unpack_from(self.mmap, self.derivedoffset + 4 +
+                                                           i * SNAPSHOT_DERIVEDENTRY.size)
+        return self.mmap[offset:offset + length]
+
+    def keys(self):
+        """The serverfullnames of the snapshot, sorted"""
+        for i in range(self.count):
+            yield self.recordkey(i).decode('utf-8')
+
+    def column(self, metric):
+        """
+        :param metric: One of SNAPSHOT_COLUMNS
+        :return: An array of the metric values of all the servers in index order, NaN for a missing value
+        """
+        column = self.filecolumn(metric)
+        if self.delta is not None:
+            # A delta file holds a subset of the servers of its base snapshot
+            deltacolumn = self.delta.filecolumn(metric)
+            for i in range(self.delta.count):
+                column[self.position(self.delta.recordkey(i))] = deltacolumn[i]
+        return column
+
+    def filecolumn(self, metric):
+        """The column of the snapshot file, without the delta file overlay"""
+        from array import array
+        offset = self.columnsoffset + 2
+        length = self.count * 8
+        for name in SNAPSHOT_COLUMNS[:SNAPSHOT_COLUMNS.index(metric)]:
+            offset += 2 + len(name.encode('utf-8')) + length
+        if self.mmap[offset + 2:offset + 2 + len(metric)] != metric.encode('utf-8'):
+            raise ValueError('Missing {} column in the snapshot'.format(metric))
+        offset += 2 + len(metric.encode('utf-8'))
+        column = array('d')
+        column.frombytes(self.mmap[offset:offset + length])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+
+# #################################################################################################################
+# History file layout, all integers little endian:
+#   header: magic, version, reserved, samples kept per series, number of series
+#   series: one fixed size record per counter of a WAS server, a ring buffer of its last (timestamp, value) samples:
+#     digest of the series key, slot of the next sample, number of samples, samples
+# Recording a sample overwrites the oldest one in place, the file only grows when a new counter shows up
+HISTORY_MAGIC = b'PSMH'
+HISTORY_VERSION = 1
+HISTORY_HEADER = struct.Struct('<4sHHII')
+HISTORY_SERIESHEADER = struct.Struct('<16sII')
+HISTORY_SAMPLE = struct.Struct('<dd')
+
+
+class PerfHistory:
+    """
+    Memory mapped ring buffer history of the counters of a Cell. Each series keeps its last samples
+    in a fixed size record, so recording a sample is O(1) and the file size is bounded by the number of series
+    """
+
+    def __init__(self, filename, samples):
+        """
+        :param filename: The history file, created when missing
+        :param samples: Samples kept per series, a history of a different size is started over
+        """
+        self.filename = filename
+        self.samples = samples
+        self.recordsize = HISTORY_SERIESHEADER.size + samples * HISTORY_SAMPLE.size
+        self.file = open(filename, 'r+b' if os.path.exists(filename) else 'w+b')
+        header = self.file.read(HISTORY_HEADER.size)
+        magic, version, reserved, filesamples, self.count = HISTORY_HEADER.unpack(header) \
+            if len(header) == HISTORY_HEADER.size else (None, None, None, None, 0)
+        if magic != HISTORY_MAGIC or version != HISTORY_VERSION or filesamples != samples:
+            self.count = 0
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, 0, samples, 0))
+            self.file.flush()
+        # digest -> record offset of the series of the file
+        self.series = {}
+        self.mmap = None
+        if self.count:
+            self.mmap = mmap.mmap(self.file.fileno(), HISTORY_HEADER.size + self.count * self.recordsize)
+            for offset in range(HISTORY_HEADER.size, len(self.mmap), self.recordsize):
+                self.series[self.mmap[offset:offset + 16]] = offset
+        # digest -> record of the series first seen in this collection, appended to the file on close
+        self.newseries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def sampleoffset(self, offset, slot):
+        return offset + HISTORY_SERIESHEADER.size + slot % self.samples * HISTORY_SAMPLE.size
+
+    @staticmethod
+    def digest(key):
+        import hashlib
+        return hashlib.sha1(key.encode('utf-8')).digest()[:16]
+
+    def record(self, key, timestamp, value):
+        """
+        Append a sample to a series
+        :param key: The series key, unique in the Cell
+        :return: The previous (timestamp, value) sample of the series or None for a new series
+        """
+        digest = self.digest(key)
+        offset = self.series.get(digest)
+        if offset is None:
+            record = bytearray(self.recordsize)
+            HISTORY_SERIESHEADER.pack_into(record, 0, digest, 1, 1)
+            HISTORY_SAMPLE.pack_into(record, HISTORY_SERIESHEADER.size, timestamp, value)
+            self.newseries[digest] = record
+            return None
+        digest, slot, count = HISTORY_SERIESHEADER.unpack_from(self.mmap, offset)
+        previous = HISTORY_SAMPLE.unpack_from(self.mmap, self.sampleoffset(offset, slot - 1))
+        HISTORY_SAMPLE.pack_into(self.mmap, self.sampleoffset(offset, slot), timestamp, value)
+        HISTORY_SERIESHEADER.pack_into(self.mmap, offset, digest, (slot + 1) % self.samples,
+                                       min(count + 1, self.samples))
+        return previous
+
+    def values(self, key, since):
+        """
+        The values of a series sampled since a timestamp, newest first. At most the samples kept per series are
+        scanned, so the cost is bounded whatever the history age
+        :param key: The series key, unique in the Cell
+        :param since: Timestamp of the oldest sample of interest
+        """
+        digest = self.digest(key)
+        if digest in self.newseries:
+            buffer, offset = self.newseries[digest], 0
+        elif digest in self.series:
+            buffer, offset = self.mmap, self.series[digest]
+        else:
+            return []
+        digest, slot, count = HISTORY_SERIESHEADER.unpack_from(buffer, offset)
+        values = []
+        for i in range(1, count + 1):
+            timestamp, value = HISTORY_SAMPLE.unpack_from(buffer, self.sampleoffset(offset, slot - i))
+            if timestamp < since:
+                break
+            values.append(value)
+        return values
+
+    def close(self):
+        """Write back the recorded samples and append the new series"""
+        if self.mmap is not None:
+            self.mmap.close()
+        if self.newseries:
+            # Any series left behind by an interrupted close are beyond the count and get overwritten
+            self.file.seek(HISTORY_HEADER.size + self.count * self.recordsize)
+            for record in self.newseries.values():
+                self.file.write(record)
+            self.file.seek(0)
+            self.file.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, 0, self.samples,
+                                                self.count + len(self.newseries)))
+        self.file.close()
+
+
+def historysamples(value):
+    """
+    Parse the number of samples kept per counter in the history file, 0 disables the history
+    :raise ValueError: When less than the 2 samples a rate needs are kept
+    """
+    samples = int(value)
+    if samples == 1 or samples < 0:
+        raise ValueError('At least 2 history samples are needed, got {}'.format(value))
+    return samples
+
+
+def windowseconds(value):
+    """
+    Parse a collection window, seconds or a number followed by s, m or h, e.g. 10m
+    :raise ValueError: On an invalid window
+    """
+    units = dict(s=1, m=60, h=3600)
+    if value[-1:] in units:
+        seconds = float(value[:-1]) * units[value[-1]]
+    else:
+        seconds = float(value)
+    if seconds <= 0:
+        raise ValueError('Invalid window {}'.format(value))
+    return seconds
+
+
+def countdelta(previous, current):
+    """Increase of a counter between two samples, a counter found lower was reset by a restart"""
+    return current - previous if current >= previous else current
+
+
+def recordrates(history, was, collected):
+    """
+    Record the counters of a WAS server in the history and keep their rates since the previous collection
+    in the server rates
+    :param history: A PerfHistory instance
+    :param was: A TypicalApplicationServer instance
+    :param collected: Timestamp of the perfservlet data collection
+    """
+    serverfullname = was.serverfullname()
+    if was.wcthreadshung is not None:
+        current = packsnapshotint(was.wcthreadshung)
+        previous = history.record(serverfullname + '/DeclaredThreadHungCount', collected, current)
+        if previous is not None and collected > previous[0]:
+            was.rates['ThreadsHung'] = countdelta(previous[1], current)
+            was.rates['ThreadsHungInterval'] = collected - previous[0]
+    for destination in was.destinations.values():
+        if destination.TotalMessagesConsumed is None:
+            continue
+        current = packsnapshotint(destination.TotalMessagesConsumed)
+        previous = history.record('{}/{}/TotalMessagesConsumed'.format(serverfullname, destination.Name), collected,
+                                  current)
+        if previous is not None and collected > previous[0]:
+            was.rates['Consumed:' + destination.Name] = countdelta(previous[1], current) / (collected - previous[0])
+
+
+def aggregate(values):
+    """
+    The avg, max and p95 of the samples of a window. The p95 is the nearest rank percentile of the samples
+    kept, so its resolution is bounded by the history size
+    :return: The aggregates by name
+    """
+    ordered = sorted(values)
+    return {'avg': sum(ordered) / len(ordered), 'max': ordered[-1],
+            'p95': ordered[max(0, -(-len(ordered) * 95 // 100) - 1)]}
+
+
+def recordaggregates(history, was, collected, window):
+    """
+    Record the usage percentages of a WAS server in the history and keep their aggregates over the window
+    in the server aggregates, so that show reads them precomputed
+    :param history: A PerfHistory instance
+    :param was: A TypicalApplicationServer instance
+    :param collected: Timestamp of the perfservlet data collection
+    :param window: Seconds of history the aggregates are computed over
+    """
+    serverfullname = was.serverfullname()
+    # (series, aggregate name prefix, aggregate name suffix, percentage)
+    percentages = []
+    # A server reporting an empty pool or heap has no usage percentage, as in columnvalues
+    if was.heapusedMB is not None and was.maxheapMB:
+        percentages.append(('Heap', 'Heap:', '', float(was.heapusedMB) / float(was.maxheapMB) * 100))
+    if was.wcactive is not None and was.wcpoolsize:
+        percentages.append(('WebContainer', 'WebContainer:', '', float(was.wcactive) / float(was.wcpoolsize) * 100))
+    for jndiname, percentused in was.connpoolspercentused.items():
+        percentages.append(('DBConnectionPoolPercentUsed:' + jndiname, 'DBConnectionPoolPercentUsed:', ':' + jndiname,
+                            float(percentused)))
+    for series, prefix, suffix, percentused in percentages:
+        key = '{}/{}'.format(serverfullname, series)
+        history.record(key, collected, percentused)
+        for name, value in aggregate(history.values(key, collected - window)).items():
+            was.aggregates[prefix + name + suffix] = value
+    if percentages:
+        was.aggregates['Window'] = window
+
+
+# #################################################################################################################\
+def retrieveperfxml(path, cellname, ip, port, username, password, httpprotocol='http', ignorecert=False,
+                    savexml=False, storeservers=None, timeout=30, connections=None, metrics=None, node=None,
+                    server=None, history=0, window=None, statindex=None, refreshfloor=300, refreshceiling=86400,
+                    parseworkers=1, retries=2, breakerthreshold=3, breakercooldown=60, nodeworkers=0):
+    """
+    Perfservlet XML Retrieval Method
+    :param path: The file path where perfserv xml and snapshot output is stored
+    :param cellname: The Name of the WAS Cell
+    :param ip: The ip of the perfserv appication
+    :param port: The port of the perfserv appication
+    :param username: An user which is authorized to access perfservlet
+    :param password: perfservlet authorized user password
+    :param httpprotocol: The http protocol to access the perfservlet, can be http or https, default http
+    :param ignorecert: Ignore TLS Certificate, default False
+    :param savexml: Also keep a copy of the perfserv xml on disk, default False
+    :param storeservers: Callable which consumes the parsed Cell servers and returns the number of changed and
+    skipped servers as storeperfservers does, default store them in the snapshot file
+    :param timeout: Seconds the whole retrieval, download and parsing included, may last, default 30
+    :param connections: PerfServletConnections pool to reuse connections from, default a new connection
+    :param metrics: Retrieve only the PMI modules of these show Metric Types, default and with the extra metrics of a
+    stat map all the PMI modules
+    :param node: Retrieve only the servers of this WAS Node, default all the Nodes of the Cell
+    :param server: Retrieve only this WAS Server, default all the Servers
+    :param history: Samples kept per counter in the history file to derive their rates, default no history
+    :param window: Seconds of history to aggregate the usage percentages over, needs history, default none
+    :param statindex: StatPathIndex of the stat rules to apply, default the built in ones
+    :param refreshfloor: Minimum seconds between two perfservlet config reloads, default 300
+    :param refreshceiling: Maximum seconds between two perfservlet config reloads, default 86400
+    :param parseworkers: Download the whole response, then parse it in this many processes, default a serial parse
+    while the response streams in
+    :param retries: Retries of a failed perfservlet request within the timeout, default 2
+    :param breakerthreshold: Failed retrievals in a row opening the circuit breaker of the endpoint, default 3
+    :param breakercooldown: Seconds the opened circuit breaker fails the retrievals fast, default 60
+    :param nodeworkers: Retrieve each Node of the Cell with its own request, this many at the same time, see
+    retrievenodes. Default 0, a single request for the whole Cell
+    :return: The nagios message
+    """
+    import datetime
+    import socket
+    import ssl
+    from xml.etree.ElementTree import ParseError
+    from http.client import HTTPException
+    from urllib.parse import urlsplit
+    deadline = time.time() + timeout
+    if httpprotocol not in ['http', 'https']:
+        return UNKNOWN, 'Invalid Perfserv URL'
+    if statindex is not None and statindex.extrarules:
+        # The extra metrics of the stat map may lie in any PMI module
+        metrics = None
+    xmlfilename = path + cellname + '.xml'
+    snapshotfilename = path + cellname + '.snap'
+    stats = PerfRetrievalStats()
+    topology = PerfTopology()
+    headers = perfservheaders(username, password)
+    breaker = PerfCircuitBreaker(path + cellname + '.breaker', '{}://{}:{}'.format(httpprotocol, ip, port),
+                                 breakerthreshold, breakercooldown)
+    if breaker.isopen():
+        return CRITICAL, 'Perfservlet circuit breaker open after {} failed retrievals, next attempt in {:.0f} ' \
+                         'seconds - {}'.format(breaker.failures(), breaker.retryin(), breaker.error())
+    nodes = shardnodes(path, cellname, refreshfloor, refreshceiling) if nodeworkers > 0 and not (node or server) \
+        else None
+    if nodes and configreloaddue(path, cellname, refreshfloor, refreshceiling):
+        # The perfservlet config is reloaded once for the whole Cell, by a whole Cell request which finds the Nodes
+        # added since as well
+        nodes = None
+    pool = connections if connections is not None else PerfServletConnections()
+    if nodes:
+        try:
+            return retrievenodes(path, cellname, nodes, pool, breaker, ip, port, httpprotocol, ignorecert, headers,
+                                 deadline, storeservers, metrics, history, window, statindex, refreshfloor,
+                                 refreshceiling, retries, nodeworkers)
+        finally:
+            if connections is None:
+                pool.close()
+    url = urlsplit(setperfservurl(ip, port, path, cellname, httpprotocol, refreshfloor, refreshceiling,
+                                  metrics=metrics, node=node, server=server))
+    # Once the circuit breaker cooled down, a single attempt probes the endpoint
+    perfserv, message = requestperfservlet(pool, httpprotocol, ip, port, ignorecert,
+                                           url.path + ('?' + url.query if url.query else ''), headers, deadline,
+                                           retries=0 if breaker.isprobing() else retries,
+                                           stats=stats)
+    if perfserv is None:
+        if connections is None:
+            pool.close()
+        breaker.failure(message)
+        return CRITICAL, message
+    response = perfserv
+    if savexml:
+        perfserv = PerfXmlCopy(perfserv, xmlfilename)
+    try:
+        # The response is parsed while it streams in, the Cell servers are stored in the same pass
+        started = time.time()
+        if parseworkers > 1:
+            responsestatus, servers = readperfxmlparallel(perfserv.read(), parseworkers, stats, statindex)
+        else:
+            responsestatus, servers = readperfxml(perfserv, stats, statindex)
+        stats.parsetime += time.time() - started
+        if responsestatus == 'success':
+            started, parsetime = time.time(), stats.parsetime
+            servers = topology.observe(stats.timeservers(servers))
+            if storeservers is None:
+                stats.changed, stats.skipped = storeperfservers(snapshotfilename, servers,
+                                                                historyfilename=path + cellname + '.hist',
+                                                                historysamples=history, window=window)
+            else:
+                stats.changed, stats.skipped = storeservers(servers)
+            if topology.drifted(path + cellname + '.topology') and 'refreshConfig=true' not in url.query:
+                # Reload the perfservlet config on a next retrieval, in case more changed than it shows yet
+                touch(path + cellname + '.miss')
+            stats.storetime = time.time() - started - (stats.parsetime - parsetime)
+            stats.finish(response)
+            stats.save(path + cellname + '.stats.json', cellname)
+            breaker.success()
+            if nodeworkers > 0 and not (node or server):
+                # The next retrievals are sharded by the Nodes of this one
+                writenodes(path + cellname + '.nodes', topology.nodes)
+            return OK, 'PerfServlet Data refreshed on {}|{}'.format(datetime.datetime.now().strftime('%c'),
+                                                                    stats.perfdata())
+        if parseworkers <= 1:
+            # Read the rest of the response, so that any xml copy on disk is complete. The parallel parse already
+            # downloaded all of it, its partitions are left unparsed
+            for was in servers:
+                pass
+        # The endpoint answered, the Cell itself failed to report its PMI data
+        breaker.success()
+        if responsestatus == 'failed':
+            return CRITICAL, 'Error retrieving PMI data! Check your Cell status!'
+        else:
+            return UNKNOWN, 'Unknown Perfserv Status: {}'.format(responsestatus)
+    except ParseError as error:
+        message = 'Invalid perfservlet XML - {}'.format(error)
+    except socket.timeout:
+        message = 'Could not read perfservlet response within {} seconds'.format(timeout)
+    except ssl.SSLError:
+        message = 'Could not read perfservlet response: Generic SSL Error, possibly a timeout'
+    except (socket.error, HTTPException, IOError) as error:
+        message = 'Could not read perfservlet response - {}'.format(error)
+    finally:
+        perfserv.close()
+        if connections is None:
+            pool.close()
+    # Part of the response may already be parsed and recorded in the history, the retrieval is not retried
+    breaker.failure(message)
+    return CRITICAL, message
+
+
+def requestperfservlet(pool, httpprotocol, ip, port, ignorecert, url, headers, deadline, retries=2, backoff=1.0,
+                       stats=None):
+    """
+    GET the perfservlet url, retrying the connection errors, timeouts and 5xx responses as long as the deadline allows,
+    after a jittered exponential backoff
+    :param pool: The PerfServletConnections pool to request over
+    :param url: The path and query of the perfservlet url
+    :param headers: The request headers
+    :param deadline: Timestamp the whole retrieval must be done by
+    :param retries: Maximum number of retries
+    :param backoff: Seconds the backoff before the first retry is drawn within, doubled on each retry
+    :param stats: PerfRetrievalStats instance counting the attempts, default none
+    :return: The PerfServletResponse and None, or None and the nagios message of the last failure
+    """
+    import random
+    import socket
+    import ssl
+    from http.client import HTTPException
+    attempt = 0
+    while True:
+        attempt += 1
+        if stats is not None:
+            stats.attempts = attempt
+        retryable = True
+        try:
+            perfserv = pool.request(httpprotocol, ip, port, ignorecert, url, headers, deadline)
+            if perfserv.status == 200:
+                return perfserv, None
+            perfserv.close()
+            message = 'Could not open perfservlet URL - Response Status Code {}'.format(perfserv.status)
+            # Client errors, e.g. wrong credentials, do not go away on a retry
+            retryable = perfserv.status >= 500 or perfserv.status == 429
+        # Handle HTTP Timeouts
+        except socket.timeout:
+            message = 'Could not open perfservlet URL: Socket Timeout'
+        # Handle HTTPS Timeouts
+        except ssl.SSLError:
+            message = 'Could not open perfservlet URL: Generic SSL Error, possibly a timeout'
+        except (socket.error, HTTPException) as error:
+            message = 'Could not open perfservlet URL - {}'.format(error)
+        # Full jitter, so that the collectors of the Cells of a DMgr do not retry in lockstep
+        pause = random.uniform(0, backoff * 2 ** (attempt - 1))
+        if not retryable or attempt > retries or time.time() + pause >= deadline:
+            if attempt > 1:
+                message += ' after {} attempts'.format(attempt)
+            return None, message
+        time.sleep(pause)
+
+
+def perfservheaders(username, password):
+    """The perfservlet request headers"""
+    import base64
+    headers = {'Accept-Encoding': 'gzip, deflate'}
+    # if Basic Auth is enabled
+    if username and password:
+        credentials = ('%s:%s' % (username, password))
+        auth_encoded = base64.b64encode(credentials.encode('ascii'))
+        headers['Authorization'] = 'Basic %s' % auth_encoded.decode("ascii")
+    return headers
+
+
+def retrievenodes(path, cellname, nodes, pool, breaker, ip, port, httpprotocol, ignorecert, headers, deadline,
+                  storeservers=None, metrics=None, history=0, window=None, statindex=None, refreshfloor=300,
+                  refreshceiling=86400, retries=2, nodeworkers=8):
+    """
+    Sharded perfservlet retrieval: each Node of the Cell is requested on its own, concurrently, instead of waiting
+    for the Deployment Manager to gather the whole Cell. The servers of all the Nodes are stored in one snapshot;
+    the servers of a failed Node are kept from the previous snapshot. The Node requests never reload the perfservlet
+    config, a whole Cell request does when it is due
+    :param nodes: The Node names of the last whole Cell retrieval, see shardnodes
+    :param pool: The PerfServletConnections pool to request over
+    :param breaker: The PerfCircuitBreaker of the endpoint, a retrieval fails when all its Nodes fail
+    :param headers: The perfservlet request headers
+    :param deadline: Timestamp the retrieval of every Node must be done by
+    :param nodeworkers: Maximum number of Nodes retrieved at the same time
+    See retrieveperfxml for the rest of the parameters
+    :return: The nagios message, WARNING when some Nodes failed with one status line per failed Node
+    """
+    import datetime
+    from concurrent.futures import ThreadPoolExecutor
+    from xml.etree.ElementTree import ParseError
+    from urllib.parse import urlsplit
+    snapshotfilename = path + cellname + '.snap'
+    stats = PerfRetrievalStats()
+    topology = PerfTopology()
+    requests = []
+    for nodename in nodes:
+        url = urlsplit(setperfservurl(ip, port, path, cellname, httpprotocol, refreshfloor, refreshceiling,
+                                      metrics=metrics, node=nodename, reload=False))
+        requests.append((nodename, url.path + ('?' + url.query if url.query else ''), PerfRetrievalStats()))
+    servers, failednodes, invalidnodes = [], [], []
+    with ThreadPoolExecutor(max_workers=min(nodeworkers, len(requests))) as executor:
+        futures = [(nodename, nodestats, executor.submit(retrievenode, pool, httpprotocol, ip, port, ignorecert, url,
+                                                         headers, deadline, 0 if breaker.isprobing() else retries,
+                                                         statindex, nodestats))
+                   for nodename, url, nodestats in requests]
+        for nodename, nodestats, future in futures:
+            try:
+                nodeservers, message = future.result()
+            except ParseError as error:
+                nodeservers, message = None, 'Invalid perfservlet XML - {}'.format(error)
+                invalidnodes.append((nodename, message))
+            except Exception as error:
+                nodeservers, message = None, 'Error retrieving PMI data - {}'.format(error)
+            if nodeservers is None:
+                failednodes.append((nodename, message))
+            else:
+                servers.extend(nodeservers)
+                stats.add(nodestats)
+    nodelines = ['{}: {}'.format(nodename, message) for nodename, message in failednodes]
+    if len(failednodes) == len(requests):
+        breaker.failure('All the {} Nodes failed - {}'.format(len(requests), failednodes[0][1]))
+        return CRITICAL, '\n'.join(['All the {} Nodes of the Cell failed'.format(len(requests))] + nodelines)
+    if invalidnodes:
+        # The endpoint answers with broken xml, as for a whole Cell retrieval
+        breaker.failure('Node {} - {}'.format(*invalidnodes[0]))
+    else:
+        breaker.success()
+    started = time.time()
+    kept = list(topology.observe(readnodeservers(snapshotfilename, [nodename for nodename, message in failednodes])))
+    if storeservers is None:
+        stats.changed, stats.skipped = storeperfservers(snapshotfilename, topology.observe(servers),
+                                                        historyfilename=path + cellname + '.hist',
+                                                        historysamples=history, window=window, keep=kept)
+    else:
+        stats.changed, stats.skipped = storeservers(topology.observe(servers), kept)
+    if topology.drifted(path + cellname + '.topology'):
+        touch(path + cellname + '.miss')
+    stats.storetime = time.time() - started
+    stats.totaltime = time.time() - stats.started
+    stats.save(path + cellname + '.stats.json', cellname)
+    perfdata = '{} nodes={} failednodes={}'.format(stats.perfdata(), len(requests), len(failednodes))
+    if failednodes:
+        return WARNING, '\n'.join(['PerfServlet Data of {}/{} Nodes refreshed on {}, the servers of {} kept from '
+                                   'the previous retrieval|{}'
+                                   .format(len(requests) - len(failednodes), len(requests),
+                                           datetime.datetime.now().strftime('%c'),
+                                           ', '.join(nodename for nodename, message in failednodes), perfdata)]
+                                  + nodelines)
+    return OK, 'PerfServlet Data of {} Nodes refreshed on {}|{}'.format(len(requests),
+                                                                      datetime.datetime.now().strftime('%c'), perfdata)
+
+
+def retrievenode(pool, httpprotocol, ip, port, ignorecert, url, headers, deadline, retries=2, statindex=None,
+                 stats=None):
+    """
+    Retrieve and parse the perfservlet xml of a Node, as it streams in
+    :param url: The path and query of the perfservlet url of the Node
+    :param stats: The PerfRetrievalStats of the Node retrieval
+    :return: The list of the parsed servers of the Node and None, or None and the nagios message of the failure
+    :raise ParseError: On an invalid perfservlet xml, which the circuit breaker counts as a failed retrieval
+    """
+    import socket
+    import ssl
+    from http.client import HTTPException
+    stats = stats if stats is not None else PerfRetrievalStats()
+    perfserv, message = requestperfservlet(pool, httpprotocol, ip, port, ignorecert, url, headers, deadline,
+                                           retries=retries, stats=stats)
+    if perfserv is None:
+        return None, message
+    try:
+        responsestatus, servers = readperfxml(perfserv, stats, statindex)
+        servers = list(stats.timeservers(servers))
+        if responsestatus == 'failed':
+            return None, 'Error retrieving PMI data! Check your Cell status!'
+        elif responsestatus != 'success':
+            return None, 'Unknown Perfserv Status: {}'.format(responsestatus)
+        stats.finish(perfserv)
+        return servers, None
+    except socket.timeout:
+        return None, 'Could not read perfservlet response before the retrieval deadline'
+    except ssl.SSLError:
+        return None, 'Could not read perfservlet response: Generic SSL Error, possibly a timeout'
+    except (socket.error, HTTPException, IOError) as error:
+        return None, 'Could not read perfservlet response - {}'.format(error)
+    finally:
+        perfserv.close()
+
+
+def shardnodes(path, cellname, refreshfloor=300, refreshceiling=86400):
+    """
+    The Nodes a retrieval is sharded by, those of the last whole Cell retrieval kept in the <cell>.nodes file.
+    The whole Cell is retrieved again, to find the Nodes added since, as often as the perfservlet config is reloaded
+    (see setperfservurl)
+    :return: The Node names, None when the whole Cell is to be retrieved
+    """
+    nodesfilename = path + cellname + '.nodes'
+    missfilename = path + cellname + '.miss'
+    try:
+        retrieved = os.path.getmtime(nodesfilename)
+        with open(nodesfilename) as nodesfile:
+            nodes = [line.strip() for line in nodesfile if line.strip()]
+    except (IOError, OSError):
+        return None
+    timeelapsed = time.time() - retrieved
+    if timeelapsed > refreshceiling:
+        return None
+    if timeelapsed > refreshfloor and os.path.isfile(missfilename) and os.path.getmtime(missfilename) > retrieved:
+        return None
+    return nodes or None
+
+
+def writenodes(nodesfilename, nodes):
+    """Replace the Node names of the <cell>.nodes file"""
+    tempfilename = '{}.{}.tmp'.format(nodesfilename, os.getpid())
+    with open(tempfilename, 'w') as nodesfile:
+        nodesfile.writelines(nodename + '\n' for nodename in sorted(nodes))
+    os.replace(tempfilename, nodesfilename)
+
+
+def readnodeservers(snapshotfilename, nodes):
+    """:return: The servers of these Nodes stored in the snapshot file"""
+    if not nodes:
+        return []
+    prefixes = tuple(nodename + '.' for nodename in nodes)
+    try:
+        with PerfSnapshotReader(snapshotfilename) as snapshot:
+            return [was for was in (snapshot.get(serverfullname) for serverfullname in snapshot.keys()
+                                    if serverfullname.startswith(prefixes)) if was.nodename in nodes]
+    except (IOError, ValueError):
+        return []
+
+
+class PerfServletConnections:
+    """
+    Keep-alive connection pool of the perfservlet endpoints. A resident or multi Cell collector shares one pool
+    among its retrievals, so that the TCP and TLS handshakes are paid once per endpoint instead of once per retrieval
+    """
+
+    def __init__(self):
+        import threading
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def connect(self, httpprotocol, ip, port, ignorecert, timeout):
+        """A new, not yet connected, perfservlet connection"""
+        from http.client import HTTPConnection, HTTPSConnection
+        import ssl
+        if httpprotocol != 'https':
+            return HTTPConnection(ip, int(port), timeout=timeout)
+        if ignorecert:
+            # On --ignorecert option accept any certificate
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        else:
+            # Default Behaviour: Accept only trusted certificates, issued to the perfservlet host
+            ctx = ssl.create_default_context()
+        return HTTPSConnection(ip, int(port), timeout=timeout, context=ctx)
+
+    def request(self, httpprotocol, ip, port, ignorecert, url, headers, deadline):
+        """
+        GET a perfservlet url over an idle pooled connection, or a new one
+        :param url: The path and query of the perfservlet url
+        :param headers: The request headers
+        :param deadline: Timestamp the whole response must have been read by
+        :return: A PerfServletResponse
+        """
+        endpoint = (httpprotocol, ip, port, ignorecert)
+        with self.lock:
+            connection = self.idle.get(endpoint, []).pop() if self.idle.get(endpoint) else None
+        if connection is not None:
+            try:
+                connection.sock.settimeout(max(deadline - time.time(), 0.001))
+                started = time.time()
+                connection.request('GET', url, headers=headers)
+                response = connection.getresponse()
+                return PerfServletResponse(self, endpoint, connection, response, deadline,
+                                           ttfb=time.time() - started)
+            except Exception:
+                # The perfservlet server closed the idle connection, retry once over a new one
+                connection.close()
+        connection = self.connect(httpprotocol, ip, port, ignorecert, max(deadline - time.time(), 0.001))
+        started = time.time()
+        connection.connect()
+        handshaketime = time.time() - started
+        try:
+            started = time.time()
+            connection.request('GET', url, headers=headers)
+            response = connection.getresponse()
+            return PerfServletResponse(self, endpoint, connection, response, deadline, handshaketime,
+                                       time.time() - started)
+        except Exception:
+            connection.close()
+            raise
+
+    def release(self, endpoint, connection):
+        """Return a connection, whose response was read to the end, to the pool"""
+        with self.lock:
+            self.idle.setdefault(endpoint, []).append(connection)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+class PerfServletResponse:
+    """
+    File like perfservlet response body, decompressed while it is read and timing out the retrieval once its
+    deadline has passed. The connection returns to its pool once the body has been read to the end
+    """
+
+    def __init__(self, pool, endpoint, connection, response, deadline, handshaketime=0.0, ttfb=0.0):
+        """
+        :param pool: The PerfServletConnections pool of the connection
+        :param endpoint: The pool key of the connection
+        :param connection: The perfservlet connection
+        :param response: The perfservlet http response
+        :param deadline: Timestamp the response must have been read by
+        :param handshaketime: Seconds spent to connect, zero on a reused connection
+        :param ttfb: Seconds from sending the request to receiving the response headers
+        """
+        import zlib
+        self.pool = pool
+        self.endpoint = endpoint
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.deadline = deadline
+        self.handshaketime = handshaketime
+        self.ttfb = ttfb
+        # Seconds spent waiting for and decompressing the body
+        self.downloadtime = 0.0
+        self.transferbytes = 0
+        self.xmlbytes = 0
+        self.eof = False
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        else:
+            self.decompressor = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(65536), b''))
+        while not self.eof:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                import socket
+                raise socket.timeout('Perfservlet retrieval deadline exceeded')
+            if self.connection.sock is not None:
+                self.connection.sock.settimeout(remaining)
+            started = time.time()
+            chunk = self.response.read(size)
+            self.transferbytes += len(chunk)
+            if not chunk:
+                self.eof = True
+                data = self.decompressor.flush() if self.decompressor is not None else b''
+            elif self.decompressor is not None:
+                data = self.decompress(chunk)
+            else:
+                data = chunk
+            self.downloadtime += time.time() - started
+            if data:
+                self.xmlbytes += len(data)
+                return data
+        return b''
+
+    def decompress(self, chunk):
+        import zlib
+        try:
+            return self.decompressor.decompress(chunk)
+        except zlib.error:
+            if self.transferbytes != len(chunk):
+                raise
+            # Some servers send deflate content without the zlib header
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(chunk)
+
+    def close(self):
+        if self.eof and not self.response.will_close:
+            self.pool.release(self.endpoint, self.connection)
+        else:
+            self.connection.close()
+
+
+class PerfRetrievalStats:
+    """
+    Timings and sizes of the phases of a perfservlet retrieval, reported as perfdata and in the stats sidecar file.
+    The response is downloaded, parsed and stored in one streaming pass, so the parse time is the time spent
+    in the parser less the time it waited for the download
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.connecttime = 0.0
+        self.ttfb = 0.0
+        self.downloadtime = 0.0
+        self.transferbytes = 0
+        self.xmlbytes = 0
+        self.parsetime = 0.0
+        self.storetime = 0.0
+        self.totaltime = 0.0
+        self.servers = 0
+        self.stats = 0
+        self.changed = 0
+        self.skipped = 0
+        self.attempts = 1
+
+    def timeservers(self, servers):
+        """Pass the parsed servers through, timing the parser apart from the consumer of the servers"""
+        while True:
+            started = time.time()
+            was = next(servers, None)
+            self.parsetime += time.time() - started
+            if was is None:
+                return
+            self.servers += 1
+            yield was
+
+    def finish(self, response):
+        """Complete the timings with the transfer ones of the PerfServletResponse"""
+        self.connecttime = response.handshaketime
+        self.ttfb = response.ttfb
+        self.downloadtime = response.downloadtime
+        self.transferbytes = response.transferbytes
+        self.xmlbytes = response.xmlbytes
+        self.parsetime = max(0.0, self.parsetime - self.downloadtime)
+        self.totaltime = time.time() - self.started
+
+    def add(self, nodestats):
+        """
+        Add the stats of a Node of a sharded retrieval. The Nodes are downloaded concurrently, their transfer timings
+        are those of the slowest Node, while their parse times add up
+        """
+        self.connecttime = max(self.connecttime, nodestats.connecttime)
+        self.ttfb = max(self.ttfb, nodestats.ttfb)
+        self.downloadtime = max(self.downloadtime, nodestats.downloadtime)
+        self.transferbytes += nodestats.transferbytes
+        self.xmlbytes += nodestats.xmlbytes
+        self.parsetime += nodestats.parsetime
+        self.servers += nodestats.servers
+        self.stats += nodestats.stats
+        self.attempts = max(self.attempts, nodestats.attempts)
+
+    def statspersec(self):
+        return self.stats / self.parsetime if self.parsetime > 0 else 0.0
+
+    def perfdata(self):
+        """Nagios perfdata of the retrieval"""
+        return 'transferbytes={}B xmlbytes={}B handshaketime={:.3f}s ttfb={:.3f}s downloadtime={:.3f}s ' \
+               'parsetime={:.3f}s storetime={:.3f}s totaltime={:.3f}s servers={} stats={} statspersec={:.0f} ' \
+               'changed={} skipped={} attempts={}' \
+            .format(self.transferbytes, self.xmlbytes, self.connecttime, self.ttfb, self.downloadtime, self.parsetime,
+                    self.storetime, self.totaltime, self.servers, self.stats, self.statspersec(), self.changed,
+                    self.skipped, self.attempts)
+
+    def save(self, statsfilename, cellname):
+        """Replace the stats sidecar file, a json object of the last retrieval timings and sizes"""
+        import json
+        tempfilename = '{}.{}.tmp'.format(statsfilename, os.getpid())
+        with open(tempfilename, 'w') as statsfile:
+            json.dump(dict(cell=cellname, collected=self.started, connect_s=self.connecttime, ttfb_s=self.ttfb,
+                           download_s=self.downloadtime, transfer_bytes=self.transferbytes,
+                           xml_bytes=self.xmlbytes, parse_s=self.parsetime, store_s=self.storetime,
+                           total_s=self.totaltime, servers=self.servers, stats=self.stats,
+                           stats_per_s=self.statspersec(), changed_servers=self.changed,
+                           skipped_servers=self.skipped, attempts=self.attempts), statsfile, indent=2,
+                      sort_keys=True)
+        os.replace(tempfilename, statsfilename)
+
+
+class PerfTopology:
+    """
+    The names of the servers, JDBC connection pools, SIB destinations and HTTP session modules of a retrieval,
+    kept as a digest in the <cell>.topology file to detect the changes of the Cell topology
+    """
+
+    def __init__(self):
+        self.names = set()
+        self.nodes = set()
+
+    def observe(self, servers):
+        """Pass the parsed servers through, collecting their names"""
+        for was in servers:
+            serverfullname = was.serverfullname()
+            self.nodes.add(was.nodename)
+            self.names.add(serverfullname)
+            for field in ('connpoolspercentused', 'destinations', 'livesessions'):
+                self.names.update('{}/{}/{}'.format(serverfullname, field, name) for name in getattr(was, field))
+            yield was
+
+    def digest(self):
+        import hashlib
+        return hashlib.sha1('\n'.join(sorted(self.names)).encode('utf-8')).hexdigest()
+
+    def drifted(self, topologyfilename):
+        """
+        Replace the topology digest of the previous retrieval
+        :param topologyfilename: The file of the topology digest
+        :return: Whether the topology changed since the previous retrieval
+        """
+        digest = self.digest()
+        try:
+            with open(topologyfilename) as topologyfile:
+                previous = topologyfile.read().strip()
+        except IOError:
+            previous = None
+        if previous == digest:
+            return False
+        with open(topologyfilename, 'w') as topologyfile:
+            topologyfile.write(digest + '\n')
+        return previous is not None
+
+
+class PerfCircuitBreaker:
+    """
+    Circuit breaker of the perfservlet endpoint of a Cell. Its state is kept in the <cell>.breaker file while
+    the retrievals fail and removed by the first successful one. After threshold failed retrievals in a row the
+    circuit opens: the retrievals fail fast, without contacting the endpoint, for a cooldown doubled on each failed
+    probe up to MAXCOOLDOWN seconds. Once cooled down, a single attempt probes the endpoint
+    """
+    MAXCOOLDOWN = 3600
+
+    def __init__(self, filename, endpoint, threshold=3, cooldown=60):
+        """
+        :param filename: The breaker state file
+        :param endpoint: The perfservlet endpoint url, a state of another endpoint is discarded
+        :param threshold: Failed retrievals in a row opening the circuit
+        :param cooldown: Seconds the circuit stays open after it opened
+        """
+        self.filename = filename
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = readbreaker(filename)
+        if self.state is None or self.state.get('endpoint') != endpoint:
+            self.state = dict(endpoint=endpoint, failures=0)
+
+    def failures(self):
+        return self.state['failures']
+
+    def error(self):
+        return self.state.get('error')
+
+    def retryin(self):
+        """Seconds until the open circuit lets a probe through"""
+        return max(self.state.get('retryat', 0) - time.time(), 0)
+
+    def isopen(self):
+        return self.threshold > 0 and self.failures() >= self.threshold and self.retryin() > 0
+
+    def isprobing(self):
+        """Whether the circuit cooled down and lets a single attempt through"""
+        return self.threshold > 0 and self.failures() >= self.threshold and self.retryin() == 0
+
+    def failure(self, error):
+        """Record a failed retrieval, opening the circuit once the failures reach the threshold"""
+        import json
+        now = time.time()
+        self.state['failures'] += 1
+        self.state.setdefault('since', now)
+        self.state['error'] = error
+        if self.threshold > 0 and self.failures() >= self.threshold:
+            self.state['retryat'] = now + min(self.cooldown * 2 ** (self.failures() - self.threshold),
+                                              self.MAXCOOLDOWN)
+        tempfilename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        with open(tempfilename, 'w') as breakerfile:
+            json.dump(self.state, breakerfile)
+        os.replace(tempfilename, self.filename)
+
+    def success(self):
+        """Close the circuit"""
+        if os.path.exists(self.filename):
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+        self.state = dict(endpoint=self.endpoint, failures=0)
+
+
+def readbreaker(breakerfilename):
+    """:return: The state of the PerfCircuitBreaker file, None when the retrievals of the Cell do not fail"""
+    if not os.path.exists(breakerfilename):
+        return None
+    import json
+    try:
+        with open(breakerfilename) as breakerfile:
+            return json.load(breakerfile)
+    except (IOError, ValueError):
+        return None
+
+
+def retrievecells(path, configfilename, workers=8):
+    """
+    Retrieve the perfservlet data of many Cells concurrently, each Cell within its own deadline,
+    so that a slow Cell never delays the snapshots of the other Cells
+    :param path: The file path where perfserv xml and snapshot output is stored
+    :param configfilename: Cells config file, see readcellsconfig
+    :param workers: Maximum number of Cells retrieved at the same time
+    :return: The nagios message, the worst Cell status with one status line per Cell
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        cells = readcellsconfig(configfilename)
+    except (IOError, ValueError) as error:
+        return UNKNOWN, 'Invalid Cells config file {} - {}'.format(configfilename, error)
+    if not cells:
+        return UNKNOWN, 'No Cells defined in {}'.format(configfilename)
+    # Cells sharing a perfservlet endpoint reuse its connections
+    connections = PerfServletConnections()
+    with ThreadPoolExecutor(max_workers=min(workers, len(cells))) as executor:
+        futures = [(cellname, executor.submit(retrieveperfxml, path, cellname, connections=connections,
+                                              **cells[cellname]))
+                   for cellname in sorted(cells)]
+        results = []
+        for cellname, future in futures:
+            try:
+                results.append((cellname, future.result()))
+            except Exception as error:
+                results.append((cellname, (UNKNOWN, 'Error retrieving PMI data - {}'.format(error))))
+    connections.close()
+    failedcells = [cellname for cellname, (status, message) in results if status != OK]
+    if failedcells:
+        summary = '{}/{} Cells failed: {}'.format(len(failedcells), len(results), ', '.join(failedcells))
+    else:
+        summary = '{} Cells refreshed'.format(len(results))
+    # Nagios expects the perfdata on the first line, prefix each Cell perfdata with the Cell name
+    celllines, perfdata = [], []
+    for cellname, (status, message) in results:
+        message, separator, cellperfdata = message.partition('|')
+        celllines.append('{}: {}'.format(cellname, nagiosmessage(status, message)[1]))
+        perfdata.extend('{}_{}'.format(cellname, label) for label in cellperfdata.split())
+    if perfdata:
+        summary += '|' + ' '.join(perfdata)
+    return worststatus(status for cellname, (status, message) in results), '\n'.join([summary] + celllines)
+
+
+def readcellsconfig(configfilename):
+    """
+    Read the Cells config file, an ini file with one section per Cell, e.g.
+    [Cell01]
+    host = dmgr01.example.com
+    port = 9443
+    protocol = https
+    username = perfuser
+    password = secret
+    ignorecert = no
+    savexml = no
+    timeout = 30
+    metrics = Heap, WebContainer, DBConnectionPoolPercentUsed
+    node = Node01
+    server = server1
+    history = 60
+    window = 10m
+    statmap = /etc/nagios/perfserv_statmap.ini
+    refreshfloor = 300
+    refreshceiling = 86400
+    parseworkers = 1
+    retries = 2
+    breakerthreshold = 3
+    breakercooldown = 60
+    nodeworkers = 0
+    Only host and port are mandatory, metrics, node and server scope the retrieval as in retrieve -M, --node, --server
+    :param configfilename: The Cells config file
+    :return: The retrieveperfxml arguments of each Cell by Cell name
+    :raise ValueError: On an invalid config file
+    """
+    import configparser
+    config = configparser.ConfigParser()
+    try:
+        if not config.read(configfilename):
+            raise IOError('Could not read {}'.format(configfilename))
+        cells = {}
+        for cellname in config.sections():
+            cells[cellname] = dict(ip=config.get(cellname, 'host'), port=config.get(cellname, 'port'),
+                                   httpprotocol=config.get(cellname, 'protocol', fallback='http'),
+                                   username=config.get(cellname, 'username', fallback=''),
+                                   password=config.get(cellname, 'password', fallback=''),
+                                   ignorecert=config.getboolean(cellname, 'ignorecert', fallback=False),
+                                   savexml=config.getboolean(cellname, 'savexml', fallback=False),
+                                   timeout=config.getint(cellname, 'timeout', fallback=30),
+                                   metrics=metriclist(config.get(cellname, 'metrics', fallback='')),
+                                   node=config.get(cellname, 'node', fallback=None),
+                                   server=config.get(cellname, 'server', fallback=None),
+                                   history=historysamples(config.get(cellname, 'history', fallback='0')),
+                                   window=windowseconds(config.get(cellname, 'window'))
+                                   if config.get(cellname, 'window', fallback='') else None,
+                                   refreshfloor=config.getint(cellname, 'refreshfloor', fallback=300),
+                                   refreshceiling=config.getint(cellname, 'refreshceiling', fallback=86400),
+                                   parseworkers=config.getint(cellname, 'parseworkers', fallback=1),
+                                   retries=config.getint(cellname, 'retries', fallback=2),
+                                   breakerthreshold=config.getint(cellname, 'breakerthreshold', fallback=3),
+                                   breakercooldown=config.getint(cellname, 'breakercooldown', fallback=60),
+                                   nodeworkers=config.getint(cellname, 'nodeworkers', fallback=0))
+            if config.get(cellname, 'statmap', fallback=''):
+                cells[cellname]['statindex'] = StatPathIndex(readstatmap(config.get(cellname, 'statmap')))
+            if cells[cellname]['window'] and not cells[cellname]['history']:
+                raise ValueError('The window of Cell {} needs a history'.format(cellname))
+    except configparser.Error as error:
+        raise ValueError(str(error).replace('\n', ' '))
+    return cells
+
+
+def snapshotage(snapshotfilename):
+    """:return: Seconds since the perfservlet data of the snapshot file were collected, None without a snapshot"""
+    try:
+        with PerfSnapshotReader(snapshotfilename) as snapshot:
+            return snapshot.age()
+    except (IOError, ValueError):
+        return None
+
+
+def refreshperfdata(path, cellname, ttl, configfilename):
+    """
+    Retrieve the perfservlet data of a Cell on demand, when its snapshot is older than ttl seconds. A single process
+    per Cell retrieves them, holding the lock of the <cell>.refresh file: the others go on with the previous snapshot,
+    or wait for the retrieval when there is no snapshot yet
+    :param path: The file path where perfserv xml and snapshot output is stored
+    :param cellname: The Name of the WAS Cell
+    :param ttl: Seconds the perfservlet data of the snapshot are fresh
+    :param configfilename: Cells config file holding the perfservlet access of the Cell, see readcellsconfig
+    :return: The nagios message of the retrieval, None when this process did not retrieve
+    """
+    import fcntl
+    snapshotfilename = path + cellname + '.snap'
+    age = snapshotage(snapshotfilename)
+    if age is not None and age < ttl:
+        return None
+    with open(path + cellname + '.refresh', 'a') as lockfile:
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            if age is not None:
+                # Another process is retrieving, the previous snapshot is served meanwhile
+                return None
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            # Another process may have retrieved while this one was checking the snapshot age
+            age = snapshotage(snapshotfilename)
+            if age is not None and age < ttl:
+                return None
+            try:
+                cells = readcellsconfig(configfilename)
+            except (IOError, ValueError) as error:
+                return UNKNOWN, 'Invalid Cells config file {} - {}'.format(configfilename, error)
+            if cellname not in cells:
+                return UNKNOWN, 'Cell {} is not defined in {}'.format(cellname, configfilename)
+            return retrieveperfxml(path, cellname, **cells[cellname])
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+class PerfXmlCopy:
+    """File like wrapper of the perfservlet response, which keeps a copy of the xml on disk while it is parsed"""
+
+    def __init__(self, response, xmlfilename):
+        """
+        :param response: The perfservlet response
+        :param xmlfilename: Where to store the perfserv xml
+        """
+        self.response = response
+        self.xmlfile = open(xmlfilename, 'wb')
+
+    def read(self, size=-1):
+        data = self.response.read(size)
+        self.xmlfile.write(data)
+        return data
+
+    def close(self):
+        self.xmlfile.close()
+        self.response.close()
+
+
+# #################################################################################################################
+class PerfServCollector:
+    """Resident Perfservlet Collector, keeps the Cell servers in memory and answers metric queries from them"""
+
+    def __init__(self, path, cellname, ip, port, username, password, httpprotocol='http', ignorecert=False,
+                 savexml=False, metrics=None, node=None, server=None, history=0, window=None, statindex=None,
+                 refreshfloor=300, refreshceiling=86400, parseworkers=1, retries=2, breakerthreshold=3,
+                 breakercooldown=60, nodeworkers=0, timeout=30):
+        """
+        :param path: The file path where perfserv xml and snapshot output is stored
+        :param cellname: The Name of the WAS Cell
+        :param ip: The ip of the perfserv appication
+        :param port: The port of the perfserv appication
+        :param username: An user which is authorized to access perfservlet
+        :param password: perfservlet authorized user password
+        :param httpprotocol: The http protocol to access the perfservlet, can be http or https, default http
+        :param ignorecert: Ignore TLS Certificate, default False
+        :param savexml: Also keep a copy of the perfserv xml on disk, default False
+        :param metrics: Retrieve only the PMI modules of these show Metric Types, default all the PMI modules
+        :param node: Retrieve only the servers of this WAS Node, default all the Nodes of the Cell
+        :param server: Retrieve only this WAS Server, default all the Servers
+        :param history: Samples kept per counter in the history file to derive their rates, default no history
+        :param window: Seconds of history to aggregate the usage percentages over, needs history, default none
+        :param statindex: StatPathIndex of the stat rules to apply, default the built in ones
+        :param refreshfloor: Minimum seconds between two perfservlet config reloads, default 300
+        :param refreshceiling: Maximum seconds between two perfservlet config reloads, default 86400
+        :param parseworkers: Parse the perfservlet xml in this many processes, default a serial parse
+        :param retries: Retries of a failed perfservlet request within a retrieval, default 2
+        :param breakerthreshold: Failed retrievals in a row opening the circuit breaker of the endpoint, default 3
+        :param breakercooldown: Seconds the opened circuit breaker fails the retrievals fast, default 60
+        :param nodeworkers: Retrieve each Node with its own request, this many at the same time, default 0
+        :param timeout: Seconds each retrieval, download and parsing included, may last, default 30
+        """
+        self.path = path
+        self.cellname = cellname
+        self.retrieveargs = dict(ip=ip, port=port, username=username, password=password, httpprotocol=httpprotocol,
+                                 ignorecert=ignorecert, savexml=savexml, metrics=metrics, node=node, server=server,
+                                 statindex=statindex, refreshfloor=refreshfloor, refreshceiling=refreshceiling,
+                                 parseworkers=parseworkers, retries=retries, breakerthreshold=breakerthreshold,
+                                 breakercooldown=breakercooldown, nodeworkers=nodeworkers, timeout=timeout)
+        self.history = history
+        self.window = window
+        # Keep the perfservlet connection alive between retrievals
+        self.connections = PerfServletConnections()
+        self.servers = {}
+        # None until the Cell servers are loaded from the snapshot file or retrieved
+        self.collected = None
+        # The queries never read the disk: the circuit breaker state is read and the topology misses are written
+        # by refresh
+        self.breaker = readbreaker(self.path + self.cellname + '.breaker')
+        self.missed = False
+        self.load()
+
+    def load(self):
+        """Start from the Cell servers of the snapshot file, if any, until the first retrieval succeeds"""
+        try:
+            with PerfSnapshotReader(self.path + self.cellname + '.snap') as snapshot:
+                self.servers = dict((serverfullname, snapshot.get(serverfullname))
+                                    for serverfullname in snapshot.keys())
+                self.collected = snapshot.collected
+        except (IOError, ValueError):
+            pass
+
+    def refresh(self):
+        """
+        Retrieve the perfservlet data and replace the in memory Cell servers
+        :return: The nagios message of the retrieval
+        """
+        if self.missed:
+            # Before the retrieval, so that it already reloads the perfservlet config, see setperfservurl
+            self.missed = False
+            touch(self.path + self.cellname + '.miss')
+        try:
+            return retrieveperfxml(self.path, self.cellname, storeservers=self.storeservers,
+                                   connections=self.connections, **self.retrieveargs)
+        finally:
+            self.breaker = readbreaker(self.path + self.cellname + '.breaker')
+
+    def storeservers(self, servers, keep=()):
+        """
+        Keep the parsed Cell servers in memory. They are stored in the snapshot file as well,
+        so that plain show checks keep working
+        :param keep: The servers of the failed Nodes of a sharded retrieval, see storeperfservers
+        :return: The number of changed and skipped servers of the snapshot file
+        """
+        collected = time.time()
+        snapshot = {}
+        for was in servers:
+            snapshot[was.serverfullname()] = was
+        stored = storeperfservers(self.path + self.cellname + '.snap', list(snapshot.values()), collected,
+                                  historyfilename=self.path + self.cellname + '.hist', historysamples=self.history,
+                                  window=self.window, keep=keep)
+        for was in keep:
+            snapshot[was.serverfullname()] = was
+        # Swap the whole snapshot at once, queries never see a half refreshed Cell
+        self.servers, self.collected = snapshot, collected
+        return stored
+
+    def query(self, nodename, servername, metric, warning, critical, destination=None, jndiname=None, maxage=None,
+              aggregate=None, extra=None, top=5):
+        """Same as queryperfdata, but against the in memory Cell servers"""
+        serverfullname = '.'.join((nodename, servername))
+        servers, collected = self.servers, self.collected
+        status, message = queryserver(servers.get(serverfullname), serverfullname, metric, warning, critical,
+                                      destination, jndiname, aggregate, extra, top)
+        if topologymiss(servers.get(serverfullname), metric, destination, jndiname):
+            # Written by the next refresh
+            self.missed = True
+        return checkdataage(status, message, time.time() - collected, maxage, self.breaker)
+
+
+class PerfQueryServer:
+    """
+    Unix socket server of the resident collector, each client connection is served by its own thread.
+    Each request line is a json object with the show check arguments(nodename, servername, metric, warning,
+    critical, destination, jndiname) and each reply line is a json object with the Nagios status and message
+    """
+
+    def __init__(self, socketpath, collector):
+        """
+        :param socketpath: The unix socket to listen on
+        :param collector: The PerfServCollector answering the queries
+        """
+        import socket
+        # Remove any socket file left behind by a previous collector
+        if os.path.exists(socketpath):
+            os.remove(socketpath)
+        self.socketpath = socketpath
+        self.collector = collector
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(socketpath)
+        self.socket.listen(128)
+
+    def serve_forever(self):
+        import threading
+        while True:
+            try:
+                client, address = self.socket.accept()
+            except OSError:
+                # The server socket is closed
+                return
+            clientthread = threading.Thread(target=self.handle, args=(client,))
+            clientthread.daemon = True
+            clientthread.start()
+
+    def handle(self, client):
+        import json
+        with client:
+            stream = client.makefile('rwb')
+            for line in stream:
+                try:
+                    query = json.loads(line.decode('utf-8'))
+                    status, message = self.collector.query(query['nodename'], query['servername'], query['metric'],
+                                                           query.get('warning'), query.get('critical'),
+                                                           query.get('destination'), query.get('jndiname'),
+                                                           query.get('maxage'), query.get('aggregate'),
+                                                           query.get('extra'), query.get('top', 5))
+                except (ValueError, KeyError, TypeError):
+                    status, message = UNKNOWN, 'Invalid perfservmon query'
+                stream.write(json.dumps(dict(status=status, message=message)).encode('utf-8') + b'\n')
+                stream.flush()
+
+    def close(self):
+        import socket
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        os.remove(self.socketpath)
+
+
+def servecell(collector, socketpath, interval=60):
+    """
+    Run the resident collector: refresh the Cell servers every interval seconds and answer queries on the unix socket
+    until terminated
+    :param collector: A PerfServCollector instance
+    :param socketpath: The unix socket the queries are answered on
+    :param interval: Seconds between perfservlet retrievals
+    """
+    import signal
+    import threading
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    server = None
+    try:
+        while not stop.is_set():
+            started = time.time()
+            status, message = collector.refresh()
+            print(nagiosmessage(status, message)[1])
+            sys.stdout.flush()
+            if server is None and collector.collected is not None:
+                # Start answering queries once the Cell servers are known, either loaded from the snapshot file or
+                # retrieved, show falls back to the snapshot file until then
+                server = PerfQueryServer(socketpath, collector)
+                serverthread = threading.Thread(target=server.serve_forever)
+                serverthread.daemon = True
+                serverthread.start()
+            stop.wait(max(0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.close()
+
+
+def querycollector(socketpath, nodename, servername, metric, warning, critical, destination=None, jndiname=None,
+                   maxage=None, aggregate=None, extra=None, top=5):
+    """
+    Query a resident collector over its unix socket. Falls back to the snapshot file when the collector is not running
+    :param socketpath: The unix socket of the resident collector
+    :return: Nagios Message
+    """
+    import json
+    import socket
+    query = dict(nodename=nodename, servername=servername, metric=metric, warning=warning, critical=critical,
+                 destination=destination, jndiname=jndiname, maxage=maxage, aggregate=aggregate, extra=extra,
+                 top=top)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(10)
+        client.connect(socketpath)
+        client.sendall(json.dumps(query).encode('utf-8') + b'\n')
+        reply = json.loads(client.makefile('rb').readline().decode('utf-8'))
+        return reply['status'], reply['message']
+    except (socket.error, ValueError, KeyError):
+        return None
+    finally:
+        client.close()
+
+
+# #################################################################################################################
+# OpenMetrics exposition of the snapshot file: family name, type, unit and help of each metric family
+OPENMETRICS_FAMILIES = (
+    ('was_heap_size_bytes', 'gauge', 'bytes', 'Maximum JVM heap size'),
+    ('was_heap_used_bytes', 'gauge', 'bytes', 'Used JVM heap'),
+    ('was_webcontainer_threads_active', 'gauge', None, 'Active threads of the WebContainer thread pool'),
+    ('was_webcontainer_threads_max', 'gauge', None, 'Size of the WebContainer thread pool'),
+    ('was_webcontainer_threads_declared_hung', 'counter', None, 'Threads of the WebContainer declared hung'),
+    ('was_orb_threads_active', 'gauge', None, 'Active threads of the ORB thread pool'),
+    ('was_orb_threads_max', 'gauge', None, 'Size of the ORB thread pool'),
+    ('was_connection_pool_used_percent', 'gauge', 'percent', 'Percent used of the JDBC connection pool'),
+    ('was_connection_pool_use_time_seconds', 'gauge', 'seconds', 'Maximum use time of a JDBC connection'),
+    ('was_connection_pool_wait_time_seconds', 'gauge', 'seconds', 'Maximum wait time for a JDBC connection'),
+    ('was_connection_pool_waiting_threads', 'gauge', None, 'Threads waiting for a JDBC connection'),
+    ('was_sessions_live', 'gauge', None, 'Live HTTP sessions of the server'),
+    ('was_sessions_active', 'gauge', None, 'Active HTTP sessions of the server'),
+    ('was_module_sessions_live', 'gauge', None, 'Live HTTP sessions of the web module'),
+    ('was_module_sessions_active', 'gauge', None, 'Active HTTP sessions of the web module'),
+    ('was_web_authentication_time_seconds', 'gauge', 'seconds', 'Maximum web authentication time'),
+    ('was_web_authorization_time_seconds', 'gauge', 'seconds', 'Maximum web authorization time'),
+    ('was_sib_messages_available', 'gauge', None, 'Available messages of the SIB destination'),
+    ('was_sib_messages_consumed', 'counter', None, 'Messages consumed from the SIB destination'),
+    ('was_sib_messages_consumed_rate', 'gauge', None,
+     'Messages consumed per second from the SIB destination since the previous collection'),
+    ('was_usage_window_percent', 'gauge', 'percent', 'Aggregate of the usage over the collection window'),
+    ('was_extra', 'gauge', None, 'Extra metric of the stat map file'),
+    ('was_snapshot_servers', 'gauge', None, 'Servers of the snapshot'),
+    ('was_snapshot_collected_timestamp_seconds', 'gauge', 'seconds', 'Collection time of the snapshot'))
+
+OPENMETRICS_CONTENTTYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def openmetricslabels(labels):
+    """
+    :param labels: A sequence of (label name, label value) tuples
+    :return: The OpenMetrics label set
+    """
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n')) for name, value in labels) + '}'
+
+
+def openmetricsvalue(value):
+    """OpenMetrics representation of a sample value"""
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+def openmetricssamples(was):
+    """
+    The OpenMetrics samples of a WAS server, without the labels identifying the server
+    :param was: A TypicalApplicationServer instance
+    :return: A generator of (family, labels, value) tuples, labels being a tuple of (label name, label value)
+    """
+    for family, value in (('was_heap_size_bytes', was.maxheapMB), ('was_heap_used_bytes', was.heapusedMB)):
+        if value is not None:
+            yield family, (), int(value) * 1048576
+    for family, value in (('was_webcontainer_threads_active', was.wcactive),
+                          ('was_webcontainer_threads_max', was.wcpoolsize),
+                          ('was_webcontainer_threads_declared_hung', was.wcthreadshung),
+                          ('was_orb_threads_active', was.orbactive), ('was_orb_threads_max', was.orbpoolsize),
+                          ('was_sessions_live', was.totallivesessions),
+                          ('was_sessions_active', was.totalactivesessions),
+                          ('was_web_authentication_time_seconds', was.webSecAuthenTime),
+                          ('was_web_authorization_time_seconds', was.webSecAuthorTime)):
+        if value is not None:
+            yield family, (), value
+    for family, label, namedvalues in (('was_connection_pool_used_percent', 'jndi', was.connpoolspercentused),
+                                       ('was_connection_pool_use_time_seconds', 'jndi', was.connpoolsusetime),
+                                       ('was_connection_pool_wait_time_seconds', 'jndi', was.connpoolswaittime),
+                                       ('was_connection_pool_waiting_threads', 'jndi',
+                                        was.connpoolswaitingthreadcount),
+                                       ('was_module_sessions_live', 'module', was.livesessions),
+                                       ('was_module_sessions_active', 'module', was.activesessions)):
+        for name in sorted(namedvalues):
+            if namedvalues[name] is not None:
+                yield family, ((label, name),), namedvalues[name]
+    for name in sorted(was.destinations):
+        destination = was.destinations[name]
+        labels = (('destination', name), ('messaging_engine', destination.MEName),
+                  ('type', 'topicspace' if isinstance(destination, SIBTopicSpace) else 'queue'))
+        if destination.AvailableMessages is not None:
+            yield 'was_sib_messages_available', labels, destination.AvailableMessages
+        if destination.TotalMessagesConsumed is not None:
+            yield 'was_sib_messages_consumed', labels, destination.TotalMessagesConsumed
+        if 'Consumed:' + name in was.rates:
+            yield 'was_sib_messages_consumed_rate', labels, was.rates['Consumed:' + name]
+    for key in sorted(was.aggregates):
+        if key == 'Window':
+            continue
+        # <metric>:<aggregate>, followed by :<jndi> for a connection pool
+        names = key.split(':', 2)
+        labels = (('metric', names[0]), ('aggregate', names[1]))
+        if len(names) > 2:
+            labels += (('jndi', names[2]),)
+        yield 'was_usage_window_percent', labels, was.aggregates[key]
+    for name in sorted(was.extras):
+        yield 'was_extra', (('name', name),), was.extras[name]
+
+
+def renderopenmetrics(cellname, snapshot):
+    """
+    Render all the servers of a snapshot as an OpenMetrics exposition, each sample labeled by cell, node and server
+    :param cellname: The Name of the WAS Cell
+    :param snapshot: A PerfSnapshotReader instance
+    :return: The exposition bytes
+    """
+    celllabels = (('cell', cellname),)
+    samples = dict((family, []) for family, metrictype, unit, description in OPENMETRICS_FAMILIES)
+    for serverfullname in snapshot.keys():
+        was = snapshot.get(serverfullname)
+        serverlabels = celllabels + (('node', was.nodename), ('server', was.name))
+        for family, labels, value in openmetricssamples(was):
+            samples[family].append((serverlabels + labels, value))
+    samples['was_snapshot_servers'].append((celllabels, snapshot.count))
+    samples['was_snapshot_collected_timestamp_seconds'].append((celllabels, snapshot.collected))
+    lines = []
+    for family, metrictype, unit, description in OPENMETRICS_FAMILIES:
+        if not samples[family]:
+            continue
+        lines.append('# TYPE {} {}'.format(family, metrictype))
+        if unit is not None:
+            lines.append('# UNIT {} {}'.format(family, unit))
+        lines.append('# HELP {} {}'.format(family, description))
+        # The samples of a counter are its _total
+        samplename = family + '_total' if metrictype == 'counter' else family
+        for labels, value in samples[family]:
+            lines.append('{}{} {}'.format(samplename, openmetricslabels(labels), openmetricsvalue(value)))
+    lines.append('# EOF\n')
+    return '\n'.join(lines).encode('utf-8')
+
+
+class PerfMetricsExporter:
+    """
+    OpenMetrics exposition of the snapshot file of a Cell. The exposition is rendered once per published snapshot,
+    every other scrape is served the rendered bytes
+    """
+
+    def __init__(self, path, cellname):
+        """
+        :param path: Where snapshot file lies
+        :param cellname: The Name of the WAS Cell
+        """
+        import threading
+        self.snapshotfilename = path + cellname + '.snap'
+        self.cellname = cellname
+        self.lock = threading.Lock()
+        self.snapshotid = None
+        self.exposition = b''
+        self.gzipexposition = b''
+
+    def render(self, gzipped=False):
+        """
+        :param gzipped: Return the gzip compressed exposition
+        :return: The OpenMetrics exposition of the current snapshot
+        :raise IOError, ValueError: When the snapshot file can not be read
+        """
+        import gzip
+        # A new snapshot or delta file is published with a rename, i.e. as a new file
+        filestat = os.stat(self.snapshotfilename)
+        snapshotid = (filestat.st_dev, filestat.st_ino, filestat.st_mtime, filestat.st_size)
+        try:
+            filestat = os.stat(deltafilename(self.snapshotfilename))
+            snapshotid += (filestat.st_ino, filestat.st_mtime, filestat.st_size)
+        except OSError:
+            pass
+        with self.lock:
+            if snapshotid != self.snapshotid:
+                with PerfSnapshotReader(self.snapshotfilename) as snapshot:
+                    self.exposition = renderopenmetrics(self.cellname, snapshot)
+                self.gzipexposition = gzip.compress(self.exposition)
+                self.snapshotid = snapshotid
+            return self.gzipexposition if gzipped else self.exposition
+
+
+def exportcell(exporter, address='127.0.0.1', port=9405):
+    """
+    Serve the OpenMetrics exposition of a Cell at http://<address>:<port>/metrics until terminated
+    :param exporter: A PerfMetricsExporter instance
+    :param address: The address to listen on
+    :param port: The port to listen on
+    """
+    import signal
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            try:
+                body = exporter.render(gzipped)
+            except IOError as error:
+                self.send_error(503, 'Error opening cached metrics file - {}'.format(error.strerror))
+                return
+            except ValueError as error:
+                self.send_error(503, 'Error opening cached metrics file - {}'.format(error))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_CONTENTTYPE)
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes are not logged
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def touch(fullpath):
+    """
+    Used for Refreshing Perfservlet cache, determing the time for this to happen
+    Usage Similar to UNIX touch command
+    """
+    with open(fullpath, 'a'):
+        os.utime(fullpath, None)
+
+
+def setperfservurl(ip, port, path, cellname, httpprotocol, refreshfloor=300, refreshceiling=86400, metrics=None,
+                   node=None, server=None, reload=True):
+    """Construct PerfServlet URL to call from Collector. The perfservlet config is reloaded when a show check missed
+    a server, JNDI name or SIB destination, or the names of the retrieved servers changed(see PerfTopology),
+    since the last reload
+    :param ip: IP Addr of the Server where perfservl runs
+    :param port: HTTP Port of the Server where perfservl runs
+    :param path: Location of .lck file, used for determining the interval window for the specific Cell
+    :param cellname: The Name of the WAS Cell, used in .lck file name
+    :param refreshfloor: Minimum seconds between two perfservlet config reloads
+    :param refreshceiling: Maximum seconds between two perfservlet config reloads
+    :param httpprotocol: The http protocol to access the perfservlet, can be http or https
+    :param metrics: Request only the PMI modules of these show Metric Types, default all the PMI modules
+    :param node: Request only the servers of this WAS Node, default all the Nodes of the Cell
+    :param server: Request only this WAS Server, default all the Servers
+    :param reload: Reload the perfservlet config when due, default True. The Node requests of a sharded retrieval
+    never reload it, see retrieveperfxml
+    :return: PerfServlet URL
+    """
+    cachereffile = path + cellname + '.lck'
+    url = httpprotocol + '://' + ip + ':' + port + '/wasPerfTool/servlet/perfservlet'
+    query = perfservquery(metrics, node, server)
+    if not os.path.isfile(cachereffile):
+        touch(cachereffile)
+    elif reload and configreloaddue(path, cellname, refreshfloor, refreshceiling):
+        touch(cachereffile)
+        query.append('refreshConfig=true')
+    return url + '?' + '&'.join(query) if query else url
+
+
+def configreloaddue(path, cellname, refreshfloor=300, refreshceiling=86400):
+    """
+    Whether the next perfservlet request of the Cell is to reload the perfservlet config, see setperfservurl
+    :return: True when the last reload is older than refreshceiling, or older than refreshfloor and a show check
+    missed a server, JNDI name or SIB destination since
+    """
+    cachereffile = path + cellname + '.lck'
+    missfile = path + cellname + '.miss'
+    if not os.path.isfile(cachereffile):
+        return False
+    refreshed = os.path.getmtime(cachereffile)
+    timeelapsed = time.time() - refreshed
+    return timeelapsed > refreshceiling or \
+        (timeelapsed > refreshfloor and os.path.isfile(missfile) and os.path.getmtime(missfile) > refreshed)
+
+
+def perfservquery(metrics=None, node=None, server=None):
+    """
+    PerfServlet query parameters scoping the response to the PMI modules of the given metrics and to a Node/Server
+    :return: The list of name=value query parameters
+    """
+    from urllib.parse import quote
+    query = []
+    if node:
+        query.append('node=' + quote(node))
+    if server:
+        query.append('server=' + quote(server))
+    modules = set(PMIMODULES[metric] for metric in metrics or ())
+    if modules and None not in modules:
+        # perfservlet separates the requested modules with +
+        query.append('module=' + '+'.join(sorted(modules)))
+    return query
+
+
+def metriclist(value):
+    """
+    Parse a comma separated list of show Metric Types
+    :raise ValueError: On an unknown Metric Type
+    """
+    metrics = [metric.strip() for metric in value.split(',') if metric.strip()]
+    for metric in metrics:
+        if metric not in PMIMODULES:
+            raise ValueError('Unknown Metric Type {}, pick from {}'.format(metric, ', '.join(sorted(PMIMODULES))))
+    return metrics or None
+
+
+def addperfservletargs(subparser):
+    """Perfservlet access arguments, shared by the collecting commands"""
+    subparser.add_argument("-N", type=str, action="store", dest='IPAddress',
+                           help="IP Address of perfservlet server", required=False)
+    subparser.add_argument("-P", type=str, action="store", dest='Port', help="Port of perfservlet server",
+                           required=False)
+    subparser.add_argument("-H", type=str, action="store", dest='HttpProtocol', choices=['http', 'https'],
+                           help="Perfservlet HTTP Protocol", default='http', required=False)
+    subparser.add_argument("--ignorecert", action="store_true",
+                           help="Ignore TLS Server Certificate", required=False)
+    subparser.add_argument("-u", type=str, action="store", dest='Username',
+                           help="Perfservlet authorized user", default='', required=False)
+    subparser.add_argument("-p", type=str, action="store", dest='Password',
+                           help="Perfservlet user password", default='', required=False)
+    subparser.add_argument("--savexml", action="store_true",
+                           help="Keep a copy of the perfservlet xml on disk", required=False)
+    subparser.add_argument("-M", type=metriclist, action="store", dest='Metrics',
+                           help="Comma separated show Metric Types to retrieve, only their PMI modules are requested "
+                                "from perfservlet. Default all the PMI modules", required=False)
+    subparser.add_argument("--checks", type=str, action="store", dest='ChecksFile',
+                           help="Retrieve only the PMI modules of the Metric Types of the checks listed in this "
+                                "show --batch file", required=False)
+    subparser.add_argument("--history", type=historysamples, action="store", dest='History',
+                           help="Keep this many samples of the counters in a history file, to report their rates, "
+                                "e.g. SIB messages consumed per second. Default no history", default=0,
+                           required=False)
+    subparser.add_argument("-W", "--window", type=windowseconds, action="store", dest='Window',
+                           help="Keep the avg, max and p95 of the Heap, WebContainer and DBConnectionPoolPercentUsed "
+                                "usage over this window of the history, e.g. 10m. Needs --history", required=False)
+    subparser.add_argument("--statmap", type=str, action="store", dest='StatMapFile',
+                           help="Also store the extra metrics of this stat map file, see show -M Extra",
+                           required=False)
+    subparser.add_argument("--node", type=str, action="store", dest='ScopeNode',
+                           help="Retrieve only the servers of this Node", required=False)
+    subparser.add_argument("--server", type=str, action="store", dest='ScopeServer',
+                           help="Retrieve only this Server", required=False)
+    subparser.add_argument("--refreshfloor", type=int, action="store", dest='RefreshFloor',
+                           help="Minimum seconds between two perfservlet config reloads, which are requested when a "
+                                "show check refers to an unknown server, JNDI name or SIB destination or when the "
+                                "retrieved servers change. Default 300", default=300, required=False)
+    subparser.add_argument("--refreshceiling", type=int, action="store", dest='RefreshCeiling',
+                           help="Maximum seconds between two perfservlet config reloads, default 86400",
+                           default=86400, required=False)
+    subparser.add_argument("--parseworkers", type=int, action="store", dest='ParseWorkers',
+                           help="Download the whole perfservlet response, then parse it split at Node and Server "
+                                "boundaries in this many processes. Default 1, a single process parsing the "
+                                "response while it streams in", default=1, required=False)
+    subparser.add_argument("--retries", type=int, action="store", dest='Retries',
+                           help="Retries of a failed perfservlet request, after a jittered backoff, as long as the "
+                                "retrieval timeout allows. Default 2", default=2, required=False)
+    subparser.add_argument("--breakerthreshold", type=int, action="store", dest='BreakerThreshold',
+                           help="Failed retrievals in a row after which the perfservlet is not contacted for "
+                                "--breakercooldown seconds, doubled on each failed probe. 0 disables the circuit "
+                                "breaker, default 3", default=3, required=False)
+    subparser.add_argument("--breakercooldown", type=int, action="store", dest='BreakerCooldown',
+                           help="Seconds the circuit breaker stays open, default 60", default=60, required=False)
+    subparser.add_argument("--nodeworkers", type=int, action="store", dest='NodeWorkers',
+                           help="Retrieve each Node of the Cell with its own perfservlet request, this many at the "
+                                "same time, and store them in one snapshot. The Nodes are those of the last retrieval "
+                                "of the whole Cell. Default 0, a single request for the whole Cell", default=0,
+                           required=False)
+
+
+def parsecmdargs():
+    """Parse Given Plugin Attributes"""
+    parser = argparse.ArgumentParser(description='Nagios plugin on Websphere Cell Metrics. Uses the PerfServlet App')
+    parser.add_argument("-C", type=str, action="store", dest='CellName', help="Cell name", required=False)
+    subparsers = parser.add_subparsers(help='Commands', dest='command_name')
+    retrieve_parser = subparsers.add_parser('retrieve', help='Retrieve Data and Store them')
+    addperfservletargs(retrieve_parser)
+    retrieve_parser.add_argument("-t", type=int, action="store", dest='Timeout',
+                                 help="Seconds the retrieval of a Cell may last", default=30, required=False)
+    retrieve_parser.add_argument("--config", type=str, action="store", dest='ConfigFile',
+                                 help="Retrieve all the Cells of this config file concurrently, instead of -C Cell",
+                                 required=False)
+    retrieve_parser.add_argument("--workers", type=int, action="store", dest='Workers',
+                                 help="Maximum number of Cells retrieved concurrently", default=8, required=False)
+    serve_parser = subparsers.add_parser('serve', help='Run a resident collector, answering show queries from memory')
+    addperfservletargs(serve_parser)
+    serve_parser.add_argument("-i", type=int, action="store", dest='Interval',
+                              help="Seconds between perfservlet data retrievals", default=60, required=False)
+    serve_parser.add_argument("-t", type=int, action="store", dest='Timeout',
+                              help="Seconds each retrieval of the Cell may last", default=30, required=False)
+    serve_parser.add_argument("--socket", type=str, action="store", dest='Socket',
+                              help="Unix socket to answer queries on, default <path><CellName>.sock", required=False)
+    export_parser = subparsers.add_parser('export', help='Serve the stored metrics as OpenMetrics over http, '
+                                                         'for Prometheus to scrape')
+    export_parser.add_argument("--address", type=str, action="store", dest='Address',
+                               help="Address to listen on, default 127.0.0.1", default='127.0.0.1', required=False)
+    export_parser.add_argument("--port", type=int, action="store", dest='ExportPort',
+                               help="Port to listen on, default 9405", default=9405, required=False)
+    show_parser = subparsers.add_parser('show', help='Show metrics')
+    show_parser.add_argument("-n", type=str, action="store", dest='NodeName', help="Node Name", required=False)
+    show_parser.add_argument("-s", type=str, action="store", dest='ServerName', help="Server Name", required=False)
+    show_parser.add_argument("-M", type=str, action="store", dest='Metric',
+                             choices=['WebContainer', 'WebContainerThreadHung', 'ORB', 'DBConnectionPoolPercentUsed',
+                                      'DBConnectionPoolUseTime', 'DBConnectionPoolWaitTime',
+                                      'DBConnectionPoolWaitingThreadCount', 'Heap', 'LiveSessions',
+                                      'SIBDestinations', 'WebAuthenticationTime', 'WebAuthorizationTime', 'Extra'],
+                             help="Metric Type", required=False)
+    show_parser.add_argument("-e", type=str, action="store", dest='ExtraName',
+                             help="Extra metric name, as named in the stat map file", required=False)
+    show_parser.add_argument("-d", type=str, action="store", dest='Destination',
+                             help="SIB Destination Name, may contain shell style wildcards to check all the matching "
+                                  "destinations at once, e.g. -d 'ORDERS.*'", required=False)
+    show_parser.add_argument("-j", type=str, action="store", dest='JndiName',
+                             help="JNDI Name, may contain shell style wildcards to check all the matching connection "
+                                  "pools at once, e.g. -j 'jdbc/*'", required=False)
+    show_parser.add_argument("-c", type=int, action="store", dest='Critical',
+                             help="Critical Value for Metric", required=False)
+    show_parser.add_argument("-w", type=int, action="store", dest='Warning',
+                             help="Warning Value for Metric", required=False)
+    show_parser.add_argument("--socket", type=str, action="store", dest='Socket',
+                             help="Query the resident collector listening on this unix socket", required=False)
+    show_parser.add_argument("-A", type=str, action="store", dest='Aggregate', choices=AGGREGATES,
+                             help="Check the aggregate of the metric over the collection window instead of its last "
+                                  "value, kept for {} when collected with --window".format(', '.join(AGGREGATEMETRICS)),
+                             required=False)
+    show_parser.add_argument("-g", type=str, action="store", dest='Function',
+                             choices=['max', 'min', 'sum', 'avg', 'top'],
+                             help="Check the metric over all the servers matching -n and -s, which may contain shell "
+                                  "style wildcards, e.g. -n '*' -s 'cluster1_*'. Default max when -n or -s has a "
+                                  "wildcard", required=False)
+    show_parser.add_argument("--top", type=int, action="store", dest='Top',
+                             help="Number of servers reported by -g top, or of the worst pools or destinations "
+                                  "matching a -j or -d wildcard, default 5", default=5, required=False)
+    show_parser.add_argument("--maxage", type=int, action="store", dest='MaxAge',
+                             help="Warn when the metrics were collected more than MaxAge seconds ago", required=False)
+    show_parser.add_argument("--ttl", type=int, action="store", dest='TTL',
+                             help="Retrieve the perfservlet data first when they were collected more than TTL "
+                                  "seconds ago, one process per Cell retrieves while the others serve the previous "
+                                  "data. Needs --config", required=False)
+    show_parser.add_argument("--config", type=str, action="store", dest='ConfigFile',
+                             help="Cells config file holding the perfservlet access of the Cell, see retrieve --config",
+                             required=False)
+    show_parser.add_argument("--batch", type=str, action="store", dest='BatchFile',
+                             help="Evaluate all the checks listed in this file, use - for stdin. "
+                                  "Each line is host_name;service_description;node;server;metric"
+                                  "[;warning;critical[;jndi[;destination[;extra]]]]. --maxage and --top apply to all "
+                                  "the checks, -A and -g are not allowed", required=False)
+    show_parser.add_argument("-o", type=str, action="store", dest='OutputFile',
+                             help="Append the batch check results to this file, e.g. the Nagios command file. "
+                                  "Default is stdout", required=False)
+    arguments = parser.parse_args()
+    if arguments.command_name == 'retrieve' and arguments.ConfigFile is not None:
+        return arguments
+    if arguments.CellName is None:
+        parser.error('the following arguments are required: -C')
+    if arguments.command_name in ('retrieve', 'serve') and None in (arguments.IPAddress, arguments.Port):
+        subparsers.choices[arguments.command_name].error('the following arguments are required: -N, -P')
+    if arguments.command_name in ('retrieve', 'serve') and arguments.Window and not arguments.History:
+        subparsers.choices[arguments.command_name].error('argument -W/--window: needs --history')
+    if arguments.command_name in ('retrieve', 'serve'):
+        arguments.StatIndex = None
+        if arguments.StatMapFile is not None:
+            try:
+                arguments.StatIndex = StatPathIndex(readstatmap(arguments.StatMapFile))
+            except (IOError, ValueError) as error:
+                subparsers.choices[arguments.command_name].error('Invalid stat map file - {}'.format(error))
+    if arguments.command_name in ('retrieve', 'serve') and arguments.ChecksFile is not None:
+        from perfservshow import readbatchchecks
+        with open(arguments.ChecksFile) as batchfile:
+            checkmetrics = set(check.metric for check in readbatchchecks(batchfile))
+        try:
+            arguments.Metrics = metriclist(','.join(checkmetrics.union(arguments.Metrics or [])))
+        except ValueError as error:
+            subparsers.choices[arguments.command_name].error(str(error))
+    if arguments.command_name == 'show' and arguments.TTL is not None and arguments.ConfigFile is None:
+        show_parser.error('argument --ttl: needs --config')
+    if arguments.command_name == 'show' and arguments.BatchFile is None and \
+            None in (arguments.NodeName, arguments.ServerName, arguments.Metric):
+        show_parser.error('the following arguments are required: -n, -s, -M')
+    if arguments.command_name == 'show' and arguments.BatchFile is not None and arguments.Aggregate is not None:
+        show_parser.error('argument -A: not allowed with --batch')
+    if arguments.command_name == 'show' and arguments.BatchFile is not None and arguments.Function is not None:
+        show_parser.error('argument -g: not allowed with --batch')
+    return arguments
+
+
+def queryserver(appsrv, serverfullname, metric, warning, critical, destination=None, jndiname=None, aggregate=None,
+                extra=None, top=5):
+    """
+    Query a metric of a stored WAS server, shared by all the show checks
+    :param appsrv: The TypicalApplicationServer instance or None when there are no stored statistics for the server
+    :param serverfullname: The <node>.<server> name of the WAS server
+    :return: Nagios Message
+    """
+    if appsrv is None:
+        return UNKNOWN, 'Not available statistics for server ' + serverfullname
+    try:
+        return appsrv.querymetric(metric, warning, critical, destination, jndiname, aggregate, extra, top)
+    except Exception:
+        return UNKNOWN, 'Error querying {} metrics for server {}'.format(metric, serverfullname)
+
+
+def topologymiss(appsrv, metric, destination=None, jndiname=None):
+    """
+    Whether a show check refers to a server, JNDI name or SIB destination missing from the stored data,
+    which the perfservlet may not know of until its config is reloaded
+    :param appsrv: The TypicalApplicationServer instance or None when there are no stored statistics for the server
+    """
+    if appsrv is None:
+        return True
+    if metric.startswith('DBConnectionPool') and jndiname is not None:
+        return not any(matchnames(getattr(appsrv, field), jndiname) for field in
+                       ('connpoolspercentused', 'connpoolsusetime', 'connpoolswaittime', 'connpoolswaitingthreadcount'))
+    if metric == 'SIBDestinations' and destination is not None:
+        # A server without any messaging engine, or whose messaging engine is inactive(see parsesibstats), reports
+        # no destinations whatever the perfservlet config
+        if not appsrv.destinations:
+            return False
+        return not matchnames(appsrv.destinations, destination)
+    return False
+
+
+def formatvalue(value):
+    """A metric value as reported, integral values without decimals"""
+    return str(int(value)) if value == int(value) else '{:.2f}'.format(value)
+
+
+def checkdataage(alertstatus, alertmessage, age, maxage=None, breaker=None):
+    """
+    Report stale perfservlet data: when they are older than maxage seconds the check is at least WARNING.
+    While the retrievals of the Cell fail, the last good data are served marked with their age
+    :param age: Seconds since the perfservlet data were collected
+    :param maxage: Maximum acceptable age in seconds, None to accept any age
+    :param breaker: The PerfCircuitBreaker state of the Cell, see readbreaker, None while the retrievals succeed
+    :return: Nagios Message
+    """
+    if breaker is not None:
+        alertmessage = 'Last good metrics collected {:.0f} seconds ago, the {} retrievals since failed - {}' \
+            .format(age, breaker.get('failures'), alertmessage)
+    if maxage is None or age <= maxage:
+        return alertstatus, alertmessage
+    if alertstatus == OK:
+        alertstatus = WARNING
+    if breaker is not None:
+        return alertstatus, alertmessage
+    return alertstatus, 'Stale metrics collected {:.0f} seconds ago - {}'.format(age, alertmessage)
+
+
+def nagiosmessage(alertstatus, alertmessage):
+    """Nagios Return Code and Plugin Output of a Nagios Msg"""
+    if alertstatus == OK:
+        return OK, 'OK - {}'.format(alertmessage)
+    elif alertstatus == WARNING:
+        return WARNING, 'WARNING - {}'.format(alertmessage)
+    elif alertstatus == CRITICAL:
+        return CRITICAL, 'CRITICAL - {}'.format(alertmessage)
+    else:
+        return UNKNOWN, 'UNKNOWN - {}'.format(alertmessage)
+
+
+def worststatus(statuses):
+    """The most severe of Nagios statuses, ranked OK < WARNING < UNKNOWN < CRITICAL"""
+    ranking = [OK, WARNING, UNKNOWN, CRITICAL]
+    return max([status if status in ranking else UNKNOWN for status in statuses], key=ranking.index, default=OK)
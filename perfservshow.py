@@ -0,0 +1,253 @@
+"""
+@author: varounisdi
+@contributor: atterdag
+"""
+
+# The show checks, which Nagios forks for every service. Kept apart from the perfservmon.py entry point, which is
+# compiled on every run, so that a check only loads cached bytecode
+import sys
+import time
+
+from perfservcore import OK, WARNING, CRITICAL, UNKNOWN, SNAPSHOT_COLUMNS, PerfSnapshotReader, checkdataage, \
+    formatvalue, nagiosmessage, queryserver, readbreaker, topologymiss, touch
+
+
+def queryperfdata(path, cellname, nodename, servername, metric, warning, critical, destination=None, jndiname=None,
+                  maxage=None, aggregate=None, extra=None, top=5):
+    """Fundamental Perfservlet Data Query Method - Used by Nagios show Check
+    :param path: Where snapshot file lies
+    :param cellname: the WAS Cell Name
+    :param nodename: the WAS Node Name
+    :param servername: the WAS Server Name
+    :param metric: Pick one of WebContainer, ORB, DBConnectionPoolPercentUsed, DBConnectionPoolUseTime,
+    DBConnectionPoolWaitTime, DBConnectionPoolWaitingThreadCount, Heap, LiveSessions, SIBDestinations,
+    WebAuthenticationTime, WebAuthorizationTime, Extra
+    :param warning: Warning threshold
+    :param critical: Critical threshold
+    :param jndiname: JNDI Name. Must be defined if Metric = DBConnectionPool*, may contain shell style wildcards
+    :param destination: Destination Name. Must be defined if Metric = SIBDestinations, may contain shell style
+    wildcards
+    :param maxage: Warn when the perfservlet data are older than maxage seconds
+    :param aggregate: Check the avg, max or p95 of the metric over the collection window instead of its last value
+    :param extra: Extra metric name. Must be defined if Metric = Extra
+    :param top: Number of pools or destinations reported when many match the jndiname or destination wildcard
+    :return: Nagios Message
+    """
+    snapshotfilename = path + cellname + '.snap'
+    try:
+        perffile = PerfSnapshotReader(snapshotfilename)
+    except IOError as error:
+        return UNKNOWN, 'Error opening cached metrics file - {}'.format(error.strerror)
+    except ValueError as error:
+        return UNKNOWN, 'Error opening cached metrics file - {}'.format(error)
+    with perffile:
+        serverfullname = '.'.join((nodename, servername))
+        appsrv = perffile.get(serverfullname)
+        status, message = queryserver(appsrv, serverfullname, metric, warning, critical, destination, jndiname,
+                                      aggregate, extra, top)
+        if topologymiss(appsrv, metric, destination, jndiname):
+            touch(path + cellname + '.miss')
+        return checkdataage(status, message, perffile.age(), maxage, readbreaker(path + cellname + '.breaker'))
+
+
+def querygroupperfdata(path, cellname, nodepattern, serverpattern, metric, function, warning, critical, top=5,
+                       maxage=None):
+    """Perfservlet Data Query Method over many servers - Used by Nagios show Check
+    The metric of all the servers is read as one column of the snapshot file, no server record is decoded
+    :param path: Where snapshot file lies
+    :param cellname: the WAS Cell Name
+    :param nodepattern: the WAS Node Name, may contain shell style wildcards
+    :param serverpattern: the WAS Server Name, may contain shell style wildcards
+    :param metric: Pick one of SNAPSHOT_COLUMNS
+    :param function: Pick one of max, min, sum, avg, top
+    :param warning: Warning threshold of the function result, for top of the worst server
+    :param critical: Critical threshold of the function result, for top of the worst server
+    :param top: Number of servers reported by top
+    :param maxage: Warn when the perfservlet data are older than maxage seconds
+    :return: Nagios Message
+    """
+    from fnmatch import fnmatchcase
+    if metric not in SNAPSHOT_COLUMNS:
+        return UNKNOWN, 'Checks over many servers are only available for {} metrics'.format(', '.join(SNAPSHOT_COLUMNS))
+    snapshotfilename = path + cellname + '.snap'
+    try:
+        perffile = PerfSnapshotReader(snapshotfilename)
+    except IOError as error:
+        return UNKNOWN, 'Error opening cached metrics file - {}'.format(error.strerror)
+    except ValueError as error:
+        return UNKNOWN, 'Error opening cached metrics file - {}'.format(error)
+    with perffile:
+        column = perffile.column(metric)
+        pattern = '.'.join((nodepattern, serverpattern))
+        if pattern == '*.*':
+            selected = range(perffile.count)
+        else:
+            selected = [i for i, serverfullname in enumerate(perffile.keys()) if fnmatchcase(serverfullname, pattern)]
+        # NaN marks the servers without the metric
+        values = [(column[i], i) for i in selected if column[i] == column[i]]
+        if not values:
+            status, message = UNKNOWN, 'No {} metrics for servers {}'.format(metric, pattern)
+            if not selected:
+                touch(path + cellname + '.miss')
+        else:
+            status, message = aggregateservers(perffile, metric, function, values, warning, critical, top)
+        return checkdataage(status, message, perffile.age(), maxage, readbreaker(path + cellname + '.breaker'))
+
+
+def aggregateservers(perffile, metric, function, values, warning, critical, top=5):
+    """
+    :param perffile: The PerfSnapshotReader of the values
+    :param values: (value, server index) tuples of the selected servers
+    :return: Nagios Message of the function result
+    """
+    unit = dict(Heap='%', WebContainer='%', ORB='%', DBConnectionPoolPercentUsed='%', WebAuthenticationTime='s',
+                WebAuthorizationTime='s').get(metric, '')
+    label = metric.lower()
+    thresholds = '{};{}'.format('' if warning is None else warning, '' if critical is None else critical)
+    servername = lambda i: perffile.recordkey(i).decode('utf-8')
+    if function == 'top':
+        worst = sorted(values, reverse=True)[:top]
+        result = worst[0][0]
+        msg = '{} top {} of {} servers: {}|'.format(metric, len(worst), len(values), ', '.join(
+            '{} {}{}'.format(servername(i), formatvalue(value), unit) for value, i in worst))
+        msg += ' '.join("'{}_{}'={}{};{}".format(servername(i), label, formatvalue(value), unit, thresholds)
+                        for value, i in worst)
+    else:
+        if function == 'max':
+            result, i = max(values)
+        elif function == 'min':
+            result, i = min(values)
+        elif function == 'sum':
+            result = sum(value for value, i in values)
+        else:
+            result = sum(value for value, i in values) / len(values)
+        msg = '{} {} of {} servers: {}{}'.format(metric, function, len(values), formatvalue(result), unit)
+        if function in ('max', 'min'):
+            msg += ' on {}'.format(servername(i))
+        msg += '|{}_{}={}{};{}'.format(label, function, formatvalue(result), unit, thresholds)
+    msg += ' servers={}'.format(len(values))
+    if critical is not None and result >= critical:
+        return CRITICAL, msg
+    elif warning is not None and warning < result:
+        return WARNING, msg
+    return OK, msg
+
+
+def querybatchperfdata(path, cellname, checks, maxage=None, top=5):
+    """Batch Perfservlet Data Query Method - Used by Nagios show --batch Check
+    The snapshot file is opened once and each WAS server is loaded once, no matter how many checks refer to it.
+    The checks are those of a single server each and of the last values, not of the aggregates over the collection
+    window
+    :param path: Where snapshot file lies
+    :param cellname: the WAS Cell Name
+    :param checks: An iterable of BatchCheck instances
+    :param maxage: Warn when the perfservlet data are older than maxage seconds
+    :param top: Number of the worst pools or destinations reported by the checks of a -j or -d wildcard
+    :return: A generator of (BatchCheck, Nagios Message) tuples
+    """
+    snapshotfilename = path + cellname + '.snap'
+    try:
+        perffile = PerfSnapshotReader(snapshotfilename)
+    except (IOError, ValueError):
+        for check in checks:
+            yield check, (UNKNOWN, 'Error opening cached metrics file')
+        return
+    with perffile:
+        age = perffile.age()
+        breaker = readbreaker(path + cellname + '.breaker')
+        servers = {}
+        for check in checks:
+            serverfullname = '.'.join((check.nodename, check.servername))
+            if serverfullname not in servers:
+                servers[serverfullname] = perffile.get(serverfullname)
+            status, message = queryserver(servers[serverfullname], serverfullname, check.metric, check.warning,
+                                          check.critical, check.destination, check.jndiname, extra=check.extra, top=top)
+            if topologymiss(servers[serverfullname], check.metric, check.destination, check.jndiname):
+                touch(path + cellname + '.miss')
+            yield check, checkdataage(status, message, age, maxage, breaker)
+
+
+class BatchCheck:
+    """A Nagios Service Check listed in a show --batch file"""
+
+    def __init__(self, hostname, servicedesc, nodename, servername, metric, warning=None, critical=None, jndiname=None,
+                 destination=None, extra=None):
+        """
+        :param hostname: The Nagios host the check result belongs to
+        :param servicedesc: The Nagios service description the check result belongs to
+        :param nodename: the WAS Node Name
+        :param servername: the WAS Server Name
+        :param metric: the Metric Type, same as show -M
+        :param warning: Warning threshold
+        :param critical: Critical threshold
+        :param jndiname: JNDI Name
+        :param destination: Destination Name
+        :param extra: Extra metric name
+        """
+        self.hostname = hostname
+        self.servicedesc = servicedesc
+        self.nodename = nodename
+        self.servername = servername
+        self.metric = metric
+        self.warning = warning
+        self.critical = critical
+        self.jndiname = jndiname
+        self.destination = destination
+        self.extra = extra
+
+
+def readbatchchecks(batchfile):
+    """
+    Read the checks of a show --batch file. Empty lines and lines starting with # are ignored
+    Line Format: host_name;service_description;node;server;metric[;warning;critical[;jndi[;destination[;extra]]]]
+    :param batchfile: An open batch file
+    :return: A generator of BatchCheck instances
+    """
+    for lineno, line in enumerate(batchfile, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = [field.strip() or None for field in line.split(';')]
+        if len(fields) < 5 or len(fields) > 10 or None in fields[:5]:
+            sys.stderr.write('Ignoring invalid batch check on line {}: {}\n'.format(lineno, line))
+            continue
+        fields += [None] * (10 - len(fields))
+        try:
+            warning, critical = [int(value) if value is not None else None for value in fields[5:7]]
+        except ValueError:
+            sys.stderr.write('Ignoring invalid batch check thresholds on line {}: {}\n'.format(lineno, line))
+            continue
+        yield BatchCheck(fields[0], fields[1], fields[2], fields[3], fields[4], warning, critical,
+                         jndiname=fields[7], destination=fields[8], extra=fields[9])
+
+
+def showbatch(batchfilename, outputfilename, results):
+    """
+    Write the batch check results in Nagios passive service check result format
+    :param batchfilename: The file the checks were read from, used in the summary message
+    :param outputfilename: Where to append the check results, None for stdout
+    :param results: An iterable of (BatchCheck, Nagios Message) tuples
+    """
+    # Line buffered, so that each result is a separate write when appending to the Nagios command pipe
+    output = open(outputfilename, 'a', buffering=1) if outputfilename else sys.stdout
+    noresults = 0
+    try:
+        for check, (alertstatus, alertmessage) in results:
+            returncode, pluginoutput = nagiosmessage(alertstatus, alertmessage)
+            output.write('[{ts}] PROCESS_SERVICE_CHECK_RESULT;{host};{svc};{rc};{out}\n'
+                         .format(ts=int(time.time()), host=check.hostname, svc=check.servicedesc, rc=returncode,
+                                 out=pluginoutput))
+            noresults += 1
+    finally:
+        if outputfilename:
+            output.close()
+    if outputfilename:
+        show(OK, '{} check results of {} written to {}'.format(noresults, batchfilename, outputfilename))
+    sys.exit(OK)
+
+
+def show(alertstatus, alertmessage):
+    """Print Nagios Msg and exit with appropriate Return Code"""
+    returncode, pluginoutput = nagiosmessage(alertstatus, alertmessage)
+    print(pluginoutput)
+    sys.exit(returncode)
@@ -0,0 +1,115 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import perfservcore  # noqa: E402
+
+DATADIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+@pytest.fixture
+def cellxml():
+    """The perfservlet xml of a Cell of 3 Nodes and 15 servers"""
+    with open(os.path.join(DATADIR, 'cell.xml'), 'rb') as xmlfile:
+        return xmlfile.read()
+
+
+@pytest.fixture
+def path(tmp_path):
+    """The perfservmon file path, with the trailing separator perfservmon appends the file names to"""
+    return str(tmp_path) + os.sep
+
+
+class PerfServletStub:
+    """
+    A local perfservlet serving the data/cell.xml Cell, scoped to a Node by the node query parameter.
+    The answers of the whole Cell(None) or of a Node are set in the behaviours: an http status code, 'invalid' for
+    a truncated xml, 'failed' for a failed responseStatus or seconds to wait before answering
+    """
+
+    def __init__(self, cellxml):
+        import threading
+        from http.server import ThreadingHTTPServer
+        self.cellxml = cellxml
+        self.behaviours = {}
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.port = str(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs=dict(poll_interval=0.05))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handler(self):
+        from http.server import BaseHTTPRequestHandler
+        stub = self
+
+        class PerfServletHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                status, body = stub.answer(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return PerfServletHandler
+
+    def answer(self, url):
+        import time
+        import xml.etree.ElementTree as ET
+        from urllib.parse import parse_qs, urlsplit
+        node = parse_qs(urlsplit(url).query).get('node', [None])[0]
+        behaviour = self.behaviours.get(node, 'ok')
+        if isinstance(behaviour, float):
+            time.sleep(behaviour)
+        elif isinstance(behaviour, int):
+            return behaviour, b''
+        root = ET.fromstring(self.cellxml)
+        if node is not None:
+            for nodestat in list(root):
+                if nodestat.attrib.get('name') != node:
+                    root.remove(nodestat)
+        if behaviour == 'failed':
+            root = ET.Element('PerformanceMonitor', responseStatus='failed')
+        body = ET.tostring(root)
+        if behaviour == 'invalid':
+            body = body[:len(body) // 2]
+        return 200, body
+
+    def nodes(self):
+        """The Node names of the requests, None for a whole Cell request"""
+        return [url.split('node=')[1].split('&')[0] if 'node=' in url else None for url in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def perfservlet(cellxml):
+    stub = PerfServletStub(cellxml)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def retrieve(path, perfservlet):
+    """Retrieve the Cell from the local perfservlet, with the given retrieveperfxml arguments"""
+    def retrieve(**kwargs):
+        return perfservcore.retrieveperfxml(path, 'cell', '127.0.0.1', perfservlet.port, None, None, **kwargs)
+    return retrieve
+
+
+@pytest.fixture
+def breaker(path):
+    """Read the circuit breaker state of the Cell, None when closed"""
+    return lambda: perfservcore.readbreaker(path + 'cell.breaker')
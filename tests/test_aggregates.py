@@ -0,0 +1,104 @@
+import pytest
+
+import perfservbench
+import perfservcore
+import perfservshow
+
+
+@pytest.mark.parametrize('values, aggregates', [
+    ([5], {'avg': 5.0, 'max': 5, 'p95': 5}),
+    ([3, 1, 2], {'avg': 2.0, 'max': 3, 'p95': 3}),
+    (list(range(1, 21)), {'avg': 10.5, 'max': 20, 'p95': 19}),
+    (list(range(100, 0, -1)), {'avg': 50.5, 'max': 100, 'p95': 95}),
+])
+def test_aggregate(values, aggregates):
+    assert perfservcore.aggregate(values) == aggregates
+
+
+def collect(path, was, collected, window, samples=10):
+    with perfservcore.PerfHistory(path + 'cell.hist', samples) as history:
+        perfservcore.recordaggregates(history, was, collected, window)
+    return was.aggregates
+
+
+def makeserver(heapused, wcactive=10, wcpoolsize=50):
+    was = perfservcore.TypicalApplicationServer('server1', 'node1')
+    was.heapusedMB, was.maxheapMB = heapused, 1000
+    was.wcactive, was.wcpoolsize = wcactive, wcpoolsize
+    was.addjdbcconnpoolpercentused('jdbc/ds1', heapused // 10)
+    return was
+
+
+def test_window(path):
+    for i, heapused in enumerate([900, 100, 200, 300]):
+        aggregates = collect(path, makeserver(heapused), 1000.0 + 60 * i, 130)
+    # The samples of the last 130 seconds only
+    assert aggregates['Heap:max'] == 30.0
+    assert aggregates['Heap:avg'] == 20.0
+    assert aggregates['DBConnectionPoolPercentUsed:max:jdbc/ds1'] == 30.0
+    assert aggregates['WebContainer:p95'] == 20.0
+    assert aggregates['Window'] == 130
+
+
+def test_window_beyond_the_history(path):
+    for i, heapused in enumerate([900, 100, 200, 300]):
+        aggregates = collect(path, makeserver(heapused), 1000.0 + 60 * i, 3600, samples=2)
+    # At most the samples kept
+    assert aggregates['Heap:max'] == 30.0
+    assert aggregates['Heap:avg'] == 25.0
+
+
+def test_empty_pool_is_skipped(path):
+    aggregates = collect(path, makeserver(500, wcactive=0, wcpoolsize=0), 1000.0, 600)
+    assert 'WebContainer:avg' not in aggregates
+    assert aggregates['Heap:avg'] == 50.0
+    was = makeserver(500)
+    was.maxheapMB = 0
+    assert 'Heap:avg' not in collect(path, was, 1060.0, 600)
+
+
+def test_store_with_an_empty_pool(path):
+    servers = perfservbench.makecell(3)
+    # As parsed from PoolSize upperBound="0"
+    servers[1].wcpoolsize = 0
+    servers[2].maxheapMB = 0
+    for collected in (1000.0, 1060.0):
+        perfservcore.storeperfservers(path + 'cell.snap', servers, collected, historyfilename=path + 'cell.hist',
+                                      historysamples=10, window=600)
+    assert perfservshow.queryperfdata(path, 'cell', 'node0', 'server1', 'WebContainer', 80, 90, aggregate='avg') == \
+        (perfservcore.UNKNOWN, 'Could not find WebContainer Usage avg over the collection window for server server1')
+
+
+@pytest.fixture
+def history(path):
+    """Two collections of a server with a 600 seconds window"""
+    for collected, heapused in ((1000.0, 400), (1060.0, 800)):
+        perfservcore.storeperfservers(path + 'cell.snap', [makeserver(heapused)], collected,
+                                      historyfilename=path + 'cell.hist', historysamples=10, window=600)
+
+
+def test_query_heap(path, history):
+    assert perfservshow.queryperfdata(path, 'cell', 'node1', 'server1', 'Heap', 70, 90, aggregate='avg') == \
+        (perfservcore.OK, 'Heap Usage avg over 600 seconds: 60%, now 800/1000 MB|heapusage_avg=60%;70;90 '
+                         'usedheap=800MB;;;0;1000')
+    assert perfservshow.queryperfdata(path, 'cell', 'node1', 'server1', 'Heap', 70, 90, aggregate='max')[0] == \
+        perfservcore.WARNING
+
+
+def test_query_webcontainer(path, history):
+    assert perfservshow.queryperfdata(path, 'cell', 'node1', 'server1', 'WebContainer', 10, 90, aggregate='p95') == \
+        (perfservcore.WARNING, 'WebContainer Thread Pool p95 over 600 seconds: 20%, now 10/50|'
+                              'wcthreadpoolusage_p95=20%;10;90 wcthreadpoolused=10;;;0;50')
+
+
+def test_query_connection_pool(path, history):
+    assert perfservshow.queryperfdata(path, 'cell', 'node1', 'server1', 'DBConnectionPoolPercentUsed', 70, 90,
+                                      jndiname='jdbc/ds1', aggregate='max') == \
+        (perfservcore.WARNING, 'DB Connection Pool Percent Used max over 600 seconds - jdbc/ds1 80%|'
+                              'jdbc/ds1_usage_max=80%;70;90')
+
+
+def test_query_without_history(path):
+    perfservcore.storeperfservers(path + 'cell.snap', [makeserver(400)])
+    assert perfservshow.queryperfdata(path, 'cell', 'node1', 'server1', 'Heap', 70, 90, aggregate='avg') == \
+        (perfservcore.UNKNOWN, 'Could not find Heap Usage avg over the collection window for server server1')
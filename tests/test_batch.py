@@ -0,0 +1,96 @@
+import io
+import re
+
+import pytest
+
+import perfservcore
+import perfservshow
+
+BATCH = """# host_name;service_description;node;server;metric[;warning;critical[;jndi[;destination[;extra]]]]
+
+host0;Heap;node0;server0;Heap;75;90
+host0;Pool;node0;server0;DBConnectionPoolPercentUsed;75;90;jdbc/ds0
+ host0 ; Queue ; node0 ; server0 ; SIBDestinations ; 10 ; 100 ; ; Q0
+host1;Sessions;node1;server2;LiveSessions
+host1;Missing fields;node1;server2
+host1;Thresholds;node1;server2;Heap;high;90
+host1;Too many fields;node1;server2;Heap;75;90;;;;more
+host1;;node1;server2;Heap;75;90
+"""
+
+
+@pytest.fixture
+def snapshot(path, cellxml):
+    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(cellxml))
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+
+
+def test_readbatchchecks(capsys):
+    checks = list(perfservshow.readbatchchecks(io.StringIO(BATCH)))
+    assert [(check.hostname, check.servicedesc, check.nodename, check.servername, check.metric, check.warning,
+             check.critical, check.jndiname, check.destination, check.extra) for check in checks] == [
+        ('host0', 'Heap', 'node0', 'server0', 'Heap', 75, 90, None, None, None),
+        ('host0', 'Pool', 'node0', 'server0', 'DBConnectionPoolPercentUsed', 75, 90, 'jdbc/ds0', None, None),
+        ('host0', 'Queue', 'node0', 'server0', 'SIBDestinations', 10, 100, None, 'Q0', None),
+        ('host1', 'Sessions', 'node1', 'server2', 'LiveSessions', None, None, None, None, None)]
+    assert capsys.readouterr().err.splitlines() == [
+        'Ignoring invalid batch check on line 7: host1;Missing fields;node1;server2',
+        'Ignoring invalid batch check thresholds on line 8: host1;Thresholds;node1;server2;Heap;high;90',
+        'Ignoring invalid batch check on line 9: host1;Too many fields;node1;server2;Heap;75;90;;;;more',
+        'Ignoring invalid batch check on line 10: host1;;node1;server2;Heap;75;90']
+
+
+def test_querybatchperfdata(path, snapshot):
+    checks = list(perfservshow.readbatchchecks(io.StringIO(BATCH)))
+    results = list(perfservshow.querybatchperfdata(path, 'cell', checks))
+    assert [check for check, result in results] == checks
+    for check, result in results:
+        assert result == perfservshow.queryperfdata(path, 'cell', check.nodename, check.servername, check.metric,
+                                                    check.warning, check.critical, destination=check.destination,
+                                                    jndiname=check.jndiname)
+
+
+def test_batch_top(path, snapshot):
+    checks = perfservshow.readbatchchecks(io.StringIO('host0;Pools;node0;server0;DBConnectionPoolPercentUsed;75;90;'
+                                                      'jdbc/*\n'))
+    check, (status, message) = next(perfservshow.querybatchperfdata(path, 'cell', checks, top=1))
+    assert message == perfservshow.queryperfdata(path, 'cell', 'node0', 'server0', 'DBConnectionPoolPercentUsed', 75,
+                                                 90, jndiname='jdbc/*', top=1)[1]
+
+
+def test_missing_snapshot(path):
+    checks = list(perfservshow.readbatchchecks(io.StringIO(BATCH)))
+    assert [result for check, result in perfservshow.querybatchperfdata(path, 'cell', checks)] == \
+        [(perfservcore.UNKNOWN, 'Error opening cached metrics file')] * 4
+
+
+def results(path):
+    checks = list(perfservshow.readbatchchecks(io.StringIO('host0;Heap;node0;server0;Heap;75;90\n'
+                                                           'host0;Nothing;node0;noserver;Heap;75;90\n')))
+    return list(perfservshow.querybatchperfdata(path, 'cell', checks))
+
+
+def test_showbatch_stdout(path, snapshot, capsys):
+    heap = perfservshow.queryperfdata(path, 'cell', 'node0', 'server0', 'Heap', 75, 90)
+    with pytest.raises(SystemExit) as excinfo:
+        perfservshow.showbatch('stdin', None, results(path))
+    assert excinfo.value.code == perfservcore.OK
+    lines = capsys.readouterr().out.splitlines()
+    assert [re.sub(r'^\[\d+\] ', '[ts] ', line) for line in lines] == [
+        '[ts] PROCESS_SERVICE_CHECK_RESULT;host0;Heap;{};{}'.format(*perfservcore.nagiosmessage(*heap)),
+        '[ts] PROCESS_SERVICE_CHECK_RESULT;host0;Nothing;3;UNKNOWN - Not available statistics for server '
+        'node0.noserver']
+
+
+def test_showbatch_output_file(path, snapshot, capsys):
+    with open(path + 'nagios.cmd', 'w') as commandfile:
+        commandfile.write('[1] PREVIOUS\n')
+    with pytest.raises(SystemExit):
+        perfservshow.showbatch('checks.txt', path + 'nagios.cmd', results(path))
+    assert capsys.readouterr().out == 'OK - 2 check results of checks.txt written to {}\n'.format(path + 'nagios.cmd')
+    with open(path + 'nagios.cmd') as commandfile:
+        lines = commandfile.read().splitlines()
+    assert lines[0] == '[1] PREVIOUS'
+    assert len(lines) == 3
+    assert lines[2].endswith('] PROCESS_SERVICE_CHECK_RESULT;host0;Nothing;3;UNKNOWN - Not available statistics '
+                             'for server node0.noserver')
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import perfservbench
+import perfservcore
+import perfservshow
+
+
+@pytest.fixture
+def servers(path):
+    servers = perfservbench.makecell(60)
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    return servers
+
+
+def heap(was):
+    return int(float(was.heapusedMB) / float(was.maxheapMB) * 100)
+
+
+def test_max_over_the_cell(path, servers):
+    worst = max(servers, key=heap)
+    status, message = perfservshow.querygroupperfdata(path, 'cell', '*', '*', 'Heap', 'max', 101, 102)
+    assert status == perfservcore.OK
+    assert message == 'Heap max of 60 servers: {0}% on {1}|heap_max={0}%;101;102 servers=60'.format(
+        heap(worst), worst.serverfullname())
+
+
+@pytest.mark.parametrize('nodepattern, serverpattern', [
+    ('node1', '*'),
+    ('node[02]', 'server*'),
+    ('*', 'server1?'),
+    ('node?', 'server5'),
+])
+def test_selection(path, servers, nodepattern, serverpattern):
+    selected = [was for was in servers
+                if perfservcore.matchnames([was.nodename], nodepattern) and
+                perfservcore.matchnames([was.name], serverpattern)]
+    status, message = perfservshow.querygroupperfdata(path, 'cell', nodepattern, serverpattern, 'Heap', 'sum', None,
+                                                      None)
+    assert message == 'Heap sum of {0} servers: {1}%|heap_sum={1}%;; servers={0}'.format(
+        len(selected), sum(heap(was) for was in selected))
+
+
+def test_min_and_avg(path, servers):
+    selected = [was for was in servers if was.nodename == 'node2']
+    best = min(selected, key=heap)
+    assert perfservshow.querygroupperfdata(path, 'cell', 'node2', '*', 'Heap', 'min', None, None)[1] == \
+        'Heap min of 20 servers: {0}% on {1}|heap_min={0}%;; servers=20'.format(heap(best), best.serverfullname())
+    status, message = perfservshow.querygroupperfdata(path, 'cell', 'node2', '*', 'Heap', 'avg', 10, 20)
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('Heap avg of 20 servers: ')
+
+
+def test_top(path, servers):
+    worst = sorted(servers, key=lambda was: (heap(was), was.serverfullname()), reverse=True)[:3]
+    status, message = perfservshow.querygroupperfdata(path, 'cell', 'node*', '*', 'Heap', 'top', 1, 2, top=3)
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('Heap top 3 of 60 servers: {}|'.format(
+        ', '.join('{} {}%'.format(was.serverfullname(), heap(was)) for was in worst)))
+
+
+def test_delta_overlay(path, servers):
+    servers[7].heapusedMB = servers[7].maxheapMB
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    assert os.path.exists(path + 'cell.delta')
+    assert perfservshow.querygroupperfdata(path, 'cell', '*', '*', 'Heap', 'max', None, None)[1] == \
+        'Heap max of 60 servers: 100% on node0.server7|heap_max=100%;; servers=60'
+
+
+def test_no_match(path, servers):
+    assert perfservshow.querygroupperfdata(path, 'cell', 'nonode*', '*', 'Heap', 'max', 80, 90) == \
+        (perfservcore.UNKNOWN, 'No Heap metrics for servers nonode*.*')
+    # The servers may be missing from the perfservlet config
+    assert os.path.exists(path + 'cell.miss')
+
+
+def test_not_a_column(path, servers):
+    assert perfservshow.querygroupperfdata(path, 'cell', '*', '*', 'SIBDestinations', 'max', 80, 90)[0] == \
+        perfservcore.UNKNOWN
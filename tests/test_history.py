@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+import perfservcore
+
+
+def makeserver(threadshung, consumed):
+    was = perfservcore.TypicalApplicationServer('server1', 'node1')
+    was.wcthreadshung = threadshung
+    was.addsibme('node1.server1-bus')
+    was.adddestination(perfservcore.SIBQueue('QUEUE.1', 'node1.server1-bus', consumed, 0))
+    return was
+
+
+def test_record_returns_the_previous_sample(path):
+    with perfservcore.PerfHistory(path + 'cell.hist', 5) as history:
+        assert history.record('node1.server1/counter', 1000.0, 10) is None
+    with perfservcore.PerfHistory(path + 'cell.hist', 5) as history:
+        assert history.record('node1.server1/counter', 1060.0, 15) == (1000.0, 10)
+        assert history.record('node1.server1/other', 1060.0, 1) is None
+        assert history.record('node1.server1/counter', 1120.0, 18) == (1060.0, 15)
+
+
+def test_wrap_around_keeps_the_last_samples(path):
+    for i in range(8):
+        with perfservcore.PerfHistory(path + 'cell.hist', 3) as history:
+            history.record('node1.server1/counter', 1000.0 + i, i)
+    size = os.path.getsize(path + 'cell.hist')
+    with perfservcore.PerfHistory(path + 'cell.hist', 3) as history:
+        assert history.values('node1.server1/counter', 0) == [7, 6, 5]
+        assert history.values('node1.server1/counter', 1006.0) == [7, 6]
+        assert history.values('node1.server1/nosuchcounter', 0) == []
+        for i in range(8, 20):
+            history.record('node1.server1/counter', 1000.0 + i, i)
+        assert history.values('node1.server1/counter', 0) == [19, 18, 17]
+    # The samples are overwritten in place
+    assert os.path.getsize(path + 'cell.hist') == size
+
+
+def test_new_series_are_readable_before_close(path):
+    with perfservcore.PerfHistory(path + 'cell.hist', 3) as history:
+        history.record('node1.server1/counter', 1000.0, 4)
+        assert history.values('node1.server1/counter', 0) == [4]
+
+
+def test_a_different_size_starts_over(path):
+    with perfservcore.PerfHistory(path + 'cell.hist', 3) as history:
+        history.record('node1.server1/counter', 1000.0, 4)
+    with perfservcore.PerfHistory(path + 'cell.hist', 5) as history:
+        assert history.values('node1.server1/counter', 0) == []
+        assert history.record('node1.server1/counter', 1060.0, 5) is None
+
+
+def collect(path, was, collected, samples=4):
+    """Record the counters of a server as a collection does, in its own opening of the history file"""
+    with perfservcore.PerfHistory(path + 'cell.hist', samples) as history:
+        perfservcore.recordrates(history, was, collected)
+    return was.rates
+
+
+def test_rates(path):
+    assert collect(path, makeserver('2', '1000'), 1000.0) == {}
+    assert collect(path, makeserver('5', '1600'), 1060.0) == {'ThreadsHung': 3, 'ThreadsHungInterval': 60.0,
+                                                              'Consumed:QUEUE.1': 10.0}
+    assert collect(path, makeserver('5', '1600'), 1120.0) == {'ThreadsHung': 0, 'ThreadsHungInterval': 60.0,
+                                                              'Consumed:QUEUE.1': 0.0}
+
+
+def test_rates_after_a_restart(path):
+    collect(path, makeserver(7, 5000), 1000.0)
+    # The counters started over
+    assert collect(path, makeserver(1, 300), 1030.0) == {'ThreadsHung': 1, 'ThreadsHungInterval': 30.0,
+                                                         'Consumed:QUEUE.1': 10.0}
+
+
+def test_rates_across_a_wrap_around(path):
+    for i in range(10):
+        rates = collect(path, makeserver(i, 100 * i), 1000.0 + 10 * i, samples=2)
+    assert rates == {'ThreadsHung': 1, 'ThreadsHungInterval': 10.0, 'Consumed:QUEUE.1': 10.0}
+
+
+def test_no_rate_within_the_same_collection(path):
+    collect(path, makeserver(1, 100), 1000.0)
+    assert collect(path, makeserver(2, 200), 1000.0) == {}
+
+
+@pytest.mark.parametrize('value', ['1', '-1', 'x'])
+def test_invalid_history_samples(value):
+    with pytest.raises(ValueError):
+        perfservcore.historysamples(value)
@@ -0,0 +1,89 @@
+import gzip
+import io
+
+import pytest
+
+import perfservbench
+import perfservcore
+
+
+@pytest.fixture
+def exposition(path, cellxml):
+    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(cellxml))
+    perfservcore.storeperfservers(path + 'cell.snap', servers, collected=1000.0)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        return perfservcore.renderopenmetrics('cell', snapshot).decode('utf-8').splitlines()
+
+
+def family(exposition, name):
+    """The metadata and sample lines of a metric family"""
+    start = next(i for i, line in enumerate(exposition) if line.startswith('# TYPE {} '.format(name)))
+    end = next((i for i in range(start + 1, len(exposition)) if exposition[i].startswith('# TYPE ')),
+               len(exposition) - 1)
+    return exposition[start:end]
+
+
+@pytest.mark.parametrize('labels, labelset', [
+    ((('cell', 'cell'),), '{cell="cell"}'),
+    ((('name', 'a\\b'), ('jndi', 'jdbc/"ds"')), '{name="a\\\\b",jndi="jdbc/\\"ds\\""}'),
+    ((('name', 'two\nlines'),), '{name="two\\nlines"}'),
+])
+def test_labels(labels, labelset):
+    assert perfservcore.openmetricslabels(labels) == labelset
+
+
+@pytest.mark.parametrize('value, text', [(3, '3'), (2.0, '2'), (0.25, '0.25'), (float('nan'), 'NaN'),
+                                         (2.0 ** 60, '1.152921504606847e+18')])
+def test_values(value, text):
+    assert perfservcore.openmetricsvalue(value) == text
+
+
+def test_gauge_family(exposition):
+    lines = family(exposition, 'was_heap_size_bytes')
+    assert lines[:3] == ['# TYPE was_heap_size_bytes gauge', '# UNIT was_heap_size_bytes bytes',
+                         '# HELP was_heap_size_bytes Maximum JVM heap size']
+    assert lines[3] == 'was_heap_size_bytes{cell="cell",node="node0",server="server0"} 1073741824'
+    assert len(lines) == 3 + 15
+
+
+def test_counter_samples_are_total(exposition):
+    lines = family(exposition, 'was_sib_messages_consumed')
+    assert lines[:2] == ['# TYPE was_sib_messages_consumed counter',
+                         '# HELP was_sib_messages_consumed Messages consumed from the SIB destination']
+    assert lines[2] == 'was_sib_messages_consumed_total{cell="cell",node="node0",server="server0",destination="Q0",' \
+                       'messaging_engine="me0",type="queue"} 756589'
+    assert all(line.startswith('was_sib_messages_consumed_total{') for line in lines[2:])
+
+
+def test_cell_samples_and_eof(exposition):
+    assert family(exposition, 'was_snapshot_servers')[-1] == 'was_snapshot_servers{cell="cell"} 15'
+    assert exposition[-2:] == ['was_snapshot_collected_timestamp_seconds{cell="cell"} 1000', '# EOF']
+    # Families without any sample are left out
+    assert '# TYPE was_extra gauge' not in exposition
+
+
+def test_render_is_cached(path, monkeypatch):
+    rendered = []
+
+    def renderopenmetrics(cellname, snapshot):
+        rendered.append(snapshot.generation)
+        return 'generation {}\n'.format(snapshot.generation).encode('utf-8')
+    monkeypatch.setattr(perfservcore, 'renderopenmetrics', renderopenmetrics)
+    servers = perfservbench.makecell(20)
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    exporter = perfservcore.PerfMetricsExporter(path, 'cell')
+    assert exporter.render() == b'generation 1\n'
+    assert exporter.render() == b'generation 1\n'
+    assert gzip.decompress(exporter.render(gzipped=True)) == b'generation 1\n'
+    assert rendered == [1]
+    # A delta file is a new snapshot as well
+    servers[0].heapusedMB += 1
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    assert exporter.render() == b'generation 2\n'
+    assert exporter.render() == b'generation 2\n'
+    assert rendered == [1, 2]
+
+
+def test_missing_snapshot(path):
+    with pytest.raises(OSError):
+        perfservcore.PerfMetricsExporter(path, 'cell').render()
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+
+import pytest
+
+import perfservbench
+import perfservcore
+from conftest import DATADIR
+
+
+def readbaseline():
+    """The show check results of the data/cell.xml servers, as the perfservmon shelve release reported them"""
+    with open(os.path.join(DATADIR, 'baseline.json')) as baselinefile:
+        return json.load(baselinefile)
+
+
+def serialservers(data):
+    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(data))
+    return responsestatus, list(servers)
+
+
+def parallelservers(data, workers):
+    responsestatus, servers = perfservcore.readperfxmlparallel(data, workers)
+    return responsestatus, list(servers)
+
+
+def assertbaseline(servers):
+    servers = dict((was.serverfullname(), was) for was in servers)
+    for query in readbaseline():
+        serverfullname = '.'.join((query['node'], query['server']))
+        result = perfservcore.queryserver(servers.get(serverfullname), serverfullname, query['metric'], 10, 50,
+                                          query.get('destination'), query.get('jndiname'))
+        assert result == (query['status'], query['message']), query
+
+
+def test_serial_parse_matches_baseline(cellxml):
+    responsestatus, servers = serialservers(cellxml)
+    assert responsestatus == 'success'
+    assert len(servers) == 15
+    assertbaseline(servers)
+
+
+@pytest.mark.parametrize('workers', [2, 3, 8])
+def test_parallel_parse_matches_baseline(cellxml, workers):
+    responsestatus, servers = parallelservers(cellxml, workers)
+    assert responsestatus == 'success'
+    assert len(servers) == 15
+    assertbaseline(servers)
+
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_parallel_parse_matches_serial_parse(workers):
+    data = ''.join(perfservbench.perfxml(perfservbench.CellShape(120, serverspernode=7))).encode('utf-8')
+    serialstatus, serial = serialservers(data)
+    parallelstatus, parallel = parallelservers(data, workers)
+    assert parallelstatus == serialstatus == 'success'
+    assert [was.serverfullname() for was in parallel] == [was.serverfullname() for was in serial]
+    assert [perfservcore.packserver(was) for was in parallel] == [perfservcore.packserver(was) for was in serial]
+
+
+def test_split_keeps_whole_servers_in_order():
+    data = ''.join(perfservbench.perfxml(perfservbench.CellShape(45, serverspernode=20))).encode('utf-8')
+    documents = perfservcore.splitperfxml(data, 8)
+    assert len(documents) > 1
+    names = []
+    for document in documents:
+        responsestatus, servers = serialservers(document)
+        assert responsestatus == 'success'
+        names.extend(was.serverfullname() for was in servers)
+    assert names == ['node{}.server{}'.format(i // 20, i) for i in range(45)]
+
+
+def test_parallel_parse_reports_failed_status():
+    data = b'<?xml version="1.0"?>\n<PerformanceMonitor responseStatus="failed" version="9.0.5.0"/>\n'
+    assert parallelservers(data, 2) == ('failed', [])
@@ -0,0 +1,110 @@
+import fcntl
+import os
+import threading
+import time
+
+import pytest
+
+import perfservbench
+import perfservcore
+
+
+@pytest.fixture
+def config(path, perfservlet):
+    with open(path + 'cells.ini', 'w') as configfile:
+        configfile.write('[cell]\nhost = 127.0.0.1\nport = {}\nretries = 0\n'.format(perfservlet.port))
+    return path + 'cells.ini'
+
+
+def refresh(path, config, ttl=60):
+    return perfservcore.refreshperfdata(path, 'cell', ttl, config)
+
+
+def stale(path, seconds=120):
+    """A snapshot collected seconds ago"""
+    perfservcore.storeperfservers(path + 'cell.snap', perfservbench.makecell(5), collected=time.time() - seconds)
+
+
+@pytest.fixture
+def lock(path):
+    """The refresh lock of the Cell, held by another process"""
+    with open(path + 'cell.refresh', 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        yield lockfile
+
+
+def test_fresh_snapshot(path, config, perfservlet):
+    stale(path, 10)
+    assert refresh(path, config) is None
+    assert perfservlet.requests == []
+
+
+def test_stale_snapshot(path, config, perfservlet):
+    stale(path)
+    status, message = refresh(path, config)
+    assert status == perfservcore.OK
+    assert len(perfservlet.requests) == 1
+    assert perfservcore.snapshotage(path + 'cell.snap') < 10
+    # The lock is released
+    assert refresh(path, config) is None
+
+
+def test_no_snapshot(path, config, perfservlet):
+    assert refresh(path, config)[0] == perfservcore.OK
+    assert len(perfservlet.requests) == 1
+
+
+def test_lock_held_with_a_previous_snapshot(path, config, perfservlet, lock):
+    stale(path)
+    started = time.time()
+    # The previous snapshot is served right away
+    assert refresh(path, config) is None
+    assert time.time() - started < 0.5
+    assert perfservlet.requests == []
+
+
+def retrieved(path, lock, delay):
+    """The other process stores a snapshot and releases the lock after delay seconds"""
+    def retrieve():
+        time.sleep(delay)
+        stale(path, 0)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    thread = threading.Thread(target=retrieve)
+    thread.start()
+    return thread
+
+
+def test_lock_held_without_a_snapshot(path, config, perfservlet, lock):
+    thread = retrieved(path, lock, 0.3)
+    started = time.time()
+    # Waits for the other retrieval, whose snapshot is then fresh
+    assert refresh(path, config) is None
+    assert time.time() - started >= 0.3
+    thread.join()
+    assert perfservlet.requests == []
+
+
+def test_age_rechecked_after_the_lock(path, config, perfservlet, monkeypatch):
+    stale(path)
+    ages = []
+    snapshotage = perfservcore.snapshotage
+
+    def racingsnapshotage(snapshotfilename):
+        ages.append(snapshotage(snapshotfilename))
+        if len(ages) == 1:
+            # Another process retrieves between the first age check and the lock
+            stale(path, 0)
+        return ages[-1]
+    monkeypatch.setattr(perfservcore, 'snapshotage', racingsnapshotage)
+    assert refresh(path, config) is None
+    assert len(ages) == 2
+    assert ages[0] > 60 > ages[1]
+    assert perfservlet.requests == []
+
+
+def test_unknown_cell(path, config, perfservlet):
+    stale(path)
+    assert perfservcore.refreshperfdata(path, 'cell', 60, path + 'nocells.ini')[0] == perfservcore.UNKNOWN
+    os.rename(path + 'cell.snap', path + 'other.snap')
+    assert perfservcore.refreshperfdata(path, 'other', 60, config) == \
+        (perfservcore.UNKNOWN, 'Cell other is not defined in {}'.format(config))
@@ -0,0 +1,121 @@
+import gzip
+import io
+import socket
+import ssl
+import time
+import zlib
+
+import pytest
+
+import perfservcore
+
+
+class Response:
+    """An http response sending the body in chunks"""
+
+    def __init__(self, body, encoding=None, chunksize=1000, will_close=False):
+        self.status = 200
+        self.body = io.BytesIO(body)
+        self.encoding = encoding
+        self.chunksize = chunksize
+        self.will_close = will_close
+
+    def getheader(self, name):
+        return self.encoding if name == 'Content-Encoding' else None
+
+    def read(self, size):
+        return self.body.read(min(size, self.chunksize))
+
+
+class Connection:
+    sock = None
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+XML = b''.join(b'<Stat name="stat%d"/>' % i for i in range(5000))
+
+
+def respond(body, encoding=None, deadline=None, **kwargs):
+    pool = perfservcore.PerfServletConnections()
+    response = perfservcore.PerfServletResponse(pool, 'endpoint', Connection(), Response(body, encoding, **kwargs),
+                                                time.time() + 10 if deadline is None else deadline)
+    return pool, response
+
+
+def rawdeflate(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize('encoding, body', [
+    (None, XML),
+    ('gzip', gzip.compress(XML)),
+    ('deflate', zlib.compress(XML)),
+    # Some servers send deflate content without the zlib header
+    ('deflate', rawdeflate(XML)),
+    ('GZIP', gzip.compress(XML)),
+])
+def test_decompressed_while_read(encoding, body):
+    pool, response = respond(body, encoding)
+    assert response.read() == XML
+    assert (response.transferbytes, response.xmlbytes) == (len(body), len(XML))
+
+
+def test_small_reads():
+    pool, response = respond(gzip.compress(XML), 'gzip', chunksize=100)
+    data = b''.join(iter(lambda: response.read(64), b''))
+    assert data == XML
+
+
+def test_corrupt_deflate_after_the_first_chunk():
+    body = zlib.compress(XML)
+    pool, response = respond(body[:500] + b'\xff' * 500 + body[1000:], 'deflate', chunksize=500)
+    with pytest.raises(zlib.error):
+        response.read()
+
+
+def test_deadline():
+    pool, response = respond(XML, chunksize=100)
+    response.read(100)
+    response.deadline = time.time() - 1
+    with pytest.raises(socket.timeout):
+        response.read(100)
+
+
+def test_connection_returns_to_the_pool():
+    pool, response = respond(XML)
+    response.read()
+    response.close()
+    assert pool.idle == {'endpoint': [response.connection]}
+
+
+def test_partly_read_response_closes_the_connection():
+    pool, response = respond(XML)
+    response.read(10)
+    response.close()
+    assert pool.idle == {}
+    assert response.connection.closed
+
+
+def test_closing_response_closes_the_connection():
+    pool, response = respond(XML, will_close=True)
+    response.read()
+    response.close()
+    assert pool.idle == {}
+    assert response.connection.closed
+
+
+def test_certificates_are_verified():
+    connection = perfservcore.PerfServletConnections().connect('https', 'dmgr', '9443', False, 10)
+    assert connection._context.verify_mode == ssl.CERT_REQUIRED
+    assert connection._context.check_hostname
+
+
+def test_ignorecert():
+    connection = perfservcore.PerfServletConnections().connect('https', 'dmgr', '9443', True, 10)
+    assert connection._context.verify_mode == ssl.CERT_NONE
+    assert not connection._context.check_hostname
+    assert connection._context.protocol == ssl.PROTOCOL_TLS_CLIENT
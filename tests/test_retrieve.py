@@ -0,0 +1,131 @@
+import json
+import time
+
+import pytest
+
+import perfservcore
+import perfservshow
+
+
+@pytest.fixture
+def nosleep(monkeypatch):
+    """Retry right away instead of after the backoff"""
+    monkeypatch.setattr(perfservcore.time, 'sleep', lambda seconds: None)
+
+
+def test_retrieve(path, retrieve, breaker):
+    status, message = retrieve()
+    assert status == perfservcore.OK
+    assert message.startswith('PerfServlet Data refreshed on ')
+    assert ' servers=15 ' in message
+    assert breaker() is None
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert snapshot.count == 15
+
+
+def test_server_errors_are_retried(perfservlet, nosleep, retrieve, breaker):
+    perfservlet.behaviours[None] = 503
+    status, message = retrieve(retries=2)
+    assert status == perfservcore.CRITICAL
+    assert message == 'Could not open perfservlet URL - Response Status Code 503 after 3 attempts'
+    assert len(perfservlet.requests) == 3
+    assert breaker()['failures'] == 1
+
+
+def test_client_errors_are_not_retried(perfservlet, nosleep, retrieve):
+    perfservlet.behaviours[None] = 401
+    assert retrieve(retries=2) == \
+        (perfservcore.CRITICAL, 'Could not open perfservlet URL - Response Status Code 401')
+    assert len(perfservlet.requests) == 1
+
+
+def test_retry_succeeds(perfservlet, monkeypatch, retrieve):
+    def sleep(seconds):
+        # The endpoint recovers during the backoff
+        perfservlet.behaviours[None] = 'ok'
+    monkeypatch.setattr(perfservcore.time, 'sleep', sleep)
+    perfservlet.behaviours[None] = 502
+    status, message = retrieve(retries=2)
+    assert status == perfservcore.OK
+    assert ' attempts=2' in message
+
+
+def test_invalid_xml(perfservlet, retrieve, breaker):
+    perfservlet.behaviours[None] = 'invalid'
+    status, message = retrieve()
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('Invalid perfservlet XML - ')
+    assert breaker()['failures'] == 1
+    assert breaker()['error'] == message
+
+
+def test_failed_cell(perfservlet, retrieve, breaker):
+    retrieve(retries=0, breakerthreshold=5)
+    perfservlet.behaviours[None] = 503
+    retrieve(retries=0)
+    perfservlet.behaviours[None] = 'failed'
+    assert retrieve() == (perfservcore.CRITICAL, 'Error retrieving PMI data! Check your Cell status!')
+    # The endpoint itself answered
+    assert breaker() is None
+
+
+def test_failed_cell_is_not_parsed(monkeypatch, retrieve):
+    parsed = []
+
+    def partitions():
+        parsed.append(True)
+        yield from ()
+    monkeypatch.setattr(perfservcore, 'readperfxmlparallel',
+                        lambda data, workers, stats, statindex: ('failed', partitions()))
+    assert retrieve(parseworkers=2) == \
+        (perfservcore.CRITICAL, 'Error retrieving PMI data! Check your Cell status!')
+    # The whole response is already downloaded, the worker processes are not started
+    assert parsed == []
+
+
+def test_deadline(perfservlet, retrieve):
+    perfservlet.behaviours[None] = 2.0
+    started = time.time()
+    status, message = retrieve(timeout=1)
+    assert status == perfservcore.CRITICAL
+    assert time.time() - started < 1.8
+
+
+def cooldown(path, breaker):
+    """Let the open circuit breaker cool down"""
+    state = breaker()
+    state['retryat'] = time.time() - 1
+    with open(path + 'cell.breaker', 'w') as breakerfile:
+        json.dump(state, breakerfile)
+
+
+def test_breaker_opens_and_probes(path, perfservlet, nosleep, retrieve, breaker):
+    perfservlet.behaviours[None] = 503
+    for failures in (1, 2):
+        assert retrieve(retries=1, breakerthreshold=2)[0] == perfservcore.CRITICAL
+        assert breaker()['failures'] == failures
+    assert len(perfservlet.requests) == 4
+    status, message = retrieve(retries=1, breakerthreshold=2)
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('Perfservlet circuit breaker open after 2 failed retrievals, next attempt in ')
+    assert len(perfservlet.requests) == 4
+    # Once cooled down, a single attempt probes the endpoint and a failed probe doubles the cooldown
+    cooldown(path, breaker)
+    assert retrieve(retries=1, breakerthreshold=2, breakercooldown=60)[0] == perfservcore.CRITICAL
+    assert len(perfservlet.requests) == 5
+    assert breaker()['failures'] == 3
+    assert breaker()['retryat'] - time.time() > 110
+    perfservlet.behaviours[None] = 'ok'
+    cooldown(path, breaker)
+    assert retrieve(retries=1, breakerthreshold=2)[0] == perfservcore.OK
+    assert breaker() is None
+
+
+def test_last_good_data(path, perfservlet, nosleep, retrieve):
+    retrieve()
+    perfservlet.behaviours[None] = 503
+    retrieve(retries=0)
+    retrieve(retries=0)
+    status, message = perfservshow.queryperfdata(path, 'cell', 'node0', 'server0', 'Heap', 80, 90)
+    assert status == perfservcore.OK
+    assert message.startswith('Last good metrics collected 0 seconds ago, the 2 retrievals since failed - Heap Usage')
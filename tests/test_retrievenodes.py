@@ -0,0 +1,132 @@
+import os
+import time
+
+import pytest
+
+import perfservcore
+
+
+@pytest.fixture
+def retrieve(retrieve):
+    """Retrieve the Cell by its Nodes, once it is known, without retries"""
+    def retrievenodes(**kwargs):
+        kwargs.setdefault('retries', 0)
+        return retrieve(nodeworkers=4, **kwargs)
+    return retrievenodes
+
+
+def snapshot(path):
+    """The servers of the snapshot file by serverfullname"""
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as perffile:
+        return dict((serverfullname, perffile.get(serverfullname)) for serverfullname in perffile.keys())
+
+
+def age(path, seconds, *names):
+    """Make the files of the Cell older"""
+    for name in names:
+        past = time.time() - seconds
+        os.utime(path + 'cell.' + name, (past, past))
+
+
+@pytest.fixture
+def sharded(perfservlet, retrieve):
+    """A whole Cell retrieval was done, the next ones are sharded by its Nodes"""
+    assert retrieve()[0] == perfservcore.OK
+    assert perfservlet.nodes() == [None]
+    del perfservlet.requests[:]
+    return perfservlet
+
+
+def test_nodes_of_the_whole_cell_retrieval(path, retrieve):
+    retrieve()
+    with open(path + 'cell.nodes') as nodesfile:
+        assert nodesfile.read().split() == ['node0', 'node1', 'node2']
+
+
+def test_sharded_retrieval(path, sharded, retrieve):
+    whole = snapshot(path)
+    status, message = retrieve()
+    assert status == perfservcore.OK
+    assert message.startswith('PerfServlet Data of 3 Nodes refreshed on ')
+    assert message.endswith(' nodes=3 failednodes=0')
+    assert sorted(sharded.nodes()) == ['node0', 'node1', 'node2']
+    assert all('refreshConfig' not in url for url in sharded.requests)
+    assert sorted(snapshot(path)) == sorted(whole)
+
+
+def test_failed_node_keeps_its_servers(path, sharded, retrieve, breaker):
+    before = snapshot(path)
+    sharded.behaviours['node1'] = 503
+    status, message = retrieve()
+    assert status == perfservcore.WARNING
+    lines = message.splitlines()
+    assert lines[0].startswith('PerfServlet Data of 2/3 Nodes refreshed on ')
+    assert 'the servers of node1 kept from the previous retrieval|' in lines[0]
+    assert lines[0].endswith(' nodes=3 failednodes=1')
+    assert lines[1:] == ['node1: Could not open perfservlet URL - Response Status Code 503']
+    after = snapshot(path)
+    assert sorted(after) == sorted(before)
+    assert [name for name in after if name.startswith('node1.')]
+    # Some Nodes answered, the endpoint works
+    assert breaker() is None
+
+
+def test_all_nodes_failed(sharded, retrieve, breaker):
+    for nodename in ('node0', 'node1', 'node2'):
+        sharded.behaviours[nodename] = 503
+    status, message = retrieve()
+    assert status == perfservcore.CRITICAL
+    assert message.splitlines()[0] == 'All the 3 Nodes of the Cell failed'
+    assert breaker()['failures'] == 1
+
+
+def test_invalid_node_xml_counts_as_failure(path, sharded, retrieve, breaker):
+    before = snapshot(path)
+    sharded.behaviours['node2'] = 'invalid'
+    status, message = retrieve()
+    assert status == perfservcore.WARNING
+    assert message.splitlines()[1].startswith('node2: Invalid perfservlet XML - ')
+    assert sorted(snapshot(path)) == sorted(before)
+    assert breaker()['failures'] == 1
+    assert breaker()['error'].startswith('Node node2 - Invalid perfservlet XML - ')
+    del sharded.behaviours['node2']
+    assert retrieve()[0] == perfservcore.OK
+    assert breaker() is None
+
+
+def test_open_breaker_fails_fast(sharded, retrieve):
+    for nodename in ('node0', 'node1', 'node2'):
+        sharded.behaviours[nodename] = 503
+    retrieve(breakerthreshold=1)
+    del sharded.requests[:]
+    status, message = retrieve(breakerthreshold=1)
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('Perfservlet circuit breaker open after 1 failed retrievals')
+    assert sharded.requests == []
+
+
+def test_config_reload_on_a_miss(path, sharded, retrieve):
+    age(path, 60, 'lck', 'nodes')
+    perfservcore.touch(path + 'cell.miss')
+    assert retrieve(refreshfloor=30)[0] == perfservcore.OK
+    # A single whole Cell request reloads the config for all the Nodes
+    assert sharded.nodes() == [None]
+    assert 'refreshConfig=true' in sharded.requests[0]
+    del sharded.requests[:]
+    assert retrieve(refreshfloor=30)[0] == perfservcore.OK
+    assert sorted(sharded.nodes()) == ['node0', 'node1', 'node2']
+    assert all('refreshConfig' not in url for url in sharded.requests)
+
+
+def test_config_reload_after_the_ceiling(path, sharded, retrieve):
+    # The Node list is recent, the last config reload is not
+    age(path, 120, 'lck')
+    assert retrieve(refreshceiling=60)[0] == perfservcore.OK
+    assert sharded.nodes() == [None]
+    assert 'refreshConfig=true' in sharded.requests[0]
+
+
+def test_miss_within_the_floor(path, sharded, retrieve):
+    perfservcore.touch(path + 'cell.miss')
+    assert retrieve(refreshfloor=300)[0] == perfservcore.OK
+    assert sorted(sharded.nodes()) == ['node0', 'node1', 'node2']
@@ -0,0 +1,171 @@
+import os
+import shutil
+
+import perfservbench
+import perfservcore
+
+
+def readall(snapshotfilename):
+    """The packed records of the snapshot file by serverfullname, with the delta file overlaid"""
+    with perfservcore.PerfSnapshotReader(snapshotfilename) as snapshot:
+        return dict((serverfullname, perfservcore.packserver(snapshot.get(serverfullname)))
+                    for serverfullname in snapshot.keys())
+
+
+def packall(servers):
+    return dict((was.serverfullname(), perfservcore.packserver(was)) for was in servers)
+
+
+def test_roundtrip(path):
+    servers = perfservbench.makecell(50)
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers, collected=1000.0) == (50, 0)
+    assert readall(path + 'cell.snap') == packall(servers)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert list(snapshot.keys()) == sorted(was.serverfullname() for was in servers)
+        assert snapshot.collected == 1000.0
+        assert 'node0.server0' in snapshot
+        assert snapshot.get('node0.nosuchserver') is None
+        heap = dict(zip(snapshot.keys(), snapshot.column('Heap')))
+    assert heap == dict((was.serverfullname(), perfservcore.columnvalues(was)[0]) for was in servers)
+
+
+def store(snapshotfilename, servers, collected):
+    """Store the servers with their derived values, as a collection keeping a history does"""
+    with perfservcore.PerfSnapshotWriter(snapshotfilename, collected, derived=True) as snapshot:
+        for was in servers:
+            snapshot.add(was)
+    return snapshot.changed, snapshot.skipped
+
+
+def test_unchanged_servers_are_skipped(path):
+    servers = perfservbench.makecell(50)
+    perfservcore.storeperfservers(path + 'cell.snap', servers, collected=1000.0)
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers, collected=1060.0) == (0, 50)
+    # The current generation is kept, collected again
+    assert not os.path.exists(path + 'cell.delta')
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert snapshot.generation == snapshot.basegeneration == 1
+        assert snapshot.collected == 1060.0
+    assert readall(path + 'cell.snap') == packall(servers)
+
+
+def test_delta_overlay(path):
+    servers = perfservbench.makecell(50)
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    snapshotsize = os.path.getsize(path + 'cell.snap')
+    for was in servers[:5]:
+        was.heapusedMB += 100
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers) == (5, 45)
+    assert os.path.getsize(path + 'cell.snap') == snapshotsize
+    assert os.path.exists(path + 'cell.delta')
+    assert readall(path + 'cell.snap') == packall(servers)
+    # Compared to the current generation, the servers of the delta file are unchanged
+    deltasize = os.path.getsize(path + 'cell.delta')
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers, collected=2000.0) == (0, 50)
+    assert os.path.getsize(path + 'cell.delta') == deltasize
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert (snapshot.generation, snapshot.collected) == (2, 2000.0)
+    # The delta file holds all the servers differing from the base snapshot, only the last one changed
+    servers[5].heapusedMB += 100
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers) == (1, 49)
+    assert readall(path + 'cell.snap') == packall(servers)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert (snapshot.generation, snapshot.delta.count) == (3, 6)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        heap = dict(zip(snapshot.keys(), snapshot.column('Heap')))
+    assert heap == dict((was.serverfullname(), perfservcore.columnvalues(was)[0]) for was in servers)
+    # Without the overlay, the base snapshot is left as first written
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap', overlay=False) as snapshot:
+        assert snapshot.get(servers[0].serverfullname()).heapusedMB == servers[0].heapusedMB - 100
+
+
+def test_many_changes_replace_the_snapshot(path):
+    servers = perfservbench.makecell(50)
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    for was in servers[:5]:
+        was.heapusedMB += 1
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    for was in servers[:40]:
+        was.webSecAuthenTime += 1
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers) == (40, 10)
+    assert not os.path.exists(path + 'cell.delta')
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert snapshot.generation == snapshot.basegeneration == 3
+    assert readall(path + 'cell.snap') == packall(servers)
+
+
+def test_removed_and_added_servers(path):
+    servers = perfservbench.makecell(50)
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    servers[0].heapusedMB += 1
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers[1:]) == (0, 49)
+    assert not os.path.exists(path + 'cell.delta')
+    assert readall(path + 'cell.snap') == packall(servers[1:])
+    assert perfservcore.storeperfservers(path + 'cell.snap', servers) == (1, 49)
+    assert readall(path + 'cell.snap') == packall(servers)
+
+
+def test_stale_delta_is_ignored(path):
+    servers = perfservbench.makecell(20)
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    servers[0].heapusedMB += 1
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    shutil.copy(path + 'cell.delta', path + 'stale.delta')
+    for was in servers:
+        was.heapusedMB += 1
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    # A delta file left behind by a previous base snapshot
+    shutil.copy(path + 'stale.delta', path + 'cell.delta')
+    assert readall(path + 'cell.snap') == packall(servers)
+
+
+def test_derived_values_do_not_change_the_digest(path):
+    servers = perfservbench.makecell(20)
+    for collected in (1000.0, 1060.0, 1120.0):
+        for was in servers:
+            was.rates['ThreadsHung'] = collected
+            was.aggregates['Window'] = collected
+        changed, skipped = store(path + 'cell.snap', servers, collected)
+        with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+            was = snapshot.get('node0.server3')
+        assert was.rates == {'ThreadsHung': collected}
+        assert was.aggregates == {'Window': collected}
+    assert (changed, skipped) == (0, 20)
+
+
+def test_history_collection_skips_idle_servers(path):
+    servers = perfservbench.makecell(20)
+    for collected in (1000.0, 1060.0, 1120.0):
+        stored = perfservcore.storeperfservers(path + 'cell.snap', servers, collected,
+                                               historyfilename=path + 'cell.hist', historysamples=10, window=300)
+    assert stored == (0, 20)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        was = snapshot.get(servers[0].serverfullname())
+    assert was.rates['ThreadsHungInterval'] == 60.0
+    assert was.aggregates['Window'] == 300
+
+
+def test_derived_values_only_with_a_history(path):
+    servers = perfservbench.makecell(20)
+    for was in servers:
+        was.rates['ThreadsHung'] = 1.0
+    perfservcore.storeperfservers(path + 'cell.snap', servers)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert not snapshot.derivedoffset
+        assert snapshot.get('node0.server3').rates == {}
+
+
+def test_unchanged_derived_values_keep_the_generation(path):
+    servers = perfservbench.makecell(20)
+    for was in servers:
+        was.rates['ThreadsHung'] = 1.0
+    store(path + 'cell.snap', servers, 1000.0)
+    assert store(path + 'cell.snap', servers, 1060.0) == (0, 20)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert (snapshot.generation, snapshot.collected) == (1, 1060.0)
+    # Without a history any more, a new generation drops them
+    perfservcore.storeperfservers(path + 'cell.snap', servers, 1120.0)
+    with perfservcore.PerfSnapshotReader(path + 'cell.snap') as snapshot:
+        assert snapshot.generation == 2
+        assert snapshot.get('node0.server3').rates == {}
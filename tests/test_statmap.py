@@ -0,0 +1,124 @@
+import io
+
+import pytest
+
+import perfservcore
+import perfservshow
+
+STATMAP = """
+[WebContainerActive]
+path = Thread Pools/WebContainer
+statistic = ActiveCount
+attribute = value
+
+[UsedMemory]
+path = JVM Runtime
+statistic = UsedMemory
+
+[PoolUseTime]
+path = JDBC Connection Pools/*/*
+statistic = UseTime
+attribute = max
+
+[Live]
+path = Servlet Session Manager/*
+statistic = LiveCount
+"""
+
+
+@pytest.fixture
+def statmap(path):
+    with open(path + 'statmap.ini', 'w') as statmapfile:
+        statmapfile.write(STATMAP)
+    return path + 'statmap.ini'
+
+
+def parse(cellxml, statmap):
+    statindex = perfservcore.StatPathIndex(perfservcore.readstatmap(statmap))
+    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(cellxml), statindex=statindex)
+    return dict((was.serverfullname(), was) for was in servers)
+
+
+def test_readstatmap(statmap):
+    rules = perfservcore.readstatmap(statmap)
+    assert [(rule.name, rule.path, rule.statistic, rule.attribute, rule.field) for rule in rules] == [
+        ('WebContainerActive', ('Thread Pools', 'WebContainer'), 'ActiveCount', 'value', 'extras'),
+        ('UsedMemory', ('JVM Runtime',), 'UsedMemory', None, 'extras'),
+        ('PoolUseTime', ('JDBC Connection Pools', '*', '*'), 'UseTime', 'max', 'extras'),
+        ('Live', ('Servlet Session Manager', '*'), 'LiveCount', None, 'extras')]
+
+
+@pytest.mark.parametrize('statmap, error', [
+    ('[Empty]\npath = /\nstatistic = ActiveCount\n', 'Empty Stat path of extra metric Empty'),
+    ('[NoStatistic]\npath = JVM Runtime\n', "No option 'statistic' in section: 'NoStatistic'"),
+    ('path = JVM Runtime\n', 'File contains no section headers. '),
+])
+def test_invalid_statmap(path, statmap, error):
+    with open(path + 'statmap.ini', 'w') as statmapfile:
+        statmapfile.write(statmap)
+    with pytest.raises(ValueError) as excinfo:
+        perfservcore.readstatmap(path + 'statmap.ini')
+    assert str(excinfo.value).startswith(error)
+
+
+def test_missing_statmap(path):
+    with pytest.raises(IOError):
+        perfservcore.readstatmap(path + 'nostatmap.ini')
+
+
+def test_extra_metrics(cellxml, statmap):
+    was = parse(cellxml, statmap)['node0.server0']
+    assert was.extras['WebContainerActive'] == 36.0
+    # The count of the statistic, without the conversion of the built in metric
+    assert was.extras['UsedMemory'] == 141891.0
+    assert was.heapusedMB == 141891 // 1024
+    assert dict((name, value) for name, value in was.extras.items() if name.startswith('PoolUseTime:')) == \
+        {'PoolUseTime:jdbc/ds0': 30949.0, 'PoolUseTime:jdbc/ds1': 13759.0, 'PoolUseTime:jdbc/ds2': 25546.0}
+    # A * never matches the perfservlet application itself
+    assert sorted(name for name in was.extras if name.startswith('Live')) == ['Live:app#web.war']
+
+
+def test_built_in_metrics_are_kept(cellxml, statmap):
+    plain = perfservcore.readperfxml(io.BytesIO(cellxml))[1]
+    extended = parse(cellxml, statmap)
+    for was in plain:
+        extended[was.serverfullname()].extras.clear()
+        assert perfservcore.packserver(extended[was.serverfullname()]) == perfservcore.packserver(was)
+
+
+def test_path_matches_at_any_depth(cellxml):
+    statindex = perfservcore.StatPathIndex([perfservcore.StatRule(['WebContainer'], 'PoolSize', 'upperBound',
+                                                                  'extras', float, 'PoolSize')])
+    servers = list(perfservcore.readperfxml(io.BytesIO(cellxml), statindex=statindex)[1])
+    assert [was.extras for was in servers[:1]] == [{'PoolSize': 50.0}]
+
+
+def test_query_extra(cellxml, statmap):
+    was = parse(cellxml, statmap)['node0.server0']
+    assert was.querymetric('Extra', 30, 40, extra='WebContainerActive') == \
+        (perfservcore.WARNING, "WebContainerActive 36|'WebContainerActive'=36;30;40")
+    status, message = was.querymetric('Extra', 20000, 30000, extra='PoolUseTime')
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('PoolUseTime:jdbc/ds0 30949 - PoolUseTime:jdbc/ds1 13759 - ')
+
+
+def test_extra_requests_all_the_modules():
+    assert perfservcore.perfservquery(['Heap', 'ORB']) == ['module=jvmRuntimeModule+threadPoolModule']
+    assert perfservcore.perfservquery(perfservcore.metriclist('Heap,Extra')) == []
+
+
+def test_statmap_retrieves_all_the_modules(path, perfservlet, retrieve, statmap):
+    statindex = perfservcore.StatPathIndex(perfservcore.readstatmap(statmap))
+    assert retrieve(metrics=['Heap'], statindex=statindex)[0] == perfservcore.OK
+    assert 'module=' not in perfservlet.requests[0]
+    assert perfservshow.queryperfdata(path, 'cell', 'node0', 'server0', 'Extra', 40, 48,
+                                      extra='WebContainerActive')[0] == perfservcore.OK
+
+
+def test_batch_extra(path, cellxml, statmap):
+    perfservcore.storeperfservers(path + 'cell.snap', parse(cellxml, statmap).values())
+    batchfile = io.StringIO('host;Pool;node0;server0;Extra;30;40;;;WebContainerActive\n')
+    checks = list(perfservshow.readbatchchecks(batchfile))
+    assert checks[0].extra == 'WebContainerActive'
+    assert [result for check, result in perfservshow.querybatchperfdata(path, 'cell', checks)] == \
+        [(perfservcore.WARNING, "WebContainerActive 36|'WebContainerActive'=36;30;40")]
@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+import perfservcore
+
+
+@pytest.fixture
+def servers(cellxml):
+    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(cellxml))
+    return dict((was.serverfullname(), was) for was in servers)
+
+
+def test_missing_server(servers):
+    assert perfservcore.topologymiss(servers.get('node0.nosuchserver'), 'Heap')
+
+
+def test_missing_connection_pool(servers):
+    was = servers['node0.server0']
+    assert not perfservcore.topologymiss(was, 'DBConnectionPoolPercentUsed', jndiname='jdbc/ds1')
+    assert not perfservcore.topologymiss(was, 'DBConnectionPoolPercentUsed', jndiname='jdbc/*')
+    assert perfservcore.topologymiss(was, 'DBConnectionPoolPercentUsed', jndiname='jdbc/new')
+    assert perfservcore.topologymiss(was, 'DBConnectionPoolWaitTime', jndiname='new/*')
+
+
+def test_missing_destination(servers):
+    was = servers['node0.server0']
+    assert was.destinations
+    assert not perfservcore.topologymiss(was, 'SIBDestinations', destination='Q1')
+    assert not perfservcore.topologymiss(was, 'SIBDestinations', destination='Q*')
+    assert perfservcore.topologymiss(was, 'SIBDestinations', destination='NEWQUEUE')
+    assert perfservcore.topologymiss(was, 'SIBDestinations', destination='NEW*')
+
+
+def test_inactive_messaging_engine_is_no_miss(servers):
+    was = servers['node0.server1']
+    assert was.messageengines and not was.destinations
+    assert not perfservcore.topologymiss(was, 'SIBDestinations', destination='Q1')
+
+
+def test_no_messaging_engine_is_no_miss():
+    was = perfservcore.TypicalApplicationServer('server1', 'node1')
+    assert not perfservcore.topologymiss(was, 'SIBDestinations', destination='Q1')
@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+import perfservcore
+
+
+@pytest.fixture
+def was(cellxml):
+    responsestatus, servers = perfservcore.readperfxml(io.BytesIO(cellxml))
+    return dict((was.serverfullname(), was) for was in servers)['node0.server0']
+
+
+@pytest.mark.parametrize('pattern, names', [
+    ('jdbc/ds1', ['jdbc/ds1']),
+    ('jdbc/nope', []),
+    ('jdbc/*', ['jdbc/ds0', 'jdbc/ds1', 'jdbc/ds2']),
+    ('jdbc/ds?', ['jdbc/ds0', 'jdbc/ds1', 'jdbc/ds2']),
+    ('jdbc/ds[!0]', ['jdbc/ds1', 'jdbc/ds2']),
+    ('JDBC/*', []),
+])
+def test_matchnames(pattern, names):
+    assert perfservcore.matchnames(['jdbc/ds2', 'jdbc/ds0', 'jdbc/ds1'], pattern) == names
+
+
+def test_connection_pools(was):
+    assert dict(was.connpoolspercentused) == {'jdbc/ds0': 97, 'jdbc/ds1': 48, 'jdbc/ds2': 62}
+    assert was.querymetric('DBConnectionPoolPercentUsed', 10, 50, jndi='jdbc/*') == \
+        (perfservcore.CRITICAL, 'DB Connection Pool Percent Used top 3 of 3 pools jdbc/*: jdbc/ds0 97%, jdbc/ds2 62%, '
+                               'jdbc/ds1 48%|jdbc/ds0_usage=97%;10;50;0 jdbc/ds1_usage=48%;10;50;0 '
+                               'jdbc/ds2_usage=62%;10;50;0')
+
+
+def test_connection_pools_top(was):
+    status, message = was.querymetric('DBConnectionPoolPercentUsed', 50, 70, jndi='jdbc/ds[12]', top=1)
+    assert status == perfservcore.WARNING
+    # The message reports the worst match, the perfdata all the matches
+    assert message == 'DB Connection Pool Percent Used top 1 of 2 pools jdbc/ds[12]: jdbc/ds2 62%|' \
+                      'jdbc/ds1_usage=48%;50;70;0 jdbc/ds2_usage=62%;50;70;0'
+
+
+def test_connection_pools_without_match(was):
+    assert was.querymetric('DBConnectionPoolPercentUsed', 10, 50, jndi='nope/*') == \
+        (perfservcore.UNKNOWN, 'No DB Connection Pool matching nope/* was found')
+
+
+@pytest.mark.parametrize('metric', ['DBConnectionPoolUseTime', 'DBConnectionPoolWaitTime',
+                                    'DBConnectionPoolWaitingThreadCount'])
+def test_connection_pool_metrics(was, metric):
+    status, message = was.querymetric(metric, 10 ** 6, 10 ** 7, jndi='jdbc/*')
+    assert status == perfservcore.OK
+    assert ' top 3 of 3 pools jdbc/*: ' in message
+    # A single pool is checked as before
+    assert was.querymetric(metric, 10 ** 6, 10 ** 7, jndi='jdbc/ds1')[1] != message
+
+
+def test_destinations(was):
+    status, message = was.querymetric('SIBDestinations', 10, 50, destination='Q?', top=2)
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('SIB Destinations Available Messages top 2 of 4 destinations Q?: Q2 81, Q0 58|')
+    assert message.split('|')[1].split() == ['Q0_AvailMsgs=58;10;50;0', 'Q0_ConsumMsgs=756589;;;0',
+                                             'Q1_AvailMsgs=26;10;50;0', 'Q1_ConsumMsgs=619869;;;0',
+                                             'Q2_AvailMsgs=81;10;50;0', 'Q2_ConsumMsgs=945215;;;0',
+                                             'Q3_AvailMsgs=5;10;50;0', 'Q3_ConsumMsgs=32075;;;0']
+
+
+def test_destinations_worst_status_first(was):
+    status, message = was.querymetric('SIBDestinations', 20, 70, destination='*', top=1)
+    assert status == perfservcore.CRITICAL
+    assert message.startswith('SIB Destinations Available Messages top 1 of 5 destinations *: Q2 81|')
+
+
+def test_destinations_without_match(was):
+    assert was.querymetric('SIBDestinations', 10, 50, destination='NONE*') == \
+        (perfservcore.UNKNOWN, 'No SIB Destination matching NONE* was found for server server0')
+
+
+@pytest.mark.parametrize('warning, critical, status', [
+    (10, 58, perfservcore.CRITICAL),
+    (57, 100, perfservcore.WARNING),
+    (58, 100, perfservcore.OK),
+])
+def test_destination_thresholds(was, warning, critical, status):
+    # Q0 holds 58 available messages, the single destination and the wildcard checks agree on the thresholds
+    assert was.querymetric('SIBDestinations', warning, critical, destination='Q0')[0] == status
+    assert was.querymetric('SIBDestinations', warning, critical, destination='Q0*')[0] == status